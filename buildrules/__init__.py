@@ -1,15 +1,54 @@
 # -*- coding: utf-8 -*-
 """buildrules contains various build setups.
+
+Builders are imported only when they are used, so that the dependencies of
+one builder do not slow down the startup of others.
 """
-from buildrules.anaconda import AnacondaBuilder
-from buildrules.ci import CIBuilder
-from buildrules.spack import SpackBuilder
-from buildrules.singularity import SingularityBuilder
+from collections.abc import Mapping
+from importlib import import_module
+
+
+class BuilderRegistry(Mapping):
+    """BuilderRegistry maps builder names to builder classes. Module of a
+    builder is imported when the builder class is first requested.
+
+    Args:
+        builders (dict): Dictionary of builder names and import paths of the
+            form 'module:ClassName'.
+    """
+
+    def __init__(self, builders):
+        self._builders = dict(builders)
+        self._classes = {}
 
+    def __getitem__(self, name):
+        if name not in self._classes:
+            module_name, class_name = self._builders[name].split(':')
+            self._classes[name] = getattr(import_module(module_name), class_name)
+        return self._classes[name]
 
-BUILDERS = {
-    'anaconda': AnacondaBuilder,
-    'ci': CIBuilder,
-    'spack': SpackBuilder,
-    'singularity': SingularityBuilder
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __len__(self):
+        return len(self._builders)
+
+
+BUILDERS = BuilderRegistry({
+    'anaconda': 'buildrules.anaconda:AnacondaBuilder',
+    'ci': 'buildrules.ci:CIBuilder',
+    'spack': 'buildrules.spack:SpackBuilder',
+    'singularity': 'buildrules.singularity:SingularityBuilder'
+})
+
+_BUILDER_CLASSES = {
+    'AnacondaBuilder': 'anaconda',
+    'CIBuilder': 'ci',
+    'SpackBuilder': 'spack',
+    'SingularityBuilder': 'singularity',
 }
+
+def __getattr__(name):
+    if name in _BUILDER_CLASSES:
+        return BUILDERS[_BUILDER_CLASSES[name]]
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
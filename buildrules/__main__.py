@@ -10,13 +10,31 @@ from argparse import ArgumentParser
 import buildrules as br
 from buildrules.common.logging import get_logger
 
-def run_builder(builder, cmd, conf_folder):
+def run_builder(builder, cmd, conf_folder, jobs=1, use_stamps=True, resume=False,
+                trace_file=None, engine=None, log_dir=None, cpus=None,
+                output_format='text'):
     """runBuilder runs a Builder instance.
 
+    If builder is 'all', every builder that has a configuration folder in
+    conf_folder is run in one process with MultiBuilder.
+
     Args:
-        builder (str): Name of the builder class.
+        builder (str): Name of the builder class or 'all'.
         cmd (str): Command to run.
         conf_folder (str): Configuration folder for the builder.
+        jobs (int): Number of build rules to run concurrently. Default is 1.
+        use_stamps (bool): Skip rules completed during previous builds.
+            Default is True.
+        resume (bool): Resume a previously failed build. Default is False.
+        trace_file (str): File for the Chrome trace of the build. Default
+            is None.
+        engine (str): Execution engine for the build rules. Default is None,
+            which uses the engine from build_config.
+        log_dir (str): Folder for compressed per-rule logs. Default is None.
+        cpus (int): Number of CPU slots available for the build. Default is
+            None, which uses all CPUs of the host.
+        output_format (str): Output format of describe, 'text' or 'json'.
+            Default is 'text'.
 
     Raises:
         ValueError: When invalid configuration folder is given.
@@ -26,12 +44,18 @@ def run_builder(builder, cmd, conf_folder):
         raise ValueError(
             'Invalid configuration folder: {0}'.format(conf_folder))
 
-    builder_instance = br.BUILDERS[builder](conf_folder)
+    if builder == 'all':
+        from buildrules.common.multibuilder import MultiBuilder
+        builder_instance = MultiBuilder(conf_folder)
+    else:
+        builder_instance = br.BUILDERS[builder](conf_folder)
 
     if cmd == 'describe':
-        builder_instance.describe()
+        builder_instance.describe(output_format=output_format)
     elif cmd == 'build':
-        builder_instance()
+        builder_instance(
+            jobs=jobs, use_stamps=use_stamps, resume=resume, trace_file=trace_file,
+            engine=engine, log_dir=log_dir, cpus=cpus)
 
 
 if __name__ == "__main__":
@@ -41,8 +65,8 @@ if __name__ == "__main__":
         'builder',
         nargs=1,
         type=str,
-        help='Builder to use',
-        choices=br.BUILDERS.keys())
+        help='Builder to use or "all" to run every builder in the configuration folder',
+        choices=list(br.BUILDERS.keys()) + ['all'])
     PARSER.add_argument(
         'cmd',
         nargs=1,
@@ -62,9 +86,77 @@ if __name__ == "__main__":
         help='Logging level to use',
         default=['INFO']
         )
+    PARSER.add_argument(
+        '--format',
+        nargs=1,
+        type=str,
+        help='Output format of describe, json writes the whole build plan',
+        choices=('text', 'json'),
+        default=['text']
+        )
+    PARSER.add_argument(
+        '-j',
+        '--jobs',
+        nargs=1,
+        type=int,
+        help=('Number of build rules to run concurrently. Spack installs '
+              'run in parallel (parallel_installs in build_config.yaml) only '
+              'if this is larger than 1'),
+        default=[1]
+        )
+    PARSER.add_argument(
+        '--cpus',
+        nargs=1,
+        type=int,
+        help='Number of CPU slots that concurrent build rules can use',
+        default=[None]
+        )
+    PARSER.add_argument(
+        '--no-stamps',
+        action='store_true',
+        help='Run all build rules even if they were completed during a previous build'
+        )
+    PARSER.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume a failed build from the first incomplete build rule'
+        )
+    PARSER.add_argument(
+        '--trace',
+        nargs=1,
+        type=str,
+        help='Write a Chrome trace-event JSON of the build into this file',
+        default=[None]
+        )
+    PARSER.add_argument(
+        '--engine',
+        nargs=1,
+        type=str,
+        help='Execution engine for build rules',
+        choices=('sync', 'asyncio'),
+        default=[None]
+        )
+    PARSER.add_argument(
+        '--log-dir',
+        nargs=1,
+        type=str,
+        help='Write output of each build rule into a compressed log file in this folder',
+        default=[None]
+        )
 
     ARGS = PARSER.parse_args()
 
     get_logger(ARGS.loglevel[0])
 
-    run_builder(ARGS.builder[0], ARGS.cmd[0], os.path.expanduser(ARGS.conf_folder[0]))
+    run_builder(
+        ARGS.builder[0],
+        ARGS.cmd[0],
+        os.path.expanduser(ARGS.conf_folder[0]),
+        jobs=ARGS.jobs[0],
+        use_stamps=not ARGS.no_stamps,
+        resume=ARGS.resume,
+        trace_file=ARGS.trace[0],
+        engine=ARGS.engine[0],
+        log_dir=ARGS.log_dir[0],
+        cpus=ARGS.cpus[0],
+        output_format=ARGS.format[0])
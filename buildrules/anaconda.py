@@ -8,11 +8,11 @@ import shutil
 from glob import glob
 import json
 import copy
-import requests
-import sh
+import threading
 
-from buildrules.common.builder import Builder
-from buildrules.common.rule import PythonRule, SubprocessRule, LoggingRule, RuleError
+from buildrules.common.builder import Builder, rule_phase
+from buildrules.common.rule import (PythonRule, SubprocessRule, LoggingRule,
+                                    RuleError, chain_rules)
 from buildrules.common.utils import (load_yaml, write_yaml, makedirs,
                                      copy_file, write_template,
                                      calculate_file_checksum,
@@ -25,6 +25,12 @@ class AnacondaBuilder(Builder):
 
     BUILDER_NAME = 'Anaconda'
     CONF_FILES = ['config.yaml', 'build_config.yaml']
+
+    # Scratch class of conda commands that use the shared package cache.
+    # conda does not support concurrent writers to one package cache, so
+    # only one of them is run at a time.
+    PKGS_SCRATCH = 'conda-pkgs'
+
     SCHEMAS = [
         {
             '$schema': 'http://json-schema.org/schema#',
@@ -72,6 +78,10 @@ class AnacondaBuilder(Builder):
                         },
                     },
                 },
+                'engine': {
+                    'type': 'string',
+                    'enum': ['sync', 'asyncio'],
+                },
                 'environments': {
                     'type': 'array',
                     'default': [],
@@ -115,9 +125,13 @@ class AnacondaBuilder(Builder):
         }]
 
 
-    def __init__(self, conf_folder):
+    def __init__(self, conf_folder, deployers=None):
         self._conda_path = os.path.join(os.getcwd(), 'conda')
-        super().__init__(conf_folder)
+        # Environments can be installed concurrently, so shared files
+        # are protected with locks
+        self._installer_lock = threading.Lock()
+        self._installed_file_lock = threading.Lock()
+        super().__init__(conf_folder, deployers=deployers)
         source_cache = self._get_path('source_cache')
         self._installer_cache = os.path.join(source_cache, 'installers')
         self._pkg_cache = os.path.join(source_cache, 'pkgs')
@@ -132,6 +146,9 @@ class AnacondaBuilder(Builder):
         self._collections = self._confreader['build_config'].get(
             'collections', {})
 
+    def _get_scratch_limits(self):
+        return {self.PKGS_SCRATCH: 1}
+
 
     def _get_path(self, path_name):
         """ This function returns proper values of builder paths. All
@@ -152,6 +169,7 @@ class AnacondaBuilder(Builder):
         path_config.update(self._confreader['config']['config'])
         return re.sub('\$conda', self._conda_path, path_config[path_name])
 
+    @rule_phase
     def _get_directory_creation_rules(self):
         """ This function returns builds rules that create required directories.
 
@@ -263,13 +281,15 @@ class AnacondaBuilder(Builder):
         else:
             installer_url = "https://repo.anaconda.com/archive/{0}".format(installer)
 
-        if not os.path.isfile(installer_path):
-            self._logger.info((
-                "Installer '%s' was not found in the cache directory. "
-                "Downloading it."), installer)
-            download_request = requests.get(installer_url)
-            with open(installer_path, 'wb') as installer_file:
-                installer_file.write(download_request.content)
+        with self._installer_lock:
+            if not os.path.isfile(installer_path):
+                self._logger.info((
+                    "Installer '%s' was not found in the cache directory. "
+                    "Downloading it."), installer)
+                import requests
+                download_request = requests.get(installer_url)
+                with open(installer_path, 'wb') as installer_file:
+                    installer_file.write(download_request.content)
 
         checksum = self._confreader['build_config'].get(
             'installer_checksums', {}).get(installer, '')
@@ -385,6 +405,7 @@ class AnacondaBuilder(Builder):
         if os.path.isdir(install_path):
             self._logger.info((
                 "Cleaning previous failed installation: %s"), install_path)
+            import sh
             sh.rm('-r', '-f', install_path)
 
     def _clean_modules(self):
@@ -429,9 +450,10 @@ class AnacondaBuilder(Builder):
             environment_config (dict): Anaconda environment config.
         """
 
-        installed_dict = self._get_installed_environments()
-        installed_dict['environments'][environment_name] = environment_config
-        write_yaml(self._installed_file, installed_dict)
+        with self._installed_file_lock:
+            installed_dict = self._get_installed_environments()
+            installed_dict['environments'][environment_name] = environment_config
+            write_yaml(self._installed_file, installed_dict)
 
     def _update_condarc(self, conda_path, condarc, install_time=True):
         """ This function updates the .condarc-file located in conda_path
@@ -462,6 +484,7 @@ class AnacondaBuilder(Builder):
             conda_path (str): Anaconda installation path.
         """
 
+        import sh
         conda_cmd = sh.Command(os.path.join(conda_path, 'bin', 'conda'))
         conda_env_json = conda_cmd('env', 'export', '-n', 'base', '--json')
         conda_env_json = conda_env_json.stdout.decode('utf-8')
@@ -502,6 +525,7 @@ class AnacondaBuilder(Builder):
                 are present.
         """
 
+        import sh
         conda_cmd = sh.Command(os.path.join(conda_path, 'bin', 'conda'))
         config_json = conda_cmd('info', '--json').stdout.decode('utf-8')
         config = json.loads(config_json)
@@ -525,6 +549,7 @@ class AnacondaBuilder(Builder):
             install_mamba (bool): Should mamba be installed.
         """
 
+        import sh
         conda_cmd = sh.Command(os.path.join(conda_path, 'bin', 'conda'))
         if install_mamba:
             conda_cmd('install', '--yes',
@@ -533,6 +558,7 @@ class AnacondaBuilder(Builder):
                       '-n', 'base',
                       'mamba')
 
+    @rule_phase
     def _get_environment_install_rules(self):
         """ This function returns build rules that install Anaconda environments.
 
@@ -540,7 +566,10 @@ class AnacondaBuilder(Builder):
             list: List of build rules that install Anaconda environments.
         """
 
-        rules = []
+        # Environments are installed after all of the previous rules, but
+        # they do not depend on each other.
+        start_rule = LoggingRule('Installing environments.')
+        rules = [start_rule]
 
         # Obtain already installed environments
         installed_environments = self._get_installed_environments()['environments']
@@ -600,11 +629,12 @@ class AnacondaBuilder(Builder):
             environment_config['module_path'] = module_path
             environment_config['environment_file'] = self._get_environment_file_path(install_path)
 
-            rules.append(LoggingRule(install_msg.format(**environment_config)))
+            environment_rules = []
+            environment_rules.append(LoggingRule(install_msg.format(**environment_config)))
 
             if not skip_install:
                 # Install base environment
-                rules.extend([
+                environment_rules.extend([
                     PythonRule(self._remove_environment, [install_path]),
                     PythonRule(self._download_installer, [installer]),
                     PythonRule(
@@ -617,7 +647,7 @@ class AnacondaBuilder(Builder):
                     ),
                 ])
 
-                rules.extend([
+                environment_rules.extend([
                     # Verify no external condarc is used
                     LoggingRule('Verifying that only the environment condarc is utilized.'),
                     PythonRule(
@@ -640,7 +670,7 @@ class AnacondaBuilder(Builder):
 
                 # During update, install old packages using environment.yml
                 if update_install:
-                    rules.extend([
+                    environment_rules.extend([
                         LoggingRule(
                             ('Sanitizing environment file from previous installation '
                              '"{0}" to new installation "{1}"').format(
@@ -657,7 +687,7 @@ class AnacondaBuilder(Builder):
                              '--file', environment_config['environment_file'],
                              '--prefix', install_path],
                             env=conda_env,
-                            shell=True)])
+                            shell=True).set_resources(scratch=self.PKGS_SCRATCH)])
 
                     conda_install_cmd.append('--freeze-installed')
                     pip_install_cmd.extend([
@@ -665,17 +695,17 @@ class AnacondaBuilder(Builder):
 
                 # Install packages using conda
                 if conda_packages:
-                    rules.extend([
+                    environment_rules.extend([
                         LoggingRule('Installing conda packages.'),
                         SubprocessRule(
                             conda_install_cmd + conda_packages,
                             env=conda_env,
-                            shell=True),
+                            shell=True).set_resources(scratch=self.PKGS_SCRATCH),
                     ])
 
                 # Install packages using pip
                 if pip_packages:
-                    rules.extend([
+                    environment_rules.extend([
                         LoggingRule('Installing pip packages.'),
                         SubprocessRule(
                             pip_install_cmd + pip_packages,
@@ -684,7 +714,7 @@ class AnacondaBuilder(Builder):
                     ])
 
                 # Create environment.yml
-                rules.extend([
+                environment_rules.extend([
                     LoggingRule('Creating environment.yml from newly built environment.'),
                     PythonRule(
                         self._export_conda_environment,
@@ -692,7 +722,7 @@ class AnacondaBuilder(Builder):
                 ])
 
                 # Add newly created environment to installed environments
-                rules.extend([
+                environment_rules.extend([
                     LoggingRule('Updating installed_environments.yml.'),
                     PythonRule(
                         self._update_installed_environments,
@@ -700,13 +730,13 @@ class AnacondaBuilder(Builder):
                 ])
 
                 if update_install and self.remove_after_update:
-                    rules.extend([
+                    environment_rules.extend([
                         LoggingRule(('Removing old environment from '
                                      '{0}').format(previous_install_path)),
                         PythonRule(self._remove_environment, [previous_install_path])])
 
             # Update .condarc
-            rules.extend([
+            environment_rules.extend([
                 LoggingRule('Creating condarc for environment: %s' % environment_name),
                 PythonRule(
                     self._update_condarc,
@@ -715,15 +745,18 @@ class AnacondaBuilder(Builder):
             ])
 
             # Create modulefile for the environment
-            rules.extend([
+            environment_rules.extend([
                 LoggingRule('Creating modulefile for environment: %s' % environment_name),
                 PythonRule(
                     self._write_modulefile,
                     [environment_config['name'], environment_config['version'], install_path, module_path])
             ])
 
+            rules.extend(chain_rules(environment_rules, [start_rule]))
+
         return rules
 
+    @rule_phase
     def _get_modulefile_clean_rules(self):
         """ This function creates build rules that clean up modulefiles.
 
@@ -5,7 +5,7 @@ import os
 import logging
 import tempfile
 
-from buildrules.common.builder import Builder
+from buildrules.common.builder import Builder, rule_phase
 from buildrules.common.rule import PythonRule, SubprocessRule, LoggingRule, RuleError
 from buildrules.common.utils import makedirs, copy_file, copy_dir, write_template, write_yaml
 from shutil import rmtree
@@ -16,6 +16,8 @@ class CIBuilder(Builder):
     """
     BUILDER_NAME = 'CI'
     CONF_FILES = ['build_config.yaml']
+    # CI environment is set up before any other builders are run
+    EXCLUSIVE = True
     SCHEMAS = [{
         '$schema': 'http://json-schema.org/schema#',
         'title': 'CI environment schema',
@@ -257,9 +259,9 @@ class CIBuilder(Builder):
         ],
     }]
 
-    def __init__(self, conf_folder):
+    def __init__(self, conf_folder, deployers=None):
 
-        super().__init__(conf_folder)
+        super().__init__(conf_folder, deployers=deployers)
         self._build_folder = self._confreader['build_config'].get(
             'build_folder',
             os.path.join(os.getcwd(), 'ci'))
@@ -319,6 +321,7 @@ class CIBuilder(Builder):
     def _template_config(self, src, dest):
         write_template(src, self._confreader['build_config'], dest)
 
+    @rule_phase
     def _get_config_creation_rules(self):
         return [
             LoggingRule('Creating buildbot_master.cfg'),
@@ -382,6 +385,7 @@ class CIBuilder(Builder):
             ),
         ]
 
+    @rule_phase
     def _get_directory_creation_rules(self):
         """Creates directories for nfs"""
 
@@ -693,6 +697,7 @@ class CIBuilder(Builder):
 
         return rules
 
+    @rule_phase
     def _get_clean_build_directory_rules(self):
         """Cleans the build directory from unnecessary files after building"""
 
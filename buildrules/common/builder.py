@@ -5,15 +5,46 @@ This module contains base Builder class used by various buildrules to
 actually build software.
 """
 import os
+import re
 import sys
+import time
 import logging
 import json
+from datetime import datetime
+from functools import wraps
 
 from buildrules.common.errors import log_error_and_quit
 from buildrules.common.confreader import ConfReader
-from buildrules.common.rule import Rule, RuleError
+from buildrules.common.rule import Rule, RuleError, SubprocessRule
+from buildrules.common.scheduler import RuleScheduler, AsyncRuleScheduler
+from buildrules.common.resources import ResourcePool
+from buildrules.common.stamps import StampStore
+from buildrules.common.journal import RuleJournal
+from buildrules.common.timeline import RuleTimeline
+from buildrules.common.utils import get_cache_dir, calculate_dict_checksum
 from buildrules.common.deployer import deployer_factory, Deployer, DEPLOYMENTCONFIG_SCHEMA
 
+def rule_phase(function):
+    """rule_phase is a decorator for functions that create build rules. It
+    marks the rules created by the function as a part of a phase named after
+    the function.
+
+    Args:
+        function (function): Function that will be decorated.
+
+    Returns:
+        phase_wrapper: Decorated function.
+    """
+
+    @wraps(function)
+    def phase_wrapper(*args, **kwargs):
+        rules = function(*args, **kwargs)
+        for rule in rules:
+            if rule.phase is None:
+                rule.phase = function.__name__
+        return rules
+    return phase_wrapper
+
 class Builder:
     """This superclass will create a build based on buildrules.
 
@@ -28,51 +59,376 @@ class Builder:
     An overview of the whole build can be obtained with describe-function.
 
     Build is initialized by running the Builder. By specifying dry_run no
-    changes are made, but the output is presented.
+    changes are made, but the output is presented. By specifying jobs
+    rules that do not depend on each other are run concurrently.
 
     Args:
         conf_folder (str): Configuration folder that contains configuration
         files.
+        deployers (list, optional): Deployers to use. Default is None, which
+            creates deployers based on deployment_config.yaml in conf_folder.
+            When deployers are given deployment_config.yaml is not read.
     """
 
     BUILDER_NAME = 'None'
     CONF_FILES = []
     SCHEMAS = []
+    # Exclusive builders are not run concurrently with other builders by
+    # MultiBuilder
+    EXCLUSIVE = False
+    # Number of traces kept in the builder's cache folder
+    MAX_TRACES = 20
+    ENGINES = {
+        'sync': RuleScheduler,
+        'asyncio': AsyncRuleScheduler,
+    }
 
     @log_error_and_quit
-    def __init__(self, conf_folder):
+    def __init__(self, conf_folder, deployers=None):
         self._logger = logging.getLogger(self.__class__.__name__)
+        conf_files = self.CONF_FILES
+        self._schemas = self._get_schemas()
+        if deployers is None:
+            conf_files = conf_files + ['deployment_config.yaml']
+            self._schemas.append(DEPLOYMENTCONFIG_SCHEMA)
         self._conf_files = list(
-            map(lambda x: os.path.join(conf_folder,x), self.CONF_FILES + ['deployment_config.yaml'])
+            map(lambda x: os.path.join(conf_folder,x), conf_files)
         )
-        self._schemas = self.SCHEMAS + [DEPLOYMENTCONFIG_SCHEMA]
         self._confreader = ConfReader(self._conf_files, self._schemas)
-        self._deployers = deployer_factory(self._confreader)
+        if deployers is None:
+            deployers = deployer_factory(self._confreader)
+        self._deployers = deployers
+        self._plans = {}
+        self._cache_dir = self._get_cache_dir()
+        self._conf_id = calculate_dict_checksum(os.path.realpath(conf_folder))
+        self._stamps = StampStore(os.path.join(self._cache_dir, 'stamps'))
+
+    @property
+    def deployers(self):
+        """list: Deployers of the builder."""
+        return self._deployers
+
+    def _get_schemas(self):
+        """Returns the schemas of the configuration files in CONF_FILES."""
+        return list(self.SCHEMAS)
+
+    def _get_cache_dir(self):
+        """Returns the folder where the builder stores its caches."""
+        return get_cache_dir(self.BUILDER_NAME.lower())
+
+    def _get_conf_cache_dir(self):
+        """Returns the folder in the builder's cache for caches that are
+        specific to the configuration folder."""
+        return os.path.join(self._cache_dir, 'confs', self._conf_id[:16])
+
+    def _get_journal_dir(self):
+        """Returns the folder where the journals of builds from the
+        configuration folder are stored."""
+        return os.path.join(self._get_conf_cache_dir(), 'journals')
+
+    def _remove_journals(self):
+        """Removes the journals of earlier builds from the configuration
+        folder. They belong to builds with different rules, which a
+        successful build has superseded."""
+        try:
+            entries = list(os.scandir(self._get_journal_dir()))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith('.journal'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _get_scratch_limits(self):
+        """Returns the maximum number of concurrent rules for scratch disk
+        classes that are specific to the builder."""
+        return {}
 
     def _skip_rule(self, step):
         return step in self._confreader.get('build_config',{}).get('skip_rules',[])
 
-    def __call__(self, dry_run=False):
-        """This function will execute all _build_rules."""
+    def _get_engine(self, engine=None):
+        if engine is None:
+            build_config = self._confreader.get('build_config', {}) or {}
+            engine = build_config.get('engine', 'sync')
+        if engine not in self.ENGINES:
+            raise ValueError('Invalid execution engine: {0}'.format(engine))
+        return engine
+
+    def __call__(self, dry_run=False, jobs=1, use_stamps=True, resume=False,
+                 trace_file=None, engine=None, log_dir=None, cpus=None,
+                 capacity=None, deploy=True):
+        """This function will execute all _build_rules.
+
+        Args:
+            dry_run (bool): Only describe the rules without running them.
+                Default is False.
+            jobs (int): Number of rules to run concurrently. Rules are run
+                in the order of their dependencies. Default is 1.
+            use_stamps (bool): Skip rules that have been completed with the
+                same fingerprint during a previous build. Stamps are stored
+                in the builder's cache folder. Default is True.
+            resume (bool): Skip rules that were completed by a failed run of
+                the same build. Completed rules are recorded into a journal,
+                which is removed after a successful build. Default is False.
+            trace_file (str): File where the timing of every rule is written
+                as a Chrome trace-event JSON. Default is None, which writes
+                the trace into the builder's cache folder and keeps the
+                newest MAX_TRACES traces.
+            engine (str): Execution engine to use. 'sync' runs rules on a
+                pool of threads and 'asyncio' runs subprocesses in an asyncio
+                event loop. Default is None, which uses the engine from
+                build_config or 'sync'.
+            log_dir (str): Folder for compressed per-rule log files. Only a
+                summary line and, if a subprocess fails, the last lines of
+                its output are logged. Default is None, which logs all
+                output.
+            cpus (int): Number of CPU slots available for concurrent rules.
+                Each rule reserves its CPU slots, memory and scratch disk
+                class while it is running. Default is None, which uses all
+                CPUs of the host.
+            capacity (ResourcePool): Resource pool shared with other
+                builders, e.g. by MultiBuilder. Default is None, which
+                creates a pool with cpus.
+            deploy (bool): Run the rules of the deployers after the build.
+                Default is True.
+        """
+        engine = self._get_engine(engine)
         rules = self._get_rules()
 
-        for deployer in self._deployers:
-            rules = rules + deployer.get_rules()
+        if deploy:
+            rules = rules + self.get_deployer_rules(self._deployers)
 
-        for rule in rules:
+        if capacity is None:
+            capacity = ResourcePool(cpus=cpus)
+        for scratch, limit in self._get_scratch_limits().items():
+            capacity.set_scratch_limit(scratch, limit)
+        scheduler = self.ENGINES[engine](rules, jobs=jobs, capacity=capacity)
+
+        if log_dir is not None:
+            self._spool_rule_output(rules, log_dir)
+
+        # Build is identified by the rules it contains
+        plan_fingerprints = [rule.fingerprint(include_files=False) for rule in rules]
+        build_id = calculate_dict_checksum(plan_fingerprints)
+        journal = RuleJournal(
+            os.path.join(self._get_journal_dir(), '{0}.journal'.format(build_id)))
+        completed = set()
+        if dry_run:
+            journal = None
+        elif resume:
+            completed = journal.completed()
+            self._logger.info(
+                'Resuming build %s: %d of %d rules have already been completed.',
+                build_id, len(completed), len(rules))
+        else:
+            journal.clear()
+
+        timeline = RuleTimeline(build_id)
+
+        def is_completed(index, rule):
+            if (index, plan_fingerprints[index]) in completed:
+                self._logger.debug('Skipping %s as it was completed by a previous run.', rule)
+                timeline.record(index, rule, time.time(), time.time(), 'resumed')
+                return True
+            return False
+
+        def record(index, rule, start, status):
+            timeline.record(index, rule, start, time.time(), status)
+            if journal is not None and status != 'failed':
+                journal.record(index, plan_fingerprints[index])
+
+        def run_rule(index, rule):
+            if is_completed(index, rule):
+                return
+            start = time.time()
+            status = 'failed'
             try:
-                rule(dry_run=dry_run)
-            except RuleError as e:
-                self._logger.error('Encountered an error while executing BuildRule: {0}: {1}'.format(rule, e))
-                sys.exit(1)
+                status = self._run_rule(rule, dry_run, use_stamps)
+            finally:
+                record(index, rule, start, status)
+
+        async def run_rule_async(index, rule):
+            if is_completed(index, rule):
+                return
+            start = time.time()
+            status = 'failed'
+            try:
+                status = await self._run_rule_async(rule, dry_run, use_stamps)
+            finally:
+                record(index, rule, start, status)
+
+        try:
+            if engine == 'asyncio':
+                scheduler(run_rule_async)
+            else:
+                scheduler(run_rule)
+        except RuleError:
+            if journal is not None:
+                self._logger.error(
+                    'Build can be resumed with --resume. Journal: %s', journal.journal_file)
+            sys.exit(1)
+        finally:
+            if not dry_run or trace_file:
+                self._write_timeline(timeline, trace_file)
+
+        if journal is not None:
+            journal.clear()
+            self._remove_journals()
+
+    @staticmethod
+    def get_deployer_rules(deployers):
+        """Returns the rules of deployers.
+
+        Args:
+            deployers (list): List of deployers.
+
+        Returns:
+            list: Rules of the deployers.
+        """
+        rules = []
+        for deployer in deployers:
+            deployer_rules = deployer.get_rules()
+            for rule in deployer_rules:
+                if rule.phase is None:
+                    rule.phase = '{0}.get_rules'.format(deployer.__class__.__name__)
+            rules = rules + deployer_rules
+        return rules
+
+    @classmethod
+    def _spool_rule_output(cls, rules, log_dir):
+        for index, rule in enumerate(rules):
+            if isinstance(rule, SubprocessRule):
+                log_name = re.sub(
+                    '[^A-Za-z0-9@._-]+', '_', rule.short_description().split(': ', 1)[-1])[:80]
+                rule.spool_output(
+                    os.path.join(log_dir, '{0:04d}-{1}.log.gz'.format(index, log_name)))
+
+    def _write_timeline(self, timeline, trace_file=None):
+        for line in timeline.get_summary():
+            self._logger.info(line)
+        rotate = trace_file is None
+        if rotate:
+            trace_file = os.path.join(
+                self._get_trace_dir(),
+                '{0}-{1}.json'.format(datetime.now().strftime('%Y%m%d-%H%M%S-%f'), os.getpid()))
+        try:
+            timeline.write_chrome_trace(trace_file)
+            self._logger.info('Build trace written to %s', trace_file)
+        except OSError as error:
+            self._logger.warning('Could not write build trace to %s: %s', trace_file, error)
+        if rotate:
+            self._remove_old_traces()
+
+    def _get_trace_dir(self):
+        """Returns the folder where traces of builds are stored by
+        default."""
+        return os.path.join(self._cache_dir, 'traces')
+
+    def _remove_old_traces(self):
+        """Removes all but the MAX_TRACES newest traces from the builder's
+        trace folder."""
+        try:
+            traces = [entry for entry in os.scandir(self._get_trace_dir())
+                      if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            return
+        traces.sort(key=lambda entry: (entry.stat().st_mtime, entry.name), reverse=True)
+        for entry in traces[self.MAX_TRACES:]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _check_stamp(self, rule, dry_run=False, use_stamps=True):
+        """Returns a tuple of a boolean that tells whether the rule can be
+        skipped and the fingerprint that should be stamped after the rule
+        has been run."""
+        fingerprint = None
+        if rule.stamped and not dry_run:
+            fingerprint = rule.fingerprint()
+            if use_stamps and fingerprint in self._stamps and rule.stamp_is_valid():
+                self._logger.info('Skipping %s as it has already been completed.', rule)
+                return True, fingerprint
+        return False, fingerprint
+
+    def _run_rule(self, rule, dry_run=False, use_stamps=True):
+        skip, fingerprint = self._check_stamp(rule, dry_run, use_stamps)
+        if skip:
+            return 'skipped'
+        try:
+            rule(dry_run=dry_run)
+        except RuleError as e:
+            self._logger.error('Encountered an error while executing BuildRule: {0}: {1}'.format(rule, e))
+            raise
+        if fingerprint is not None:
+            self._stamps.add(fingerprint, str(rule))
+        return 'completed'
+
+    async def _run_rule_async(self, rule, dry_run=False, use_stamps=True):
+        skip, fingerprint = self._check_stamp(rule, dry_run, use_stamps)
+        if skip:
+            return 'skipped'
+        try:
+            await rule.run_async(dry_run=dry_run)
+        except RuleError as e:
+            self._logger.error('Encountered an error while executing BuildRule: {0}: {1}'.format(rule, e))
+            raise
+        if fingerprint is not None:
+            self._stamps.add(fingerprint, str(rule))
+        return 'completed'
 
     def _get_rules(self):
         """"""
         return []
 
+    def get_plan(self, deploy=True):
+        """Returns a machine-readable plan of the build. The plan is
+        created once and cached on the builder.
+
+        Args:
+            deploy (bool): Include the rules of the deployers. Default is
+                True.
+
+        Returns:
+            dict: Plan with the builder name, the build id and a list of
+            rule descriptions in the order the rules are run.
+        """
+        if deploy not in self._plans:
+            rules = self._get_rules()
+            if deploy:
+                rules = rules + self.get_deployer_rules(self._deployers)
+            dependencies = RuleScheduler.resolve_dependencies(rules)
+            plan_rules = []
+            for index, rule in enumerate(rules):
+                plan_rule = rule.get_plan()
+                plan_rule['index'] = index
+                plan_rule['dependencies'] = sorted(dependencies[index])
+                plan_rules.append(plan_rule)
+            self._plans[deploy] = {
+                'builder': self.BUILDER_NAME,
+                'build_id': calculate_dict_checksum(
+                    [plan_rule['fingerprint'] for plan_rule in plan_rules]),
+                'rules': plan_rules,
+            }
+        return self._plans[deploy]
+
     @log_error_and_quit
-    def describe(self):
-        """"""
+    def describe(self, output_format='text'):
+        """Describes the build.
+
+        Args:
+            output_format (str): 'text' logs descriptions of the rules and
+                'json' writes the plan of the build into standard output.
+                Default is 'text'.
+        """
+        if output_format == 'json':
+            sys.stdout.write(json.dumps(self.get_plan(), indent=2, sort_keys=True) + '\n')
+            return
+        if output_format != 'text':
+            raise ValueError('Invalid output format: {0}'.format(output_format))
         self._logger.info('Builder: {0}'.format(self.BUILDER_NAME))
         self._logger.info(
             'Configuration files: {0}'.format(' '.join(self.CONF_FILES + ['deployment_config.yaml'])))
@@ -84,10 +440,7 @@ class Builder:
         for rule in rules:
             self._logger.info(rule)
 
-        deployer_rules = []
-        deployers = deployer_factory(self._confreader)
-        for deployer in deployers:
-            deployer_rules = deployer_rules + deployer.get_rules()
+        deployer_rules = self.get_deployer_rules(self._deployers)
 
         self._logger.info('Deployment descriptions:')
         for rule in deployer_rules:
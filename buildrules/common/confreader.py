@@ -1,12 +1,26 @@
 # -*- coding=utf-8 -*-
 """This module contains ConfReader class that contains methods for reading
-and validating different yaml files."""
+and validating different yaml files.
+
+Parsed and validated configurations are cached on disk. Cache entries are
+keyed by the contents of the configuration file and by the schema, so a
+cached entry is used only if both are unchanged. Entries are written
+atomically, so the cache can be shared between concurrent builders.
+
+Entries are stored as JSON. Cache files and folders that are owned by
+another user or that are writable by other users are not trusted."""
+import os
+import json
+import stat
+import hashlib
 from os.path import basename, splitext
 from collections.abc import Mapping
 from textwrap import indent
 from copy import copy
-from jsonschema import validate, Draft4Validator
-import yaml
+from buildrules.common.utils import (get_cache_dir, calculate_dict_checksum,
+                                     write_file_atomic, makedirs, parse_yaml,
+                                     dump_yaml)
+from buildrules.common.validators import validate
 
 class ConfReader(Mapping):
     """ConfReader is used for reading an validating configurations.
@@ -14,23 +28,106 @@ class ConfReader(Mapping):
     Args:
         yamlfiles (list): YAML files to load into configuration.
         schemas (list): A list of schemas that correspond to YAMLs.
+        use_cache (bool, optional): Use the cache of validated
+            configurations. Default is True.
     """
 
-    def __init__(self, yamlfiles, schemas):
+    # Changing this invalidates all cached configurations
+    CACHE_VERSION = 3
+
+    def __init__(self, yamlfiles, schemas, use_cache=True):
         self._configs = dict()
         self._conf_files = copy(yamlfiles)
         for yamlfile, schema in zip(yamlfiles, schemas):
 
+            conf_key = splitext(basename(yamlfile))[0]
+
+            with open(yamlfile, 'rb') as yaml_f:
+                contents = yaml_f.read()
+
+            cache_file = None
+            if use_cache:
+                cache_file = self._get_cache_file(contents, schema)
+                data, found = self._load_cached(cache_file)
+                if found:
+                    self._configs[conf_key] = data
+                    continue
+
             # Read data from configuration file
-            data = self._read_yaml(yamlfile)
+            data = self._parse_yaml(contents)
 
             # Insert configuration to self._configs
-            conf_key = splitext(basename(yamlfile))[0]
             self._configs[conf_key] = data
 
             # Validate configuration
             self.validate(conf_key, schema)
 
+            if cache_file is not None:
+                self._store_cached(cache_file, data)
+
+    @classmethod
+    def _get_cache_file(cls, contents, schema):
+        """Returns the cache file for a configuration file with given
+        contents that is validated with given schema. Returns None if
+        the schema cannot be hashed."""
+        try:
+            schema_checksum = calculate_dict_checksum(schema)
+        except (TypeError, ValueError):
+            return None
+        key = hashlib.sha256()
+        key.update(str(cls.CACHE_VERSION).encode('utf-8'))
+        key.update(hashlib.sha256(contents).hexdigest().encode('utf-8'))
+        key.update(schema_checksum.encode('utf-8'))
+        key = key.hexdigest()
+        return os.path.join(get_cache_dir('configs'), key[:2], '{0}.json'.format(key))
+
+    @staticmethod
+    def _is_trusted(path):
+        """Returns True if path is owned by the current user and it is not
+        writable by group or others."""
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            return False
+        return (path_stat.st_uid == os.getuid() and
+                not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+    @classmethod
+    def _load_cached(cls, cache_file):
+        """Returns a tuple of the cached configuration and a boolean that
+        tells whether the configuration was found in the cache."""
+        if cache_file is None:
+            return None, False
+        cache_folder = os.path.dirname(cache_file)
+        for path in (cache_file, cache_folder, os.path.dirname(cache_folder)):
+            if not cls._is_trusted(path):
+                return None, False
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as cache_f:
+                return json.load(cache_f), True
+        except (OSError, ValueError):
+            return None, False
+
+    @staticmethod
+    def _store_cached(cache_file, data):
+        try:
+            contents = json.dumps(data)
+        except (TypeError, ValueError):
+            return
+        # Configurations that do not survive a JSON round trip (e.g. YAML
+        # dates or non-string keys) are not cached.
+        if json.loads(contents) != data:
+            return
+        cache_folder = os.path.dirname(cache_file)
+        try:
+            # Folders are created without group and other write permissions
+            # so that the entries pass the checks in _load_cached.
+            makedirs(os.path.dirname(cache_folder), chmod=0o755)
+            makedirs(cache_folder, chmod=0o755)
+            write_file_atomic(cache_file, contents, chmod=0o644)
+        except OSError:
+            pass
+
     def __getitem__(self, confname):
         """Get a configuration.
 
@@ -89,15 +186,18 @@ class ConfReader(Mapping):
         yaml matches with the template.
         """
 
-        with open(yamlfile, 'r') as yaml_f:
-            configuration = yaml.load(yaml_f.read(), Loader=yaml.Loader)
+        with open(yamlfile, 'rb') as yaml_f:
+            return self._parse_yaml(yaml_f.read())
 
-        return configuration
+    @staticmethod
+    def _parse_yaml(contents):
+        """Parses the contents of a yamlfile."""
+        return parse_yaml(contents.decode('utf-8'))
 
     def __str__(self):
 
         conf_files = [config for config in self._conf_files]
-        configs = [indent(yaml.dump(self[config], default_flow_style=False), 4*' ')
+        configs = [indent(dump_yaml(self[config], indent=False), 4*' ')
                    for config in iter(self)]
 
 
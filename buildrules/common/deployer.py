@@ -7,11 +7,9 @@ strategies.
 """
 import logging
 import os
-import yaml
 from buildrules.common.rule import SubprocessRule, LoggingRule, PythonRule
 from buildrules.common.confreader import ConfReader
-from jsonschema import validate
-from swiftclient.service import SwiftError, SwiftService, SwiftUploadObject
+from buildrules.common.validators import validate
 
 DEPLOYMENTCONFIG_SCHEMA = {
     "$schema" : "http://json-schema.org/draft-07/schema#",
@@ -49,6 +47,11 @@ class Deployer:
         validate(deployer_config, self.DEPLOYER_SCHEMA)
         self._deployer_config = deployer_config
 
+    @property
+    def config(self):
+        """dict: Configuration of the deployer."""
+        return self._deployer_config
+
 class RsyncDeployer(Deployer):
 
     DEPLOYER_SCHEMA = {
@@ -171,6 +174,8 @@ class SwiftDeployer(Deployer):
         return auths
 
     def _swift_deploy(self):
+        # swiftclient is slow to import and only needed for deployment
+        from swiftclient.service import SwiftService, SwiftUploadObject
 
         auth = self._auths[self._deployer_config['target_host']]
 
@@ -240,12 +245,11 @@ class SwiftDeployer(Deployer):
 
 def deployer_factory(confreader):
     """This function creates instances of subclasses of Deployer based on
-    deployment_config. The configurations passed to the deployers class are validated
-    again against the specific schema of each class.
+    deployment_config. deployment_config is expected to be validated against
+    DEPLOYMENTCONFIG_SCHEMA by ConfReader. The configurations passed to the
+    deployers class are validated against the specific schema of each class.
     """
 
-    confreader.validate('deployment_config', DEPLOYMENTCONFIG_SCHEMA)
-
     deployer_classes = {
         'rsync': RsyncDeployer,
         'swift': SwiftDeployer
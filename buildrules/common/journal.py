@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Journal records the progress of a build.
+
+This module contains RuleJournal class that is used by Builder to record
+which rules of a build have been completed. An interrupted build can then
+be resumed without re-running the completed rules.
+"""
+import os
+import threading
+
+from buildrules.common.utils import makedirs
+
+class RuleJournal:
+    """RuleJournal is an append-only journal of completed rules.
+
+    Each line of the journal contains the index and the fingerprint of
+    a completed rule.
+
+    Args:
+        journal_file (str): File where the journal is stored.
+    """
+
+    def __init__(self, journal_file):
+        self._journal_file = journal_file
+        self._lock = threading.Lock()
+        self._terminated = False
+
+    @property
+    def journal_file(self):
+        """str: File where the journal is stored."""
+        return self._journal_file
+
+    def completed(self):
+        """Reads completed rules from the journal.
+
+        Returns:
+            set: Set of (index, fingerprint)-tuples of completed rules.
+        """
+        completed = set()
+        if not os.path.isfile(self._journal_file):
+            return completed
+        with open(self._journal_file, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                # Last line might be incomplete if the build was killed
+                fields = line.split()
+                if (not line.endswith('\n') or len(fields) != 2 or
+                        not fields[0].isdigit()):
+                    continue
+                completed.add((int(fields[0]), fields[1]))
+        return completed
+
+    def record(self, index, fingerprint):
+        """Records a completed rule.
+
+        Args:
+            index (int): Index of the rule.
+            fingerprint (str): Fingerprint of the rule.
+        """
+        with self._lock:
+            makedirs(os.path.dirname(self._journal_file))
+            with open(self._journal_file, 'a+', encoding='utf-8') as journal:
+                # Invalidate an incomplete last line left by a killed build
+                if not self._terminated:
+                    journal.seek(0, os.SEEK_END)
+                    if journal.tell() > 0:
+                        journal.seek(journal.tell() - 1)
+                        if journal.read(1) != '\n':
+                            journal.write(' -\n')
+                    self._terminated = True
+                journal.write('{0} {1}\n'.format(index, fingerprint))
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def clear(self):
+        """Removes the journal."""
+        self._terminated = False
+        try:
+            os.remove(self._journal_file)
+        except FileNotFoundError:
+            pass
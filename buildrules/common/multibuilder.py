@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""MultiBuilder runs several builders in one process.
+
+This module contains MultiBuilder class that is used by the 'all' builder
+of the command line interface. It creates builders for every configuration
+folder found in a configuration root, runs them concurrently and deploys
+their results in one pass at the end.
+"""
+import os
+import sys
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from buildrules.common.errors import log_error_and_quit
+from buildrules.common.builder import Builder
+from buildrules.common.confreader import ConfReader
+from buildrules.common.rule import RuleError
+from buildrules.common.scheduler import RuleScheduler
+from buildrules.common.resources import ResourcePool
+from buildrules.common.deployer import deployer_factory, DEPLOYMENTCONFIG_SCHEMA
+
+class MultiBuilder:
+    """MultiBuilder runs several builders in one process.
+
+    conf_root contains a configuration folder for each builder that is named
+    after the builder, e.g. conf_root/spack. If conf_root contains a
+    deployment_config.yaml, it is read once and shared by all builders.
+    Otherwise each builder uses the deployment_config.yaml in its own folder.
+
+    Builders are run concurrently and they share the capacity of the build
+    host. Builders that are EXCLUSIVE are run alone before the others.
+    Builders do not deploy anything themselves. After all builders have
+    succeeded the deployers of all builders are merged, duplicate
+    deployments are removed and the deployments are run once.
+
+    Args:
+        conf_root (str): Folder that contains configuration folders of the
+            builders.
+        builders (list, optional): Names of the builders to run. Default is
+            None, which runs every builder that has a configuration folder.
+        registry (Mapping, optional): Builder names and classes. Default is
+            None, which uses buildrules.BUILDERS.
+
+    Raises:
+        ValueError: When no builder configuration folders are found.
+    """
+
+    @log_error_and_quit
+    def __init__(self, conf_root, builders=None, registry=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        if registry is None:
+            from buildrules import BUILDERS
+            registry = BUILDERS
+        if builders is None:
+            builders = [name for name in registry
+                        if os.path.isdir(os.path.join(conf_root, name))]
+        if not builders:
+            raise ValueError(
+                'No builder configuration folders found in {0}'.format(conf_root))
+
+        shared_deployers = None
+        deployment_config = os.path.join(conf_root, 'deployment_config.yaml')
+        if os.path.isfile(deployment_config):
+            shared_deployers = deployer_factory(
+                ConfReader([deployment_config], [DEPLOYMENTCONFIG_SCHEMA]))
+
+        self._builders = {}
+        for name in builders:
+            self._builders[name] = registry[name](
+                os.path.join(conf_root, name), deployers=shared_deployers)
+
+        self._deployers = self.merge_deployers(
+            [builder.deployers for builder in self._builders.values()])
+
+    @property
+    def builders(self):
+        """dict: Builders by their name."""
+        return self._builders
+
+    @property
+    def deployers(self):
+        """list: Merged deployers of all builders."""
+        return self._deployers
+
+    @staticmethod
+    def merge_deployers(deployer_lists):
+        """Merges lists of deployers. Deployers of the same type with equal
+        configurations are included only once.
+
+        Args:
+            deployer_lists (list): Lists of deployers.
+
+        Returns:
+            list: Merged list of deployers.
+        """
+        merged = []
+        seen = set()
+        for deployers in deployer_lists:
+            for deployer in deployers:
+                key = (
+                    deployer.__class__.__name__,
+                    json.dumps(deployer.config, sort_keys=True, default=str))
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(deployer)
+        return merged
+
+    @staticmethod
+    def _get_builder_path(path, name):
+        """Returns a builder specific version of a file or folder path."""
+        if path is None:
+            return None
+        root, extension = os.path.splitext(path)
+        return '{0}-{1}{2}'.format(root, name, extension)
+
+    def _run_builder(self, name, dry_run=False, trace_file=None, log_dir=None, **kwargs):
+        """Runs a builder without deployments. Returns True if the build
+        succeeded."""
+        self._logger.info('Starting builder: %s', name)
+        try:
+            self._builders[name](
+                dry_run=dry_run,
+                trace_file=self._get_builder_path(trace_file, name),
+                log_dir=None if log_dir is None else os.path.join(log_dir, name),
+                deploy=False,
+                **kwargs)
+        except SystemExit as error:
+            if error.code:
+                self._logger.error('Builder %s failed.', name)
+                return False
+        self._logger.info('Builder %s finished.', name)
+        return True
+
+    def __call__(self, dry_run=False, jobs=1, cpus=None, **kwargs):
+        """Runs all builders and deploys their results.
+
+        Args:
+            dry_run (bool): Only describe the rules without running them.
+                Default is False.
+            jobs (int): Number of rules each builder runs concurrently.
+                Default is 1.
+            cpus (int): Number of CPU slots shared by all builders. Default
+                is None, which uses all CPUs of the host.
+            **kwargs: Other arguments for the builders. Builder specific
+                trace files and log folders are created from trace_file and
+                log_dir.
+        """
+        capacity = ResourcePool(cpus=cpus)
+
+        def run_builder(name):
+            return self._run_builder(
+                name, dry_run=dry_run, jobs=jobs, capacity=capacity, **kwargs)
+
+        exclusive = [name for name, builder in self._builders.items() if builder.EXCLUSIVE]
+        concurrent = [name for name in self._builders if name not in exclusive]
+
+        results = {}
+        for name in exclusive:
+            results[name] = run_builder(name)
+            if not results[name]:
+                break
+        if all(results.values()) and concurrent:
+            with ThreadPoolExecutor(max_workers=len(concurrent)) as executor:
+                results.update(zip(concurrent, executor.map(run_builder, concurrent)))
+
+        failed = [name for name, succeeded in results.items() if not succeeded]
+        if failed:
+            self._logger.error(
+                'Skipping deployments as following builders failed: %s', ' '.join(failed))
+            sys.exit(1)
+
+        rules = Builder.get_deployer_rules(self._deployers)
+        self._logger.info(
+            'Running %d deployments for builders: %s',
+            len(self._deployers), ' '.join(self._builders))
+        try:
+            RuleScheduler(rules)(lambda index, rule: rule(dry_run=dry_run))
+        except RuleError as error:
+            self._logger.error('Encountered an error while deploying: %s', error)
+            sys.exit(1)
+
+    def get_plan(self):
+        """Returns a machine-readable plan of all builders and the merged
+        deployments.
+
+        Returns:
+            dict: Plans of the builders without their deployments and
+            descriptions of the merged deployment rules.
+        """
+        deployment_rules = Builder.get_deployer_rules(self._deployers)
+        dependencies = RuleScheduler.resolve_dependencies(deployment_rules)
+        deployments = []
+        for index, rule in enumerate(deployment_rules):
+            plan_rule = rule.get_plan()
+            plan_rule['index'] = index
+            plan_rule['dependencies'] = sorted(dependencies[index])
+            deployments.append(plan_rule)
+        return {
+            'builders': {
+                name: builder.get_plan(deploy=False)
+                for name, builder in self._builders.items()
+            },
+            'deployments': deployments,
+        }
+
+    @log_error_and_quit
+    def describe(self, output_format='text'):
+        """Describes all builders and the merged deployments.
+
+        Args:
+            output_format (str): 'text' logs descriptions of the rules and
+                'json' writes the plan into standard output. Default is
+                'text'.
+        """
+        if output_format == 'json':
+            sys.stdout.write(json.dumps(self.get_plan(), indent=2, sort_keys=True) + '\n')
+            return
+        if output_format != 'text':
+            raise ValueError('Invalid output format: {0}'.format(output_format))
+        for builder in self._builders.values():
+            builder.describe()
+        self._logger.info('Merged deployment descriptions:')
+        for rule in Builder.get_deployer_rules(self._deployers):
+            self._logger.info(rule)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Resources describe the capacity of the build host.
+
+This module contains ResourcePool class that is used by the schedulers to
+pack build rules onto the capacity of the build host. Each rule reserves
+CPU slots, memory and optionally a slot of a scratch disk class while it
+is running.
+"""
+import os
+import threading
+
+def get_host_cpus():
+    """Returns the number of CPUs available for the build."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_host_memory():
+    """Returns the amount of physical memory of the host in bytes."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+class ResourcePool:
+    """ResourcePool keeps track of free capacity of the build host.
+
+    Requests that are larger than the total capacity are limited to the
+    total capacity, so that every rule can be run when the host is
+    otherwise idle.
+
+    Args:
+        cpus (int, optional): Number of CPU slots. Default is None, which
+            uses the number of CPUs of the host.
+        memory (int, optional): Amount of memory in bytes. Default is None,
+            which uses the physical memory of the host. Zero disables memory
+            accounting.
+        scratch_limits (dict, optional): Maximum number of concurrent rules
+            for each scratch disk class. Classes that are not listed are not
+            limited. Default is SCRATCH_LIMITS.
+    """
+
+    SCRATCH_LIMITS = {
+        'large': 1,
+    }
+
+    def __init__(self, cpus=None, memory=None, scratch_limits=None):
+        if cpus is None:
+            cpus = get_host_cpus()
+        if memory is None:
+            memory = get_host_memory()
+        if scratch_limits is None:
+            scratch_limits = self.SCRATCH_LIMITS
+        self._total = {'cpus': max(1, cpus), 'memory': memory}
+        self._free = dict(self._total)
+        self._scratch_limits = dict(scratch_limits)
+        self._scratch_used = {scratch: 0 for scratch in self._scratch_limits}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    @property
+    def cpus(self):
+        """int: Total number of CPU slots."""
+        return self._total['cpus']
+
+    def set_scratch_limit(self, scratch, limit):
+        """Sets the maximum number of concurrent rules for a scratch disk
+        class.
+
+        Args:
+            scratch (str): Scratch disk class.
+            limit (int): Maximum number of concurrent rules.
+        """
+        with self._lock:
+            self._scratch_limits[scratch] = max(1, int(limit))
+            self._scratch_used.setdefault(scratch, 0)
+
+    def _get_request(self, resources):
+        request = {
+            'cpus': min(resources.get('cpus', 1), self._total['cpus']),
+            'memory': 0,
+        }
+        if self._total['memory']:
+            request['memory'] = min(resources.get('memory', 0), self._total['memory'])
+        return request
+
+    def _try_acquire(self, request, scratch):
+        for resource, amount in request.items():
+            if amount > self._free[resource]:
+                return False
+        if scratch in self._scratch_limits:
+            if self._scratch_used[scratch] >= self._scratch_limits[scratch]:
+                return False
+            self._scratch_used[scratch] += 1
+        for resource, amount in request.items():
+            self._free[resource] -= amount
+        return True
+
+    def acquire(self, resources, blocking=False):
+        """Reserves resources if they are available.
+
+        Args:
+            resources (dict): Resources of a rule.
+            blocking (bool, optional): Wait until other users of the pool
+                have released enough resources. Default is False.
+
+        Returns:
+            bool: True if the resources were reserved.
+        """
+        request = self._get_request(resources)
+        scratch = resources.get('scratch', None)
+        with self._released:
+            if not blocking:
+                return self._try_acquire(request, scratch)
+            while not self._try_acquire(request, scratch):
+                self._released.wait()
+        return True
+
+    def release(self, resources):
+        """Releases reserved resources.
+
+        Args:
+            resources (dict): Resources of a rule.
+        """
+        request = self._get_request(resources)
+        scratch = resources.get('scratch', None)
+        with self._released:
+            for resource, amount in request.items():
+                self._free[resource] += amount
+            if scratch in self._scratch_limits:
+                self._scratch_used[scratch] -= 1
+            self._released.notify_all()
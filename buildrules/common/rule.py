@@ -8,12 +8,22 @@ returned as BuildRuleErrors.
 """
 
 import os
+import json
+import gzip
+import time
+import asyncio
 import logging
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
 import subprocess
 import select
 import traceback
 from io import StringIO
 
+from buildrules.common.utils import (calculate_dict_checksum, calculate_file_checksum,
+                                     makedirs)
+
 class RuleError(Exception):
     """BuildRuleError is the error for build rules."""
 
@@ -43,6 +53,222 @@ def rule_error_wrapper(function):
     return exception_wrapper
 
 
+def async_rule_error_wrapper(function):
+    """async_rule_error_wrapper is the rule_error_wrapper for coroutine
+    functions.
+
+    Args:
+        function (function): Coroutine function that will be decorated.
+
+    Returns:
+        exception_wrapper: Decorated coroutine function.
+    """
+
+    async def exception_wrapper(*args, **kwargs):
+        try:
+            return await function(*args, **kwargs)
+        except (KeyboardInterrupt, asyncio.CancelledError) as error:
+            raise error
+        except Exception as error:
+            logging.error('Encountered an error:')
+            trace = StringIO()
+            traceback.print_stack(file=trace)
+            logging.error(trace.getvalue())
+            trace.close()
+            raise RuleError(error) from error
+    return exception_wrapper
+
+def _fingerprint_default(value):
+    """Returns a stable description of values that cannot be serialized into
+    JSON. Object addresses would change between runs, so functions are
+    described by their qualified names and other objects by their types."""
+    if hasattr(value, '__qualname__'):
+        return '{0}.{1}'.format(getattr(value, '__module__', ''), value.__qualname__)
+    return type(value).__qualname__
+
+def chain_rules(rules, dependencies=()):
+    """chain_rules makes each rule in a list depend on the rule before it.
+    The first rule of the chain will depend on the given dependencies.
+
+    Chains can be used by builders to create independent sub-graphs (e.g.
+    all rules related to one package) that can be run concurrently with
+    other chains.
+
+    Args:
+        rules (list): Rules that will be chained.
+        dependencies (list): Rules the first rule depends on. Default is
+            an empty list.
+
+    Returns:
+        list: The chained rules.
+    """
+    previous = list(dependencies)
+    for rule in rules:
+        rule.depends_on(*previous)
+        previous = [rule]
+    return rules
+
+class LineBuffer:
+    """LineBuffer splits chunks of output into lines and passes them to
+    a writer.
+
+    All complete lines of a chunk are passed to the writer in one call.
+    Incomplete lines are kept until they are completed or until the buffer
+    is closed. Empty lines are dropped.
+
+    Args:
+        writer (function): Function that takes a string.
+        max_partial (int, optional): Maximum length of an incomplete line
+            that is kept in the buffer. Longer lines are passed on without
+            waiting for their end. Default is 65536.
+    """
+
+    def __init__(self, writer, max_partial=65536):
+        self._writer = writer
+        self._max_partial = max_partial
+        self._partial = b''
+
+    def feed(self, data):
+        """Adds a chunk of output into the buffer.
+
+        Args:
+            data (bytes): Chunk of output.
+        """
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if len(self._partial) > self._max_partial:
+            lines.append(self._partial)
+            self._partial = b''
+        lines = [line for line in lines if line]
+        if lines:
+            self._writer(b'\n'.join(lines).decode('utf-8', errors='replace'))
+
+    def close(self):
+        """Passes the remaining incomplete line to the writer."""
+        if self._partial:
+            self._writer(self._partial.decode('utf-8', errors='replace'))
+        self._partial = b''
+
+class OutputPump:
+    """OutputPump drains output streams of a subprocess into writers.
+
+    Streams are read with non-blocking I/O in large chunks. Chunks are split
+    into lines in bulk by LineBuffers.
+
+    Args:
+        writers (dict): Dictionary of stream: writer-pairs. Streams should be
+            binary file objects and writers functions that take a string.
+        chunk_size (int, optional): Maximum number of bytes read at once.
+            Default is 65536.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, writers, chunk_size=CHUNK_SIZE):
+        self._chunk_size = chunk_size
+        self._buffers = {}
+        for stream, writer in writers.items():
+            fileno = stream.fileno()
+            os.set_blocking(fileno, False)
+            self._buffers[fileno] = LineBuffer(writer, chunk_size)
+
+    def pump(self, timeout=None):
+        """Reads all output that is currently available.
+
+        Args:
+            timeout (float, optional): Maximum time to wait for output in
+                seconds. Default is None, which waits until output is
+                available.
+
+        Returns:
+            bool: False if all streams have been closed, True otherwise.
+        """
+        if not self._buffers:
+            return False
+        ready = select.select(list(self._buffers), [], [], timeout)[0]
+        for fileno in ready:
+            while True:
+                try:
+                    data = os.read(fileno, self._chunk_size)
+                except BlockingIOError:
+                    break
+                if not data:
+                    self._buffers.pop(fileno).close()
+                    break
+                self._buffers[fileno].feed(data)
+                if len(data) < self._chunk_size:
+                    break
+        return bool(self._buffers)
+
+    def run(self):
+        """Reads output until all streams have been closed."""
+        while self.pump():
+            pass
+
+class LogSpool:
+    """LogSpool writes the output of a rule into a compressed log file and
+    keeps the last lines of the output in a ring buffer.
+
+    Args:
+        log_file (str): Target log file. It is written with gzip-compression.
+        tail_lines (int, optional): Number of lines kept in the ring buffer.
+            Default is 100.
+    """
+
+    def __init__(self, log_file, tail_lines=100):
+        self._log_file = log_file
+        self._tail = deque(maxlen=tail_lines)
+        self._file = None
+
+    @property
+    def log_file(self):
+        """str: Target log file."""
+        return self._log_file
+
+    @property
+    def tail(self):
+        """list: Last lines of the output."""
+        return list(self._tail)
+
+    def __enter__(self):
+        log_folder = os.path.dirname(self._log_file)
+        if log_folder:
+            makedirs(log_folder)
+        self._tail.clear()
+        self._file = gzip.open(self._log_file, 'wt', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self._file = None
+
+    def write(self, message):
+        """Writes a message into the log file and the ring buffer.
+
+        Args:
+            message (str): Message that can contain multiple lines.
+        """
+        self._file.write(message)
+        self._file.write('\n')
+        self._tail.extend(message.split('\n'))
+
+async def read_stream_async(stream, writer, chunk_size=OutputPump.CHUNK_SIZE):
+    """Reads an asyncio stream in chunks until it is closed.
+
+    Args:
+        stream (asyncio.StreamReader): Stream to read.
+        writer (function): Function that takes a string.
+        chunk_size (int, optional): Maximum number of bytes read at once.
+            Default is 65536.
+    """
+    line_buffer = LineBuffer(writer, chunk_size)
+    while True:
+        data = await stream.read(chunk_size)
+        if not data:
+            break
+        line_buffer.feed(data)
+    line_buffer.close()
+
 class Rule:
     """BuildRule is created by ConfReader and it is used by
     Builder to build software.
@@ -60,6 +286,168 @@ class Rule:
             stderr_writer = self._logger.error
         self._stdout_writer = stdout_writer
         self._stderr_writer = stderr_writer
+        self._dependencies = None
+        self._stamped = False
+        self._input_files = []
+        self._input_config = None
+        self._stamp_actions = None
+        self._stamp_check = None
+        self._phase = None
+        self._resources = {'cpus': 1, 'memory': 0, 'scratch': None}
+
+    @property
+    def phase(self):
+        """str: Name of the builder phase that created the rule."""
+        return self._phase
+
+    @phase.setter
+    def phase(self, phase):
+        self._phase = phase
+
+    def short_description(self):
+        """Returns a short, one-line description of the rule."""
+        return self.__class__.__name__
+
+    @property
+    def stamped(self):
+        """bool: Whether the rule can be skipped when a stamp for its
+        fingerprint exists."""
+        return self._stamped
+
+    def use_stamp(self, files=None, config=None, actions=None, check=None):
+        """Marks the rule as one that can be skipped if it has already been
+        completed with the same fingerprint.
+
+        Args:
+            files (list, optional): Files whose contents affect the result
+                of the rule.
+            config (object, optional): Configuration subtree that affects
+                the result of the rule.
+            actions (object, optional): Description of the actions of the
+                rule that is used in the fingerprint instead of the rule
+                itself, e.g. a command without options that do not affect
+                the result.
+            check (function, optional): Function that returns False if the
+                result of an earlier run no longer exists. The rule is run
+                again even if a stamp exists for its fingerprint.
+
+        Returns:
+            Rule: The rule itself so that calls can be chained.
+        """
+        self._stamped = True
+        if files:
+            self._input_files.extend(files)
+        if config is not None:
+            self._input_config = config
+        if actions is not None:
+            self._stamp_actions = actions
+        if check is not None:
+            self._stamp_check = check
+        return self
+
+    def stamp_is_valid(self):
+        """Returns False if the result of an earlier run of a stamped rule
+        no longer exists and the rule has to be run again."""
+        return self._stamp_check is None or bool(self._stamp_check())
+
+    def _get_fingerprint_dict(self):
+        """Returns a dictionary that describes the actions of the rule.
+        Subclasses should extend this."""
+        return {'type': self.__class__.__name__}
+
+    def get_plan(self):
+        """Returns a machine-readable description of the rule for build
+        plans. Subclasses should extend this.
+
+        Returns:
+            dict: Description of the rule that can be serialized as JSON.
+        """
+        return {
+            'type': self.__class__.__name__,
+            'description': self.short_description(),
+            'phase': self._phase,
+            'fingerprint': self.fingerprint(include_files=False),
+            'stamped': self._stamped,
+            'resources': dict(self._resources),
+        }
+
+    def fingerprint(self, include_files=True):
+        """Calculates a fingerprint for the rule. Fingerprint is a checksum
+        calculated from the actions of the rule and from its inputs.
+
+        Args:
+            include_files (bool): Include the contents of input files in the
+                fingerprint. When False, only the names of the input files
+                are used. Default is True.
+
+        Returns:
+            str: Fingerprint of the rule.
+        """
+        input_files = {}
+        for input_file in self._input_files:
+            if include_files and os.path.isfile(input_file):
+                input_files[input_file] = calculate_file_checksum(input_file)
+            else:
+                input_files[input_file] = None
+        fingerprint_dict = json.loads(json.dumps(
+            {
+                'rule': (self._get_fingerprint_dict() if self._stamp_actions is None
+                         else {'type': self.__class__.__name__,
+                               'actions': self._stamp_actions}),
+                'files': input_files,
+                'config': self._input_config,
+            },
+            sort_keys=True,
+            default=_fingerprint_default))
+        return calculate_dict_checksum(fingerprint_dict)
+
+    @property
+    def dependencies(self):
+        """list: Rules that need to finish before this rule can be run. If no
+        dependencies have been declared this is None and the rule depends on
+        every rule that precedes it in the rule list."""
+        return self._dependencies
+
+    def depends_on(self, *rules):
+        """Declares rules that need to finish before this rule is run.
+
+        Args:
+            *rules (Rule): Rules this rule depends on.
+
+        Returns:
+            Rule: The rule itself so that calls can be chained.
+        """
+        if self._dependencies is None:
+            self._dependencies = []
+        self._dependencies.extend(rules)
+        return self
+
+    @property
+    def resources(self):
+        """dict: Resources the rule reserves from the build host while it
+        is running: number of CPU slots, memory in bytes and the scratch disk
+        class."""
+        return self._resources
+
+    def set_resources(self, cpus=None, memory=None, scratch=None):
+        """Declares the resources the rule needs while it is running.
+
+        Args:
+            cpus (int, optional): Number of CPU slots. Default is 1.
+            memory (int, optional): Amount of memory in bytes. Default is 0.
+            scratch (str, optional): Scratch disk class, e.g. 'large'.
+                Default is None.
+
+        Returns:
+            Rule: The rule itself so that calls can be chained.
+        """
+        if cpus is not None:
+            self._resources['cpus'] = max(0, int(cpus))
+        if memory is not None:
+            self._resources['memory'] = max(0, int(memory))
+        if scratch is not None:
+            self._resources['scratch'] = scratch
+        return self
 
     def __repr__(self):
         return self.__str__()
@@ -67,6 +455,19 @@ class Rule:
     def __call__(self):
         return False
 
+    async def run_async(self, dry_run=False):
+        """Runs the rule in an asyncio event loop. By default the rule is
+        called in the default executor of the event loop.
+
+        Args:
+            dry_run (bool): Only describe the rule. Default is False.
+
+        Returns:
+            object: Output of the rule.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(self, dry_run=dry_run))
+
 class PythonRule(Rule):
     """PythonRule is a BuildRule that when called will execute a Python
     command.
@@ -103,6 +504,8 @@ class PythonRule(Rule):
         self._hide_args = hide_args
         self._hide_kwargs = hide_kwargs
         super().__init__(stdout_writer, stderr_writer)
+        # Python functions are mostly cheap bookkeeping
+        self._resources['cpus'] = 0
 
     @rule_error_wrapper
     def __call__(self, dry_run=False):
@@ -113,6 +516,23 @@ class PythonRule(Rule):
 
         return False
 
+    def short_description(self):
+        return 'PythonRule: {0}'.format(self._func.__qualname__)
+
+    def _get_fingerprint_dict(self):
+        fingerprint_dict = super()._get_fingerprint_dict()
+        fingerprint_dict.update({
+            'function': self._func,
+            'args': self._args,
+            'kwargs': self._kwargs,
+        })
+        return fingerprint_dict
+
+    def get_plan(self):
+        plan = super().get_plan()
+        plan['function'] = self._func.__qualname__
+        return plan
+
     def __str__(self):
         msg = 'PythonRule: {{ '
         msg_list = ['function: {0}'.format(self._func.__qualname__)]
@@ -170,61 +590,157 @@ class SubprocessRule(Rule):
         self._check = check
         self._cwd = cwd
         self._hide_env = hide_env
+        self._log_spool = None
         super().__init__(stdout_writer, stderr_writer)
 
+    def spool_output(self, log_file, tail_lines=100):
+        """Writes the output of the command into a compressed log file
+        instead of the writers. Only a one-line summary is logged when the
+        command finishes. If the command fails, the last lines of the
+        output are logged.
+
+        Args:
+            log_file (str): Target log file.
+            tail_lines (int, optional): Number of lines to log on failure.
+                Default is 100.
+
+        Returns:
+            SubprocessRule: The rule itself so that calls can be chained.
+        """
+        self._log_spool = LogSpool(log_file, tail_lines)
+        return self
+
+    @contextmanager
+    def _output_writers(self):
+        """Context manager that provides writers for stdout and stderr."""
+        if self._log_spool is None:
+            yield self._stdout_writer, self._stderr_writer
+            return
+        start = time.time()
+        with self._log_spool as log_spool:
+            log_spool.write(str(self))
+            try:
+                yield log_spool.write, log_spool.write
+            except Exception:
+                self._logger.error(
+                    '%s failed after %.1f s. Last lines of output (full log: %s):\n%s',
+                    self.short_description(), time.time() - start,
+                    log_spool.log_file, '\n'.join(log_spool.tail))
+                raise
+        self._logger.info(
+            '%s finished in %.1f s (log: %s)',
+            self.short_description(), time.time() - start, log_spool.log_file)
+
     @rule_error_wrapper
     def __call__(self, dry_run=False):
-        self._logger.info('Running %s', self)
+        if dry_run or self._log_spool is None:
+            self._logger.info('Running %s', self)
 
         if self._shell:
             cmd = [' '.join(self._sp_command)]
         else:
             cmd = self._sp_command
 
-        def logged_call():
-            def capture_io():
-                pass
-            try:
-                sp_call = subprocess.Popen(
-                    cmd,
-                    bufsize=0,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    env=self._env,
-                    shell=self._shell,
-                    cwd=self._cwd
-                )
-
-                loggers = {sp_call.stdout: self._stdout_writer,
-                           sp_call.stderr: self._stderr_writer}
-
-                def capture_io():
-                    output = select.select([sp_call.stdout, sp_call.stderr], [], [], 1000)[0]
-                    for io_stream in output:
-                        line = io_stream.readline()[:-1].decode('utf-8')
-                        if line:
-                            loggers[io_stream](line)
-
-                # Poll subprocess call for output
-                while sp_call.poll() is None:
-                    capture_io()
-
-                capture_io()
-
-                # Raise error if check is enabled
+        def logged_call(stdout_writer, stderr_writer):
+            sp_call = subprocess.Popen(
+                cmd,
+                bufsize=0,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=self._env,
+                shell=self._shell,
+                cwd=self._cwd
+            )
+
+            with sp_call:
+                # Drain output until both pipes have been closed
+                OutputPump({sp_call.stdout: stdout_writer,
+                            sp_call.stderr: stderr_writer}).run()
                 return_code = sp_call.wait()
-                if self._check and return_code != 0:
-                    raise subprocess.CalledProcessError(return_code, ' '.join(cmd))
-                return return_code
 
-            finally:
-                capture_io()
+            # Raise error if check is enabled
+            if self._check and return_code != 0:
+                raise subprocess.CalledProcessError(return_code, ' '.join(cmd))
+            return return_code
 
         if not dry_run:
-            return logged_call()
+            with self._output_writers() as (stdout_writer, stderr_writer):
+                return logged_call(stdout_writer, stderr_writer)
 
         return 0
 
+    @async_rule_error_wrapper
+    async def run_async(self, dry_run=False):
+        """Runs the command with asyncio subprocesses. Output is read from
+        asyncio streams, so no threads are needed for supervising the
+        subprocess.
+
+        Args:
+            dry_run (bool): Only describe the rule. Default is False.
+
+        Returns:
+            return_code (int): Return code of the subprocess call.
+        """
+        if dry_run or self._log_spool is None:
+            self._logger.info('Running %s', self)
+
+        if dry_run:
+            return 0
+
+        with self._output_writers() as (stdout_writer, stderr_writer):
+            return await self._logged_call_async(stdout_writer, stderr_writer)
+
+    async def _logged_call_async(self, stdout_writer, stderr_writer):
+        if self._shell:
+            sp_call = await asyncio.create_subprocess_shell(
+                ' '.join(self._sp_command),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._env,
+                cwd=self._cwd)
+        else:
+            sp_call = await asyncio.create_subprocess_exec(
+                *self._sp_command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._env,
+                cwd=self._cwd)
+
+        await asyncio.gather(
+            read_stream_async(sp_call.stdout, stdout_writer),
+            read_stream_async(sp_call.stderr, stderr_writer))
+        return_code = await sp_call.wait()
+
+        # Raise error if check is enabled
+        if self._check and return_code != 0:
+            raise subprocess.CalledProcessError(return_code, ' '.join(self._sp_command))
+        return return_code
+
+    def short_description(self):
+        return 'SubprocessRule: {0}'.format(' '.join(self._sp_command))
+
+    def _get_fingerprint_dict(self):
+        fingerprint_dict = super()._get_fingerprint_dict()
+        fingerprint_dict.update({
+            'sp_command': self._sp_command,
+            'env': self._orig_env,
+            'shell': self._shell,
+            'check': self._check,
+            'cwd': self._cwd,
+        })
+        return fingerprint_dict
+
+    def get_plan(self):
+        plan = super().get_plan()
+        plan.update({
+            'command': list(self._sp_command),
+            # Values of environment variables can contain secrets
+            'env_keys': sorted(self._orig_env or {}),
+            'shell': self._shell,
+            'cwd': self._cwd,
+        })
+        return plan
+
     def __str__(self):
         msg = 'SubprocessRule: {{ '
         msg_list = ['sp_function: {0}'.format(' '.join(self._sp_command))]
@@ -245,9 +761,23 @@ class LoggingRule(Rule):
     def __init__(self, message, stdout_writer=None):
         self._message = message
         super().__init__(stdout_writer, None)
+        self._resources['cpus'] = 0
 
     def __call__(self, dry_run=False):
         self._stdout_writer(self._message)
 
+    def short_description(self):
+        return 'LoggingRule: {0}'.format(self._message)
+
+    def _get_fingerprint_dict(self):
+        fingerprint_dict = super()._get_fingerprint_dict()
+        fingerprint_dict['message'] = self._message
+        return fingerprint_dict
+
+    def get_plan(self):
+        plan = super().get_plan()
+        plan['message'] = self._message
+        return plan
+
     def __str__(self):
         return 'LoggingRule: "{0}"'.format(self._message)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Scheduler runs build rules based on their dependencies.
+
+This module contains RuleScheduler class that is used by Builder to run
+build rules. Rules that have not declared any dependencies depend on every
+rule that precedes them, so a plain list of rules is run in order. Rules
+that have declared their dependencies can be run concurrently with other
+rules once their dependencies have finished.
+
+RuleScheduler runs rules on a pool of threads. AsyncRuleScheduler runs
+them as tasks in an asyncio event loop.
+
+Resources of each rule are reserved from a ResourcePool. A rule is started
+only when its CPU slots, memory and scratch disk class fit into the free
+capacity of the build host. The pool can be shared by the schedulers of
+several builders.
+"""
+import heapq
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from buildrules.common.rule import RuleError
+from buildrules.common.resources import ResourcePool
+
+class RuleScheduler:
+    """RuleScheduler runs a list of build rules on a pool of workers.
+
+    Args:
+        rules (list): List of build rules.
+        jobs (int, optional): Number of rules that can be run concurrently.
+            Default is 1.
+        capacity (ResourcePool, optional): Capacity of the build host.
+            Default is None, which uses the capacity of the whole host.
+
+    Raises:
+        ValueError: When a rule depends on a rule that does not precede it
+            in the rule list.
+    """
+
+    def __init__(self, rules, jobs=1, capacity=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._rules = rules
+        self._jobs = max(1, jobs)
+        if capacity is None:
+            capacity = ResourcePool()
+        self._capacity = capacity
+        self._dependencies = self.resolve_dependencies(rules)
+
+    @classmethod
+    def resolve_dependencies(cls, rules):
+        """Resolves the dependencies of rules into rule indices.
+
+        Rules without declared dependencies depend on all rules that
+        have not yet been depended upon. As every preceding rule leads to
+        one of these rules, such a rule will wait until every rule before
+        it has finished.
+
+        Args:
+            rules (list): List of build rules.
+
+        Returns:
+            list: List of sets that contain indices of the dependencies
+                of each rule.
+        """
+        indices = {id(rule): index for index, rule in enumerate(rules)}
+        dependencies = []
+        unconsumed = set()
+        for index, rule in enumerate(rules):
+            if rule.dependencies is None:
+                rule_dependencies = set(unconsumed)
+            else:
+                rule_dependencies = set()
+                for dependency in rule.dependencies:
+                    dependency_index = indices.get(id(dependency), None)
+                    if dependency_index is None or dependency_index >= index:
+                        raise ValueError(
+                            ('Rule {0} depends on rule {1} that does not '
+                             'precede it in the rule list').format(rule, dependency))
+                    rule_dependencies.add(dependency_index)
+            unconsumed -= rule_dependencies
+            unconsumed.add(index)
+            dependencies.append(rule_dependencies)
+        return dependencies
+
+    def _get_initial_state(self):
+        """Returns the remaining dependencies of each rule, the dependents
+        of each rule and a heap of rules that are ready to be run."""
+        remaining = {index: set(dependencies)
+                     for index, dependencies in enumerate(self._dependencies)}
+        dependents = defaultdict(list)
+        for index, dependencies in enumerate(self._dependencies):
+            for dependency in dependencies:
+                dependents[dependency].append(index)
+
+        ready = [index for index, dependencies in remaining.items() if not dependencies]
+        heapq.heapify(ready)
+        return remaining, dependents, ready
+
+    def _take_runnable(self, ready, n_running):
+        """Pops rules that fit into the free capacity from the ready heap.
+
+        Rules are considered in order. Rules that do not fit are put back
+        into the heap and smaller rules after them can be started instead.
+        Resources of the returned rules have been reserved.
+        """
+        runnable = []
+        blocked = []
+        while ready and n_running + len(runnable) < self._jobs:
+            index = heapq.heappop(ready)
+            if self._capacity.acquire(self._rules[index].resources):
+                runnable.append(index)
+            else:
+                blocked.append(index)
+        for index in blocked:
+            heapq.heappush(ready, index)
+        return runnable
+
+    def _wait_for_capacity(self, ready):
+        """Pops the first rule from the ready heap and waits until its
+        resources have been reserved.
+
+        This is used when none of the rules is running, so the capacity is
+        held by other users of a shared ResourcePool.
+        """
+        index = heapq.heappop(ready)
+        self._capacity.acquire(self._rules[index].resources, blocking=True)
+        return index
+
+    def _check_finished(self, n_finished):
+        """Raises RuleError if some of the rules were not run."""
+        if n_finished < len(self._rules):
+            raise RuleError('{0} of {1} rules were not run'.format(
+                len(self._rules) - n_finished, len(self._rules)))
+
+    def __call__(self, run_rule):
+        """Runs all rules.
+
+        Args:
+            run_rule (function): Function that is called with the index of
+                a rule and the rule itself. It should run the rule.
+
+        Raises:
+            RuleError: Raises the first error encountered. Rules that are
+                already running are allowed to finish, but no new rules
+                are started after an error.
+        """
+
+        if self._jobs == 1:
+            for index, rule in enumerate(self._rules):
+                self._capacity.acquire(rule.resources, blocking=True)
+                try:
+                    run_rule(index, rule)
+                finally:
+                    self._capacity.release(rule.resources)
+            return
+
+        remaining, dependents, ready = self._get_initial_state()
+        failure = None
+        n_finished = 0
+
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            running = {}
+
+            def submit_ready():
+                runnable = self._take_runnable(ready, len(running))
+                if not runnable and not running and ready:
+                    runnable = [self._wait_for_capacity(ready)]
+                for index in runnable:
+                    future = executor.submit(run_rule, index, self._rules[index])
+                    running[future] = index
+
+            submit_ready()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    self._capacity.release(self._rules[index].resources)
+                    try:
+                        future.result()
+                    except RuleError as error:
+                        if failure is None:
+                            failure = error
+                        continue
+                    n_finished += 1
+                    for dependent in dependents[index]:
+                        remaining[dependent].discard(index)
+                        if not remaining[dependent]:
+                            heapq.heappush(ready, dependent)
+                if failure is None:
+                    submit_ready()
+
+        if failure is not None:
+            raise failure
+        self._check_finished(n_finished)
+
+class AsyncRuleScheduler(RuleScheduler):
+    """AsyncRuleScheduler runs a list of build rules as asyncio tasks.
+
+    One event loop can supervise a large number of concurrent subprocesses
+    without a thread for each of them.
+
+    Args:
+        rules (list): List of build rules.
+        jobs (int, optional): Number of rules that can be run concurrently.
+            Default is 1.
+        capacity (ResourcePool, optional): Capacity of the build host.
+            Default is None, which uses the capacity of the whole host.
+    """
+
+    def __call__(self, run_rule):
+        """Runs all rules in a new event loop.
+
+        Args:
+            run_rule (function): Coroutine function that is called with the
+                index of a rule and the rule itself. It should run the rule.
+
+        Raises:
+            RuleError: Raises the first error encountered. Rules that are
+                already running are allowed to finish, but no new rules
+                are started after an error.
+        """
+        asyncio.run(self._run(run_rule))
+
+    async def _run(self, run_rule):
+        remaining, dependents, ready = self._get_initial_state()
+        failure = None
+        n_finished = 0
+        running = {}
+
+        async def submit_ready():
+            runnable = self._take_runnable(ready, len(running))
+            if not runnable and not running and ready:
+                index = await asyncio.get_running_loop().run_in_executor(
+                    None, self._wait_for_capacity, ready)
+                runnable = [index]
+            for index in runnable:
+                task = asyncio.ensure_future(run_rule(index, self._rules[index]))
+                running[task] = index
+
+        await submit_ready()
+        while running:
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                index = running.pop(task)
+                self._capacity.release(self._rules[index].resources)
+                try:
+                    task.result()
+                except RuleError as error:
+                    if failure is None:
+                        failure = error
+                    continue
+                n_finished += 1
+                for dependent in dependents[index]:
+                    remaining[dependent].discard(index)
+                    if not remaining[dependent]:
+                        heapq.heappush(ready, dependent)
+            if failure is None:
+                await submit_ready()
+
+        if failure is not None:
+            raise failure
+        self._check_finished(n_finished)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Stamps record completed build rules.
+
+This module contains StampStore class that is used by Builder to record
+fingerprints of completed build rules. Rules that have been marked with
+Rule.use_stamp are skipped when a stamp for their fingerprint exists.
+"""
+import os
+
+from buildrules.common.utils import write_file_atomic
+
+class StampStore:
+    """StampStore is a content-addressed store of rule fingerprints.
+
+    Each stamp is a file named after the fingerprint. Stamps are written
+    atomically so that the store can be shared between builder processes.
+
+    Args:
+        stamp_dir (str): Folder where stamps are stored.
+    """
+
+    def __init__(self, stamp_dir):
+        self._stamp_dir = stamp_dir
+
+    def _get_stamp_path(self, fingerprint):
+        return os.path.join(self._stamp_dir, fingerprint[:2], fingerprint)
+
+    def __contains__(self, fingerprint):
+        """Checks whether a stamp exists for a fingerprint.
+
+        Args:
+            fingerprint (str): Fingerprint of a rule.
+
+        Returns:
+            bool: True if the stamp exists.
+        """
+        return os.path.isfile(self._get_stamp_path(fingerprint))
+
+    def add(self, fingerprint, description=''):
+        """Adds a stamp for a fingerprint.
+
+        Args:
+            fingerprint (str): Fingerprint of a rule.
+            description (str): Description of the rule that is stored
+                into the stamp. Default is empty string.
+        """
+        write_file_atomic(
+            self._get_stamp_path(fingerprint), '{0}\n'.format(description))
+
+    def remove(self, fingerprint):
+        """Removes a stamp for a fingerprint if it exists.
+
+        Args:
+            fingerprint (str): Fingerprint of a rule.
+        """
+        try:
+            os.remove(self._get_stamp_path(fingerprint))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Timeline records where the time of a build goes.
+
+This module contains RuleTimeline class that is used by Builder to record
+the start and end times, the exit status and the phase of every build rule.
+Timelines can be exported as Chrome trace-event JSON files that can be
+opened with chrome://tracing or Perfetto.
+"""
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+from buildrules.common.utils import makedirs
+
+class RuleTimeline:
+    """RuleTimeline stores timing information of build rules.
+
+    Args:
+        build_id (str, optional): Identifier of the build. Default is None.
+    """
+
+    def __init__(self, build_id=None):
+        self._build_id = build_id
+        self._start_time = time.time()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def events(self):
+        """list: Recorded events sorted by their start time."""
+        with self._lock:
+            return sorted(self._events, key=lambda event: event['start'])
+
+    def record(self, index, rule, start, end, status):
+        """Records the execution of a rule.
+
+        Args:
+            index (int): Index of the rule.
+            rule (Rule): Rule that was executed.
+            start (float): Start time of the rule as given by time.time().
+            end (float): End time of the rule as given by time.time().
+            status (str): Exit status of the rule.
+        """
+        with self._lock:
+            thread = self._threads.setdefault(threading.get_ident(), len(self._threads))
+            self._events.append({
+                'index': index,
+                'name': rule.short_description(),
+                'type': rule.__class__.__name__,
+                'phase': rule.phase,
+                'start': start,
+                'end': end,
+                'duration': end - start,
+                'status': status,
+                'thread': thread,
+            })
+
+    def get_chrome_trace(self):
+        """Creates a Chrome trace-event representation of the timeline.
+
+        Returns:
+            dict: Trace in Chrome trace-event format.
+        """
+        pid = os.getpid()
+        trace_events = []
+        for event in self.events:
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['phase'] or 'None',
+                'ph': 'X',
+                'ts': int((event['start'] - self._start_time) * 1e6),
+                'dur': int(event['duration'] * 1e6),
+                'pid': pid,
+                'tid': event['thread'],
+                'args': {
+                    'index': event['index'],
+                    'type': event['type'],
+                    'status': event['status'],
+                },
+            })
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'build_id': self._build_id,
+                'start_time': self._start_time,
+            },
+        }
+
+    def write_chrome_trace(self, trace_file):
+        """Writes the timeline into a Chrome trace-event JSON file.
+
+        Args:
+            trace_file (str): Target file.
+        """
+        trace_folder = os.path.dirname(trace_file)
+        if trace_folder:
+            makedirs(trace_folder)
+        with open(trace_file, 'w', encoding='utf-8') as trace_f:
+            json.dump(self.get_chrome_trace(), trace_f)
+
+    def get_summary(self, slowest=10):
+        """Creates a summary table of the timeline.
+
+        Args:
+            slowest (int): Number of slowest rules to list. Default is 10.
+
+        Returns:
+            list: Lines of the summary table.
+        """
+        events = self.events
+        phase_durations = defaultdict(float)
+        phase_counts = defaultdict(int)
+        for event in events:
+            phase_durations[event['phase'] or 'None'] += event['duration']
+            phase_counts[event['phase'] or 'None'] += 1
+
+        wall_time = 0.0
+        if events:
+            wall_time = max(event['end'] for event in events) - min(event['start'] for event in events)
+
+        lines = ['Build timeline summary: {0} rules, wall time {1:.1f} s'.format(
+            len(events), wall_time)]
+        lines.append('{0:<40} {1:>6} {2:>12}'.format('Phase', 'Rules', 'Time (s)'))
+        for phase, duration in sorted(phase_durations.items(), key=lambda item: -item[1]):
+            lines.append('{0:<40} {1:>6} {2:>12.1f}'.format(
+                phase[:40], phase_counts[phase], duration))
+        lines.append('Slowest rules:')
+        lines.append('{0:>12} {1:<10} {2}'.format('Time (s)', 'Status', 'Rule'))
+        for event in sorted(events, key=lambda event: -event['duration'])[:slowest]:
+            lines.append('{0:>12.1f} {1:<10} {2}'.format(
+                event['duration'], event['status'], event['name'][:100]))
+        return lines
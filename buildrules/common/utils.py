@@ -5,35 +5,175 @@ import os
 import re
 import hashlib
 import json
+import stat
+import secrets
 import textwrap
 from shutil import copy2, copytree
 import yaml
-from jinja2 import Template
+
+try:
+    from yaml import CSafeLoader as YAMLLoader, CSafeDumper as CYAMLDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+    CYAMLDumper = None
 
 class YAMLDumper(yaml.SafeDumper):
 
     def increase_indent(self, flow=False, indentless=False):
         return super(YAMLDumper, self).increase_indent(flow, False)
 
+# Lines that contain complex mapping keys ('? key')
+COMPLEX_KEY_REGEX = re.compile(r'^[ -]*\? ', re.MULTILINE)
+
+def _get_node_column(stripped, column):
+    """Returns the column of the innermost node that starts on a line."""
+    while stripped.startswith('- '):
+        stripped = stripped[2:]
+        column += 2
+    return column
+
+def indent_sequences(yaml_str):
+    """ This function indents block sequences that are values of mappings
+    in the same way as YAMLDumper does. libyaml's emitter always writes
+    them at the same column as the mapping key.
+
+    Args:
+        yaml_str (str): YAML document written by libyaml without complex
+            mapping keys.
+    Returns:
+        str: YAML document with indented sequences.
+    """
+    lines = yaml_str.split('\n')
+    sequence_columns = []
+    previous_key_column = None
+    scalar_column = None
+    for index, line in enumerate(lines):
+        stripped = line.lstrip(' ')
+        if not stripped:
+            continue
+        column = len(line) - len(stripped)
+        if scalar_column is None or column <= scalar_column:
+            # Line starts a new node. Deeper lines after a scalar value
+            # continue a multi-line scalar.
+            is_item = stripped == '-' or stripped.startswith('- ')
+            while sequence_columns and (
+                    column < sequence_columns[-1] or
+                    (column == sequence_columns[-1] and not is_item)):
+                sequence_columns.pop()
+            if (is_item and previous_key_column == column and
+                    (not sequence_columns or sequence_columns[-1] != column)):
+                sequence_columns.append(column)
+            node_column = _get_node_column(stripped, column)
+            if stripped.endswith(':'):
+                previous_key_column = node_column
+                scalar_column = None
+            else:
+                previous_key_column = None
+                scalar_column = node_column if ': ' in stripped else node_column - 2
+        lines[index] = ' ' * (2 * len(sequence_columns)) + line
+    return '\n'.join(lines)
+
+def dump_yaml(contents, indent=True):
+    """ This function dumps contents into a YAML string. libyaml is used
+    when it is available.
+
+    Args:
+        contents (object): Contents to dump.
+        indent (bool): Indent block sequences that are values of mappings
+            like YAMLDumper does. Default is True.
+    Returns:
+        str: YAML document.
+    """
+    if CYAMLDumper is not None and isinstance(contents, (dict, list)):
+        yaml_str = yaml.dump(contents, default_flow_style=False, Dumper=CYAMLDumper)
+        if not indent:
+            return yaml_str
+        # Complex keys are rare, let YAMLDumper handle them
+        if not COMPLEX_KEY_REGEX.search(yaml_str):
+            return indent_sequences(yaml_str)
+    return yaml.dump(
+        contents,
+        default_flow_style=False,
+        Dumper=YAMLDumper if indent else yaml.SafeDumper)
+
+def parse_yaml(yaml_str):
+    """ This function parses a YAML document. libyaml is used when it is
+    available.
+
+    Args:
+        yaml_str (str): YAML document or an open file.
+    Returns:
+        object: Parsed contents.
+    """
+    return yaml.load(yaml_str, Loader=YAMLLoader)
+
 def remove_tabs(string):
     return re.sub('\t', '  ', string)
 
 def get_formatted_yaml(contents):
-    return remove_tabs(
-        yaml.dump(
-            contents,
-            default_flow_style=False,
-            Dumper=YAMLDumper))
+    return remove_tabs(dump_yaml(contents))
 
-def write_yaml(filename, contents):
+def write_yaml(filename, contents, indent=True):
     with open(filename, 'w') as yaml_file:
-        yaml_file.write(get_formatted_yaml(contents))
+        yaml_file.write(
+            get_formatted_yaml(contents) if indent else dump_yaml(contents, indent=False))
 
 def load_yaml(filename):
     with open(filename, 'r') as yaml_file:
-        contents = yaml.load(yaml_file, Loader=yaml.SafeLoader)
+        contents = parse_yaml(yaml_file)
     return contents
 
+def get_cache_dir(*subfolders):
+    """ This function returns a folder for buildrules' own caches. The root
+    of the cache can be set with BUILDRULES_CACHE_DIR-environment variable.
+
+    Args:
+        *subfolders (str): Subfolders inside the cache root.
+    Returns:
+        str: Path to the cache folder.
+    """
+    cache_root = os.getenv(
+        'BUILDRULES_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'buildrules'))
+    return os.path.join(cache_root, *subfolders)
+
+def write_file_atomic(filename, contents, chmod=None):
+    """ This function writes a file atomically. Contents are written into a
+    temporary file in the same folder that then replaces the target, so
+    that other processes never see a partially written file.
+
+    Args:
+        filename (str): File to write.
+        contents (str or bytes): Contents of the file. Bytes are written in
+            binary mode and strings are written as UTF-8.
+        chmod (int): Chmod permissions, e.g. 0o644. They are set before
+            the file replaces the target. Default is None, which keeps the
+            permissions of an existing target. New files get the default
+            permissions of new files, i.e. 0o666 without the umask.
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    makedirs(folder)
+    if chmod is None:
+        try:
+            chmod = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            pass
+    # Temporary file is created with os.open, as it applies the umask to
+    # the permissions like creating the file in place would.
+    tmp_name = os.path.join(folder, '.{0}.{1}.tmp'.format(
+        os.path.basename(filename), secrets.token_hex(8)))
+    mode, encoding = ('wb', None) if isinstance(contents, bytes) else ('w', 'utf-8')
+    tmp_fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with open(tmp_fd, mode, encoding=encoding) as tmp_file:
+            tmp_file.write(contents)
+            if chmod is not None:
+                os.chmod(tmp_name, chmod)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+    os.replace(tmp_name, filename)
+
 def makedirs(path, chmod=None):
     """ This function creates a folder with requested permissions
 
@@ -83,6 +223,7 @@ def fill_template(template, config):
     Returns:
         str: Filled template.
     """
+    from jinja2 import Template
     return Template(textwrap.dedent(template)).render(config).strip()
 
 def write_template(target_path, config, template_path=None, template=None, chmod=None):
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Validators validate configurations against JSON schemas.
+
+jsonschema.validate checks the schema and creates a new validator on every
+call. This module keeps a process-wide registry of validators that have
+been created for each schema, so that every schema is checked and compiled
+only once.
+
+Schemas are identified by a checksum of their contents, so equal schemas
+that are created separately share a validator.
+"""
+import copy
+import threading
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+from buildrules.common.utils import calculate_dict_checksum
+
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
+
+def get_validator(schema):
+    """Returns a validator for a schema. Validator is created and the schema
+    is checked when the schema is first used.
+
+    Args:
+        schema (dict): JSON schema.
+
+    Returns:
+        jsonschema.protocols.Validator: Validator for the schema.
+
+    Raises:
+        SchemaError: If the schema is invalid.
+    """
+    checksum = calculate_dict_checksum(schema)
+    validator = _VALIDATORS.get(checksum, None)
+    if validator is not None:
+        return validator
+    # Validator gets its own copy so that later changes to the schema
+    # object do not affect the cached validator.
+    schema = copy.deepcopy(schema)
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    validator = validator_class(schema)
+    with _VALIDATORS_LOCK:
+        _VALIDATORS[checksum] = validator
+    return validator
+
+def validate(instance, schema):
+    """Validates an instance against a schema. This works like
+    jsonschema.validate, but reuses the validator of the schema.
+
+    Args:
+        instance (object): Instance to validate.
+        schema (dict): JSON schema.
+
+    Raises:
+        ValidationError: If the instance is invalid.
+        SchemaError: If the schema is invalid.
+    """
+    error = best_match(get_validator(schema).iter_errors(instance))
+    if error is not None:
+        raise error
+
+def clear_validators():
+    """Removes all validators from the registry."""
+    with _VALIDATORS_LOCK:
+        _VALIDATORS.clear()
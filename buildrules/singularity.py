@@ -8,13 +8,12 @@ from collections import defaultdict
 import shutil
 import logging
 from glob import glob
-import yaml
 import copy
-import requests
-import sh
+import threading
 
-from buildrules.common.builder import Builder
-from buildrules.common.rule import PythonRule, SubprocessRule, LoggingRule, RuleError
+from buildrules.common.builder import Builder, rule_phase
+from buildrules.common.rule import (PythonRule, SubprocessRule, LoggingRule,
+                                    RuleError, chain_rules)
 from buildrules.common.confreader import ConfReader
 from buildrules.common.utils import (load_yaml, write_yaml, makedirs, copy_file,
         write_template, calculate_dict_checksum)
@@ -85,6 +84,10 @@ class SingularityBuilder(Builder):
                         },
                     },
                 },
+                'engine': {
+                    'type': 'string',
+                    'enum': ['sync', 'asyncio'],
+                },
                 'definitions': {
                     'type': 'array',
                     'default': [],
@@ -145,9 +148,12 @@ class SingularityBuilder(Builder):
         },
     }
 
-    def __init__(self, conf_folder):
+    def __init__(self, conf_folder, deployers=None):
         self._singularity_path = os.path.join(os.getcwd(), 'singularity')
-        super().__init__(conf_folder)
+        # Images can be built concurrently, so the installed images file
+        # is protected with a lock
+        self._installed_file_lock = threading.Lock()
+        super().__init__(conf_folder, deployers=deployers)
         self._source_cache = self._get_path('source_cache')
         self._tmpdir = self._get_path('tmpdir')
         self._build_stage = self._get_path('build_stage')
@@ -188,6 +194,7 @@ class SingularityBuilder(Builder):
 
         return auths
 
+    @rule_phase
     def _get_directory_creation_rules(self):
         rules = []
 
@@ -229,15 +236,10 @@ class SingularityBuilder(Builder):
             image_name (str): Name of the image.
             image_config (dict): Anaconda environment config.
         """
-        installed_dict = self._get_installed_images()
-        installed_dict['images'][image_name] = installation_config
-        with open(self._installed_file, 'w') as installed_file:
-            installed_file.write(
-                yaml.dump(
-                    installed_dict,
-                    default_flow_style=False,
-                    Dumper=yaml.SafeDumper
-                ))
+        with self._installed_file_lock:
+            installed_dict = self._get_installed_images()
+            installed_dict['images'][image_name] = installation_config
+            write_yaml(self._installed_file, installed_dict, indent=False)
 
 
     def _get_image_config(self, tag, definition_dict):
@@ -326,6 +328,7 @@ class SingularityBuilder(Builder):
                 hide_env=True)
             cmd()
 
+    @rule_phase
     def _get_image_install_rules(self):
 
         rules = []
@@ -344,9 +347,12 @@ class SingularityBuilder(Builder):
             'remove_after_update',
             False)
 
+        # Images are built after staging has been cleaned, but they do not
+        # depend on each other.
+        start_rule = PythonRule(self._clean_staging)
         rules.extend([
             LoggingRule('Cleaning up images in staging path: %s' % self._build_stage),
-            PythonRule(self._clean_staging),
+            start_rule,
         ])
 
         for definition in self._confreader['build_config']['definitions']:
@@ -398,10 +404,12 @@ class SingularityBuilder(Builder):
                 image_config['image_file'] = install_image
                 image_config['module_path'] = module_path
 
+                image_rules = []
+
                 build_env = copy.deepcopy(default_env)
                 auths = self._auths.get(image_config['registry'], None)
                 if auths:
-                    rules.append(
+                    image_rules.append(
                         LoggingRule(
                             ("Using authentication for user "
                              "'%s' with registry '%s'") % (auths['username'], image_config['registry'])
@@ -433,11 +441,11 @@ class SingularityBuilder(Builder):
                     install_msg = ("Image {0} is "
                                    "not installed. Starting installation.")
 
-                rules.append(LoggingRule(install_msg.format(install_name)))
+                image_rules.append(LoggingRule(install_msg.format(install_name)))
 
                 if not skip_install:
 
-                     rules.extend([
+                     image_rules.extend([
                          PythonRule(makedirs, [stage_definition_path]),
                          PythonRule(makedirs, [stage_image_path]),
                          PythonRule(makedirs, [install_definition_path]),
@@ -445,7 +453,7 @@ class SingularityBuilder(Builder):
                          PythonRule(makedirs, [module_path]),
                      ])
 
-                     rules.extend([
+                     image_rules.extend([
                          LoggingRule(
                              'Writing definition file for %s' % install_name),
                          PythonRule(
@@ -465,7 +473,7 @@ class SingularityBuilder(Builder):
                      fakeroot = (image_config.get('fakeroot', False) or
                                  self._confreader['config']['config'].get(
                                      'fakeroot', False))
-                     rules.extend([
+                     image_rules.extend([
                          LoggingRule(
                              'Building image for %s' % install_name),
                          PythonRule(
@@ -473,31 +481,32 @@ class SingularityBuilder(Builder):
                              [stage_image, stage_definition],
                              {'debug': debug, 'sudo': sudo, 'fakeroot': fakeroot,
                               'build_env': build_env},
-                             hide_kwargs=True)
+                             hide_kwargs=True
+                         ).set_resources(cpus=1, scratch='large')
                      ])
 
                      if sudo:
                          chown_cmd = ['chown', '{0}:{0}'.format(uid)]
-                         rules.append(
+                         image_rules.append(
                              SubprocessRule(
                                  chown_cmd + [stage_image],
                                  shell=True))
 
-                     rules.extend([
+                     image_rules.extend([
                          LoggingRule(
                              'Copying staged image to installation directory'),
                          PythonRule(
                              copy_file, [stage_image, install_image]),
                      ])
 
-                     rules.extend([
+                     image_rules.extend([
                          LoggingRule(
                              'Copying definition file to installation directory'),
                          PythonRule(
                              copy_file, [stage_definition, install_definition]),
                      ])
 
-                     rules.extend([
+                     image_rules.extend([
                          LoggingRule(
                              'Updating installed images'),
                          PythonRule(
@@ -506,12 +515,12 @@ class SingularityBuilder(Builder):
                      ])
 
                      if update_install and remove_after_update:
-                         rules.extend([
+                         image_rules.extend([
                              LoggingRule(('Removing old image from '
                                           '{0}').format(previous_image_path)),
                              PythonRule(os.remove, [previous_image_path])])
 
-                rules.extend([
+                image_rules.extend([
                     LoggingRule('Writing modulefile for %s' % install_name),
                     PythonRule(
                         self._write_modulefile,
@@ -519,6 +528,8 @@ class SingularityBuilder(Builder):
                          image_config['flags'], install_image, module_path]),
                 ])
 
+                rules.extend(chain_rules(image_rules, [start_rule]))
+
         return rules
 
     def _write_modulefile(self, name, tag, flags, image_file, module_path):
@@ -606,6 +617,7 @@ class SingularityBuilder(Builder):
             for modulefile in modulefiles:
                 os.remove(modulefile)
 
+    @rule_phase
     def _get_modulefile_clean_rules(self):
         """ This function creates build rules that clean up modulefiles.
 
@@ -5,31 +5,29 @@ import sys
 import re
 import os
 import shutil
-import logging
 from glob import glob
-import yaml
-import sh
-import warnings
+import json
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
-from buildrules.common.builder import Builder
+from buildrules.common.builder import Builder, rule_phase
 from buildrules.common.rule import PythonRule, SubprocessRule, LoggingRule
-from buildrules.common.utils import makedirs, copy_file
-
-SPACK_ROOT=os.getenv('SPACK_ROOT', None)
-if not SPACK_ROOT:
-    warnings.warn('Spack environment is not activated. Spack configuration schemas are not verified correctly!')
-    config_schema = {}
-    modules_schema = {}
-    packages_schema = {}
-else:
-    SPACK_LIB_PATH=os.path.join(SPACK_ROOT, 'lib/spack')
-    SPACK_EXTERNAL_LIB_PATH=os.path.join(SPACK_ROOT, 'lib/spack/external')
-    sys.path.append(SPACK_LIB_PATH)
-    sys.path.append(SPACK_EXTERNAL_LIB_PATH)
-    import spack.config
-    config_schema = spack.schema.config.schema
-    modules_schema = spack.schema.modules.schema
-    packages_schema = spack.schema.packages.schema
+from buildrules.common.utils import (makedirs, copy_file, get_cache_dir, dump_yaml,
+                                     calculate_dict_checksum, calculate_file_checksum,
+                                     write_file_atomic)
+from buildrules.common.resources import get_host_cpus
+from buildrules.spackutils import (SPACK_ROOT, LOCATION_SCRIPT, ENVIRONMENT_CHECK_SCRIPT,
+                                   BUILDCONFIG_SCHEMA, CompilersFile, SpackQueryServer,
+                                   SpackQueryError, InstalledSpecIndex, parse_json_output,
+                                   find_files, sync_modulefiles, get_spack_revision,
+                                   get_spack_schemas, get_package_repos, get_repo_revision)
+
+# Compiler names in compiler specs ('%gcc@9.3.0') of a spec string
+COMPILER_SPEC_REGEX = re.compile(r'%([\w-]+)')
+
+class SpackInstallError(Exception):
+    """SpackInstallError is raised when packages were not installed."""
 
 class SpackBuilder(Builder):
     """SpackBuilder extends on Builder and creates buildrules for Spack build.
@@ -37,102 +35,80 @@ class SpackBuilder(Builder):
 
     BUILDER_NAME = 'Spack'
     CONF_FILES = ['config.yaml', 'modules.yaml', 'packages.yaml', 'build_config.yaml']
-    SCHEMAS = [
-        config_schema,
-        modules_schema,
-        packages_schema,
-        {
-            '$schema': 'http://json-schema.org/schema#',
-            'title': 'Package configuration file schema',
-            'type': 'object',
-            'additionalProperties': False,
-            'patternProperties': {
-                'target_architecture': {
-                    'type': 'object',
-                    'properties': {
-                        'platform': {'type': 'string'},
-                        'os': {'type': 'string'},
-                        'target': {'type': 'string'},
-                    },
-                },
-                'compilers': {
-                    'type': 'array',
-                    'default': [],
-                    'items': {
-                        'type': 'object',
-                        'properties': {
-                            'name': {'type': 'string'},
-                            'version': {'type': 'string'},
-                            'system_compiler': {'type': 'boolean'},
-                            'licenses': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'variants': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'dependencies': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'extra_flags': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'flags': {
-                                'type': 'object',
-                                'properties': {
-                                    'cflags': {'type': 'string'},
-                                    'cxxflags': {'type': 'string'},
-                                    'fflags': {'type': 'string'},
-                                    'cppflags': {'type': 'string'},
-                                    'ldflags': {'type': 'string'},
-                                    'ldlibs': {'type': 'string'},
-                                },
-                            },
-                        },
-                        'required': ['name', 'version'],
-                    },
-                },
-                'packages': {
-                    'type': 'array',
-                    'default': [],
-                    'items': {
-                        'type': 'object',
-                        'properties': {
-                            'name': {'type': 'string'},
-                            'version': {'type': 'string'},
-                            'licenses': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'variants': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'dependencies': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                            'extra_flags': {
-                                'type': 'array',
-                                'items': {'type': 'string'},
-                            },
-                        },
-                        'required': ['name', 'version'],
-                    },
-                },
-            },
-        }]
-
-
-    def __init__(self, conf_folder):
+    # Schemas of config.yaml, modules.yaml and packages.yaml are loaded from
+    # Spack by _get_schemas.
+    SCHEMAS = [BUILDCONFIG_SCHEMA]
+
+    # Names in compiler specs of compiler packages whose Spack compiler
+    # name differs from the package name
+    COMPILER_NAMES = {
+        'intel-parallel-studio': ['intel'],
+        'intel-oneapi-compilers': ['oneapi', 'intel'],
+        'llvm': ['clang'],
+        'llvm-amdgpu': ['rocmcc'],
+    }
+
+    # Scratch class of package installations. Its limit is the number of
+    # parallel installations.
+    INSTALL_SCRATCH = 'spack-install'
+
+    # Number of modulefiles synced by one task of the thread pool
+    MODULEFILE_CHUNK_SIZE = 256
+
+    def __init__(self, conf_folder, deployers=None):
         self._spack_cmd = ['spack', '--config-scope', conf_folder]
-        self._spack_sh = sh.spack.bake('--config-scope', conf_folder)
+        self._conf_folder = conf_folder
+        self._spack_sh_cmd = None
         self._compilers_file = os.path.expanduser('~/.spack/linux/compilers.yaml')
-        super().__init__(conf_folder)
+        self._installed_index = None
+        self._compilers = None
+        self._query_server = None
+        self._spack_revision = None
+        self._repo_revisions = None
+        self._installed_prefixes = None
+        self._installed_lock = threading.Lock()
+        self._install_counts = {'installed': 0, 'to_build': 0}
+        super().__init__(conf_folder, deployers=deployers)
+        # Server is created before any rule runs, so that concurrent rules
+        # share one server process. The process is started on the first
+        # query.
+        if self._confreader['build_config'].get('query_server', False):
+            self._query_server = SpackQueryServer(self._spack_cmd)
+
+    def _get_schemas(self):
+        return get_spack_schemas() + self.SCHEMAS
+
+    def _get_spack_sh(self):
+        """Returns the sh.Command of Spack for queries made while the build
+        is running. sh is imported only when it is needed."""
+        if self._spack_sh_cmd is None:
+            import sh
+            self._spack_sh_cmd = sh.spack.bake('--config-scope', self._conf_folder)
+        return self._spack_sh_cmd
+
+    def _spack_query(self, *args):
+        """Runs a Spack command that only queries Spack and returns its
+        output. If 'query_server' is set in build_config, query commands
+        are run in a long-lived SpackQueryServer process. Otherwise a new
+        Spack process is started for each query."""
+        if self._query_server is not None and args[0] in SpackQueryServer.COMMANDS:
+            return self._query_server.query(*args)
+        return str(self._get_spack_sh()(*args))
+
+    def _stop_query_server(self):
+        """Stops the query server. It is started again on the next query,
+        so it is stopped whenever Spack's configuration or compilers
+        change."""
+        if self._query_server is not None:
+            self._query_server.stop()
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            self._stop_query_server()
 
+    @rule_phase
     def _get_reindex_rules(self):
         logging_rule = LoggingRule('Re-indexing installed packages.')
         reindex_rule = SubprocessRule(self._spack_cmd + ['reindex'])
@@ -141,7 +117,7 @@ class SpackBuilder(Builder):
     def _get_spec_string(self, package_config):
         return ' '.join(self._get_spec_list(package_config))
 
-    def _get_target_architecture_flags(self, package_config):
+    def _get_target_architecture(self, package_config):
         target_architecture = {
             'platform': 'linux',
             'os': 'None',
@@ -149,9 +125,50 @@ class SpackBuilder(Builder):
         }
         target_architecture.update(self._confreader['build_config'].get('target_architecture', {}))
         target_architecture.update(package_config.get('target_architecture', {}))
+        return target_architecture
+
+    def _get_target_architecture_flags(self, package_config):
+        target_architecture = self._get_target_architecture(package_config)
         arch_flags = ['arch={platform}-{os}-{arch}'.format(**target_architecture)]
         return arch_flags
 
+    def _get_installed_index(self):
+        """Returns the index of installed specs. Spack is queried only once
+        when the rules are first created."""
+        if self._installed_index is None:
+            specs = []
+            if shutil.which('spack'):
+                import sh
+                try:
+                    specs = parse_json_output(self._spack_query('find', '--json') or '[]')
+                except (sh.ErrorReturnCode, SpackQueryError, ValueError) as error:
+                    self._logger.warning('Could not query installed specs: %s', error)
+            else:
+                self._logger.warning('Spack was not found. Installed specs are not checked.')
+            self._installed_index = InstalledSpecIndex(specs)
+        return self._installed_index
+
+    def _filter_installed(self, packages):
+        """Returns the packages that need to be installed. If
+        'skip_installed' is set in build_config, packages that are satisfied
+        by an installed spec are left out."""
+        if not self._confreader['build_config'].get('skip_installed', False):
+            self._install_counts['to_build'] += len(packages)
+            return packages
+        installed_index = self._get_installed_index()
+        to_build = []
+        for package_config in packages:
+            if installed_index.satisfies(
+                    package_config, self._get_target_architecture(package_config)):
+                self._logger.info(
+                    "Spec '%s' is already installed. Skipping its installation.",
+                    self._get_spec_string(package_config))
+                self._install_counts['installed'] += 1
+            else:
+                to_build.append(package_config)
+        self._install_counts['to_build'] += len(to_build)
+        return to_build
+
     @classmethod
     def _get_extra_flags(cls, package_config):
         extra_flags = []
@@ -167,6 +184,7 @@ class SpackBuilder(Builder):
         return spec_list
 
     def _remove_compilers_file(self):
+        self._stop_query_server()
         try:
             os.remove(self._compilers_file)
         except OSError:
@@ -178,39 +196,306 @@ class SpackBuilder(Builder):
         self._logger.debug(msg='Creating package spec rule for spec: {0}'.format(spec_str))
         return SubprocessRule(self._spack_cmd + ['spec'] + spec_list)
 
-    def _get_package_install_rule(self, package_config):
+    def _get_spack_config(self):
+        """Returns the 'config' section of Spack's config.yaml."""
+        return (self._confreader.get('config', {}) or {}).get('config', {}) or {}
+
+    def _get_parallel_installs(self, warn=False):
+        """Returns the maximum number of concurrent package installations
+        set with 'parallel_installs' in build_config or None if the number
+        is not limited.
+
+        Concurrent installations rely on Spack's prefix locks for shared
+        dependencies, so installations are run one at a time if locks are
+        disabled in Spack's config.yaml. This is logged as a warning if
+        warn is True."""
+        parallel_installs = self._confreader['build_config'].get('parallel_installs', None)
+        if parallel_installs is not None and parallel_installs > 1:
+            if not self._get_spack_config().get('locks', True):
+                if warn:
+                    self._logger.warning(
+                        'Spack locks are disabled. Installing packages one at a time.')
+                parallel_installs = 1
+        return parallel_installs
+
+    def _get_install_cpus(self, package_config, parallel_installs=None):
+        """Returns the number of CPU slots used by an installation. It is
+        taken from the package, from 'install_cpus' in build_config or from
+        'build_jobs' in Spack's config.yaml. Otherwise CPUs of the host are
+        split between parallel installations. By default Spack's own default
+        of at most 16 jobs is used."""
+        cpus = package_config.get(
+            'cpus', self._confreader['build_config'].get('install_cpus', None))
+        if cpus is None:
+            default_cpus = min(16, get_host_cpus() // (parallel_installs or 1))
+            cpus = self._get_spack_config().get('build_jobs', default_cpus)
+        return max(1, int(cpus))
+
+    def _get_scratch_limits(self):
+        """Concurrent package installations are limited with the
+        'spack-install' scratch class."""
+        parallel_installs = self._get_parallel_installs()
+        if parallel_installs is None:
+            return {}
+        return {self.INSTALL_SCRATCH: parallel_installs}
+
+    def _get_spack_revision(self):
+        """Returns the revision of Spack in SPACK_ROOT or None if Spack
+        environment is not activated."""
+        if self._spack_revision is None and SPACK_ROOT:
+            self._spack_revision = get_spack_revision(SPACK_ROOT)
+        return self._spack_revision
+
+    @staticmethod
+    def _get_scope_folders():
+        """Returns the folders of Spack's site and user configuration
+        scopes."""
+        scope_folders = [os.path.expanduser('~/.spack')]
+        if SPACK_ROOT:
+            scope_folders.insert(0, os.path.join(SPACK_ROOT, 'etc', 'spack'))
+        return scope_folders
+
+    def _get_scope_config_files(self):
+        """Returns the configuration files of Spack's site and user scopes
+        that affect concretization and installation in addition to the
+        files in the configuration folder."""
+        return [
+            os.path.join(scope_folder, config_file)
+            for scope_folder in self._get_scope_folders()
+            for config_file in ['config.yaml', 'packages.yaml', 'repos.yaml']
+        ]
+
+    def _get_repo_revisions(self):
+        """Returns the revisions of custom package repositories that are
+        listed in repos.yaml of Spack's site and user scopes and of the
+        configuration folder."""
+        if self._repo_revisions is None:
+            conf_folders = self._get_scope_folders() + [self._conf_folder]
+            self._repo_revisions = {
+                repo_path: get_repo_revision(repo_path)
+                for repo_path in get_package_repos(conf_folders, SPACK_ROOT)
+            }
+        return self._repo_revisions
+
+    def _is_installed(self, package_config):
+        """Returns True if a package is installed. Installed packages of
+        the whole build are located with one query when the first package
+        is checked."""
+        with self._installed_lock:
+            if self._installed_prefixes is None:
+                packages = (self._confreader['build_config']['compilers'] +
+                            self._confreader['build_config']['packages'])
+                spec_strs = [
+                    ' '.join(self._get_spec_list(package) +
+                             self._get_target_architecture_flags(package))
+                    for package in packages
+                ]
+                import sh
+                try:
+                    prefixes = self._locate_specs(spec_strs)
+                except (sh.ErrorReturnCode, SpackQueryError, ValueError) as error:
+                    self._logger.warning('Could not query installed packages: %s', error)
+                    prefixes = [None] * len(spec_strs)
+                self._installed_prefixes = dict(zip(spec_strs, prefixes))
+        spec_str = ' '.join(self._get_spec_list(package_config) +
+                            self._get_target_architecture_flags(package_config))
+        if self._installed_prefixes.get(spec_str, None):
+            return True
+        self._logger.info("Package '%s' is no longer installed.", spec_str)
+        return False
+
+    def _get_concretization_inputs(self):
+        """Returns the inputs of concretization other than the specs: the
+        Spack configuration, the available compilers, the revision of Spack
+        and the revisions of custom package repositories."""
+        config_files = [
+            os.path.join(self._conf_folder, 'config.yaml'),
+            os.path.join(self._conf_folder, 'packages.yaml'),
+            self._compilers_file,
+        ] + self._get_scope_config_files()
+        return {
+            'files': {
+                config_file: (calculate_file_checksum(config_file)
+                              if os.path.isfile(config_file) else None)
+                for config_file in config_files
+            },
+            'spack': self._get_spack_revision(),
+            'repos': self._get_repo_revisions(),
+        }
+
+    def _get_concretization_key(self, package_config):
+        """Returns the key of a concrete spec in the concretization cache.
+        Concretization depends on the spec and on the inputs from
+        _get_concretization_inputs."""
+        return calculate_dict_checksum(dict(
+            self._get_concretization_inputs(),
+            spec=self._get_spec_list(package_config),
+            arch=self._get_target_architecture_flags(package_config)))
+
+    def _get_spec_file(self, package_config):
+        """Returns the file that contains the current concrete spec of a
+        package."""
+        spec_checksum = calculate_dict_checksum(
+            self._get_spec_list(package_config) +
+            self._get_target_architecture_flags(package_config))
+        return os.path.join(
+            self._get_conf_cache_dir(), 'specs', '{0}.json'.format(spec_checksum))
+
+    def _concretize_spec(self, package_config, spec_file):
+        """Writes the concrete spec of a package into spec_file. Spack's
+        solver is run only if the spec is not in the concretization cache."""
+        spec_str = self._get_spec_string(package_config)
+        key = self._get_concretization_key(package_config)
+        cache_file = get_cache_dir('spack', 'concretized', key[:2], '{0}.json'.format(key))
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as cached_spec:
+                concrete_spec = json.load(cached_spec)
+            self._logger.info("Using cached concretization of spec '%s'.", spec_str)
+        except (OSError, ValueError):
+            spec_args = (['spec', '--json'] +
+                         self._get_spec_list(package_config) +
+                         self._get_target_architecture_flags(package_config))
+            # Output can contain warnings before the concrete spec
+            concrete_spec = parse_json_output(self._spack_query(*spec_args))
+            write_file_atomic(cache_file, json.dumps(concrete_spec))
+        write_file_atomic(spec_file, json.dumps(concrete_spec))
+
+    def _get_package_install_rule(self, package_config, parallel_installs=None,
+                                  spec_file=None):
         spec_str = self._get_spec_string(package_config)
         spec_list = self._get_spec_list(package_config)
         extra_flags = self._get_extra_flags(package_config)
         arch_flags = self._get_target_architecture_flags(package_config)
+        cpus = self._get_install_cpus(package_config, parallel_installs)
         self._logger.debug(msg='Creating package install rule for spec: {0}'.format(spec_str))
+        input_files = [self._compilers_file] + self._get_scope_config_files()
+        if spec_file is None:
+            spec_args = spec_list + arch_flags
+        else:
+            spec_args = ['-f', spec_file]
+            input_files.append(spec_file)
+        install_args = ['install', '-v'] + extra_flags + spec_args
+        # Installation is skipped if neither the command, the compilers, the
+        # Spack configuration, the revision of Spack nor the revisions of
+        # custom package repositories have changed since the last
+        # installation and the package is still installed. Number
+        # of build jobs does not change the result, so it is left out of the
+        # fingerprint. Spack builds with as many jobs as the rule has
+        # reserved CPU slots.
         return SubprocessRule(
-            self._spack_cmd + ['install', '-v'] + extra_flags + spec_list + arch_flags)
-
-    def _set_compiler_flags(self, spec, flags):
-        if os.path.isfile(self._compilers_file):
-            with open(self._compilers_file, 'r') as compilers_file:
-                compiler_dict = yaml.load(compilers_file, Loader=yaml.SafeLoader)
-            for index, compiler in zip(range(len(compiler_dict['compilers'])),
-                                       compiler_dict['compilers']):
-                if compiler['compiler']['spec'] == spec:
-                    compiler_dict['compilers'][index]['compiler']['flags'] = flags
-            with open(self._compilers_file, 'w') as compilers_file:
-                compilers_file.write(
-                    yaml.dump(
-                        compiler_dict,
-                        default_flow_style=False,
-                        Dumper=yaml.SafeDumper
-                    ))
+            self._spack_cmd + install_args[:2] + ['-j', str(cpus)] + install_args[2:]
+        ).set_resources(
+            cpus=cpus,
+            scratch=self.INSTALL_SCRATCH if parallel_installs is not None else None
+        ).use_stamp(
+            files=input_files,
+            config={
+                'config': self._confreader['config'],
+                'packages': self._confreader['packages'],
+                'spack': self._get_spack_revision(),
+                'repos': self._get_repo_revisions(),
+            },
+            actions=self._spack_cmd + install_args,
+            check=partial(self._is_installed, package_config))
+
+    def _get_package_rules(self, package_config, parallel_installs=None):
+        """Returns the rules that install a package. If
+        'concretization_cache' is set in build_config, the package is
+        installed from a concrete spec that is concretized by a separate
+        rule. The installation rule is the last rule."""
+        if not self._confreader['build_config'].get('concretization_cache', False):
+            return [self._get_package_install_rule(package_config, parallel_installs)]
+        spec_file = self._get_spec_file(package_config)
+        concretize_rule = PythonRule(
+            self._concretize_spec, [package_config, spec_file]
+        ).set_resources(cpus=1)
+        install_rule = self._get_package_install_rule(
+            package_config, parallel_installs, spec_file=spec_file
+        ).depends_on(concretize_rule)
+        return [concretize_rule, install_rule]
+
+    def _get_compilers(self):
+        """Returns the model of compilers.yaml. The file is parsed again
+        only if it has changed since it was last read or written."""
+        if self._compilers is None or not self._compilers.is_current():
+            self._compilers = CompilersFile(self._compilers_file)
+        return self._compilers
+
+    def _set_compiler_flags(self, package_configs):
+        """Sets the flags of all compilers in one pass over compilers.yaml."""
+        compilers = self._get_compilers()
+        for package_config in package_configs:
+            spec = self._get_spec_list(package_config)[0]
+            compilers.set_flags(spec, package_config.get('flags', {}))
+        compilers.write()
+        self._stop_query_server()
 
     def _show_compilers(self):
         self._logger.info('Following compilers found:')
-        if os.path.isfile(self._compilers_file):
-            with open(self._compilers_file, 'r') as compilers_file:
-                compiler_dict = yaml.load(compilers_file, Loader=yaml.SafeLoader)
-            for compiler in compiler_dict['compilers']:
-                self._logger.info(compiler['compiler']['spec'])
+        for spec in self._get_compilers().specs:
+            self._logger.info(spec)
+
+    def _add_compilers(self, package_configs, add_default=False):
+        """Adds installed compilers to Spack with one 'spack compiler add'.
+        Installation directories of the compilers are located with one
+        query and compilers that are not installed are skipped. Output of
+        'spack compiler add' is logged. If it fails to add the installed
+        compilers, a warning is logged and the build continues. Failures to
+        add the default compilers are raised.
+
+        Args:
+            package_configs (list): Compiler configurations.
+            add_default (bool): Also add compilers found in PATH like
+                'spack compiler add' without arguments does. Default is False.
+        """
+        paths = []
+        if add_default:
+            paths.extend(
+                path for path in os.getenv('PATH', '').split(os.pathsep)
+                if os.path.isdir(path))
+        if package_configs:
+            install_dirs = self._get_install_dirs(package_configs)
+            for package_config, install_dir in zip(package_configs, install_dirs):
+                if install_dir:
+                    paths.append(install_dir)
+                else:
+                    self._logger.debug(
+                        "Compiler '%s' is not installed.", self._get_spec_string(package_config))
+        if paths:
+            import sh
+
+            def compiler_add(*args):
+                self._get_spack_sh()(
+                    'compiler', 'add', *args,
+                    _out=lambda line: self._logger.info(line.rstrip('\n')),
+                    _err=lambda line: self._logger.error(line.rstrip('\n')))
+
+            try:
+                compiler_add(*paths)
+            except sh.ErrorReturnCode as error:
+                if add_default:
+                    # Default compilers are added on their own to find out
+                    # whether they caused the failure. Their failure stops
+                    # the build.
+                    compiler_add()
+                self._logger.warning(
+                    "'spack compiler add' failed with exit code %d.", error.exit_code)
+            self._stop_query_server()
 
+    def _get_compiler_add_rules(self, package_configs, add_default=False):
+        return [
+            PythonRule(self._add_compilers, [package_configs, add_default]),
+            PythonRule(self._set_compiler_flags, [package_configs]),
+        ]
+
+    @classmethod
+    def _get_compiler_names(cls, package_config):
+        """Returns the names a compiler package can have in compiler specs
+        ('%name') of other packages."""
+        return {package_config['name']} | set(
+            cls.COMPILER_NAMES.get(package_config['name'], []))
+
+    @rule_phase
     def _get_compiler_install_rules(self):
         rules = []
         self._logger.debug(msg='Parsing rules for compilers:')
@@ -218,119 +503,345 @@ class SpackBuilder(Builder):
         rules.append(LoggingRule('Removing old compilers.yml'))
         rules.append(PythonRule(self._remove_compilers_file))
 
-        def get_compiler_find_rule(spec_list):
-            return SubprocessRule(
-                (self._spack_cmd + ['find', '-p'] +
-                 spec_list +
-                 (['|', 'tail', '-n', '1', '|', 'awk', "'{",
-                   'print', '$2', "}'", '|', 'xargs', '-r']) +
-                 self._spack_cmd + ['compiler', 'add']),
-                shell=True,
-                check=False)
-
-        def get_compiler_flags_rule(spec_list, package_config):
-            flags = package_config.get('flags', {})
-            return PythonRule(self._set_compiler_flags, [spec_list[0], flags])
-
-
-        rules.extend([
-            LoggingRule('Adding default compilers.'),
-            SubprocessRule(
-                self._spack_cmd + ['compiler', 'add'],
-            )
-        ])
+        # All compilers are added in batches. Each batch starts Spack
+        # twice: once to locate the compilers and once to add them.
+        rules.append(LoggingRule('Adding default and existing compilers.'))
+        rules.extend(self._get_compiler_add_rules(compiler_packages, add_default=True))
 
-        rules.append(LoggingRule('Adding existing compilers.'))
-        for package_config in compiler_packages:
-            spec_str = self._get_spec_string(package_config)
-            spec_list = self._get_spec_list(package_config)
-            self._logger.debug(msg='Creating compiler find rule for spec: {0}'.format(spec_str))
-            rules.extend([
-                get_compiler_find_rule(spec_list),
-                get_compiler_flags_rule(spec_list, package_config)
-            ])
         rules.append(LoggingRule('Installing compilers.'))
+        compilers_to_build = self._filter_installed([
+            package_config for package_config in compiler_packages
+            if not package_config.get('system_compiler', False)
+        ])
+        # Compilers installed during the build are added after the
+        # installations, or earlier if a later compiler is built with them.
+        # Compiler specs that do not name an added compiler are assumed to
+        # need one of the installed compilers. Compilers whose spec does not
+        # name a compiler are built with Spack's default compiler, which can
+        # be any of the installed compilers, so they are added first.
+        added_names = set()
         for package_config in compiler_packages:
-            spec_list = self._get_spec_list(package_config)
-            if not package_config.get('system_compiler', False):
-                rules.extend([
-                    self._get_package_install_rule(package_config),
-                    get_compiler_find_rule(spec_list),
-                    get_compiler_flags_rule(spec_list, package_config)
-                ])
+            if package_config not in compilers_to_build:
+                added_names |= self._get_compiler_names(package_config)
+        installed = []
+        for package_config in compilers_to_build:
+            spec_str = self._get_spec_string(package_config)
+            installed_names = set()
+            for compiler in installed:
+                installed_names |= self._get_compiler_names(compiler)
+            compiler_names = COMPILER_SPEC_REGEX.findall(spec_str)
+            if installed and (not compiler_names or
+                              any(name in installed_names or name not in added_names
+                                  for name in compiler_names)):
+                rules.extend(self._get_compiler_add_rules(installed))
+                added_names |= installed_names
+                installed = []
+            self._logger.debug(msg='Creating compiler install rule for spec: {0}'.format(spec_str))
+            rules.extend(self._get_package_rules(package_config))
+            installed.append(package_config)
+        if installed:
+            rules.extend(self._get_compiler_add_rules(installed))
         rules.append(PythonRule(self._show_compilers))
 
         return rules
 
+    @rule_phase
     def _get_package_install_rules(self):
         rules = []
         self._logger.debug(msg='Parsing rules for packages:')
 
-        packages = self._confreader['build_config']['packages']
+        packages = self._filter_installed(self._confreader['build_config']['packages'])
 
-        rules.append(LoggingRule('Installing packages.'))
+        # Packages are installed after all of the previous rules, but they
+        # do not depend on each other. If the number of parallel
+        # installations is limited, installations share a scratch class
+        # whose limit is the number of parallel installations.
+        parallel_installs = self._get_parallel_installs(warn=True)
+        start_rule = LoggingRule('Installing packages.')
+        rules.append(start_rule)
         for package_config in packages:
-            rules.extend([
-                self._get_package_install_rule(package_config)
-            ])
+            package_rules = self._get_package_rules(package_config, parallel_installs)
+            package_rules[0].depends_on(start_rule)
+            rules.extend(package_rules)
 
         return rules
 
-    def _copy_license_rule(self, package_config):
+    def _get_environment_folder(self):
+        """Returns the folder of the generated Spack environment. Each
+        configuration folder has its own environment."""
+        return os.path.join(self._get_conf_cache_dir(), 'environment')
+
+    def _get_environment_spec(self, package_config):
+        """Returns the root spec of a package in the generated environment."""
+        return ' '.join(self._get_spec_list(package_config) +
+                        self._get_target_architecture_flags(package_config))
+
+    def _get_environment(self, packages):
+        """Returns the contents of spack.yaml for an environment that
+        contains all packages as root specs."""
+        specs = [self._get_environment_spec(package_config) for package_config in packages]
+        return {
+            'spack': {
+                'specs': specs,
+                'view': False,
+                'concretizer': {
+                    'unify': 'when_possible',
+                    'reuse': True,
+                },
+            },
+        }
 
-        licenses = package_config['licenses']
-        spec_list = self._get_spec_list(package_config)
-        spec_str = self._get_spec_string(package_config)
+    def _get_environment_key(self, environment):
+        """Returns the key of a concretization of the environment."""
+        return calculate_dict_checksum(dict(
+            self._get_concretization_inputs(), environment=environment))
+
+    @staticmethod
+    def _get_environment_key_file(environment_folder):
+        """Returns the file where the key of the concretization in
+        spack.lock is recorded."""
+        return os.path.join(environment_folder, 'spack.lock.key')
+
+    def _write_environment(self, environment_folder, environment):
+        """Writes spack.yaml of the environment. Recorded key of an earlier
+        concretization is removed if it does not match the environment, so
+        that a spack.lock left by an interrupted concretization is not
+        used."""
+        makedirs(environment_folder)
+        write_file_atomic(
+            os.path.join(environment_folder, 'spack.yaml'),
+            dump_yaml(environment))
+        if not self._is_environment_concretized(environment_folder, environment):
+            try:
+                os.remove(self._get_environment_key_file(environment_folder))
+            except FileNotFoundError:
+                pass
+
+    def _record_environment_key(self, environment_folder, environment):
+        """Records the key of the concretization in spack.lock."""
+        write_file_atomic(
+            self._get_environment_key_file(environment_folder),
+            '{0}\n'.format(self._get_environment_key(environment)))
+
+    def _is_environment_concretized(self, environment_folder, environment):
+        """Returns True if spack.lock exists and it was concretized with
+        the current environment and concretization inputs."""
+        if not os.path.isfile(os.path.join(environment_folder, 'spack.lock')):
+            return False
+        try:
+            with open(self._get_environment_key_file(environment_folder), 'r',
+                      encoding='utf-8') as key_file:
+                recorded_key = key_file.read().strip()
+        except OSError:
+            return False
+        return recorded_key == self._get_environment_key(environment)
+
+    def _check_environment_install(self, environment_folder, packages):
+        """Checks that the root specs of the environment were installed
+        and reports the result of every package. Root specs are matched to
+        the packages by Spack."""
+        spec_strs = [self._get_environment_spec(package_config) for package_config in packages]
+        script = ENVIRONMENT_CHECK_SCRIPT.format(
+            folder=json.dumps(environment_folder), specs=json.dumps(spec_strs))
+        output = str(self._get_spack_sh()('python', '-c', script)).strip()
+        installed = json.loads(output.splitlines()[-1])
+
+        failed = []
+        for package_config, spec_str in zip(packages, spec_strs):
+            if installed.get(spec_str, False):
+                self._logger.info(
+                    "Package '%s' is installed.", self._get_spec_string(package_config))
+            else:
+                self._logger.error(
+                    "Package '%s' was not installed.", self._get_spec_string(package_config))
+                failed.append(self._get_spec_string(package_config))
+        if failed:
+            raise SpackInstallError(
+                'Following packages were not installed: {0}'.format(', '.join(failed)))
+
+    @rule_phase
+    def _get_environment_install_rules(self):
+        """This function will create rules that install all packages from
+        one Spack environment. Packages are concretized together once and
+        installed with one command."""
+        self._logger.debug(msg='Parsing environment rules for packages:')
+
+        packages = self._filter_installed(self._confreader['build_config']['packages'])
+        environment_folder = self._get_environment_folder()
+        environment = self._get_environment(packages)
+        spack_env_cmd = self._spack_cmd + ['-e', environment_folder]
+
+        # Packages are grouped by their extra_flags, so that the flags of
+        # a package are only given to the installation of that package.
+        flag_groups = {}
+        for package_config in packages:
+            flag_groups.setdefault(
+                tuple(self._get_extra_flags(package_config)), []).append(package_config)
+
+        start_rule = LoggingRule('Installing packages from a Spack environment.')
+        write_rule = PythonRule(
+            self._write_environment, [environment_folder, environment]
+        ).depends_on(start_rule)
+        # Environment is concretized again only if the environment, the
+        # compilers or the Spack configuration have changed or if spack.lock
+        # was not created by a completed concretization with the current
+        # inputs. Key of the concretization is recorded next to spack.lock.
+        concretize_rule = SubprocessRule(
+            spack_env_cmd + ['concretize', '-f']
+        ).depends_on(
+            write_rule
+        ).use_stamp(
+            files=[self._compilers_file],
+            config={
+                'config': self._confreader['config'],
+                'packages': self._confreader['packages'],
+                'environment': environment,
+            },
+            check=partial(self._is_environment_concretized, environment_folder, environment))
+        record_rule = PythonRule(
+            self._record_environment_key, [environment_folder, environment]
+        ).depends_on(concretize_rule)
+
+        # Environment is installed with one command per group of extra_flags,
+        # so that installations of the same environment do not compete with
+        # each other. If the packages have different extra_flags, each
+        # command installs only the root specs of its group. Failures are
+        # reported by the check rule for each package.
+        cpus = self._get_install_cpus({})
+        install_rules = []
+        for extra_flags, group_packages in flag_groups.items():
+            spec_args = []
+            if len(flag_groups) > 1:
+                spec_args = [
+                    self._get_environment_spec(package_config)
+                    for package_config in group_packages
+                ]
+            install_rules.append(SubprocessRule(
+                spack_env_cmd + ['install', '-v', '-j', str(cpus)] +
+                list(extra_flags) + spec_args,
+                check=False
+            ).set_resources(
+                cpus=cpus
+            ).depends_on(
+                install_rules[-1] if install_rules else record_rule
+            ))
+        check_rule = PythonRule(
+            self._check_environment_install, [environment_folder, packages]
+        ).depends_on(install_rules[-1] if install_rules else record_rule)
+
+        return ([start_rule, write_rule, concretize_rule, record_rule] +
+                install_rules + [check_rule])
+
+    def _locate_specs(self, spec_strs):
+        """Returns the installation directories of specs. All specs are
+        located with one Spack process. If several installations match a
+        spec, the last one is used. Specs that cannot be looked up are
+        reported as warnings.
+
+        Args:
+            spec_strs (list): Spec strings.
 
-        location_args = ['location', '-i'] + spec_list
-        install_dir = self._spack_sh(*location_args).splitlines()[0]
+        Returns:
+            list: Installation directories. Directory is None if a spec
+            could not be located.
+        """
+        script = LOCATION_SCRIPT.format(specs=json.dumps(spec_strs))
+        output = self._spack_query('python', '-c', script).strip()
+        locations = json.loads(output.splitlines()[-1])
+        for spec_str, error in sorted(locations['errors'].items()):
+            self._logger.warning("Could not look up spec '%s': %s", spec_str, error)
+        return locations['prefixes']
 
-        if not install_dir:
-            raise Exception(
-                'Could not find the installation directory for spec {0}'.format(spec_str))
-        license_find_sh = sh.find.bake(install_dir)
-        for license in licenses:
-            license_files = license_find_sh('-name', license).splitlines()
-            if not license_files:
-                self._logger.warning(
-                    ("No license files found in the installation directory "
-                     "of spec '%s' with license file name '%s'."),
-                    spec_str,
-                    license)
+    def _get_install_dirs(self, package_configs):
+        """Returns the installation directories of packages.
+
+        Args:
+            package_configs (list): Package configurations.
+
+        Returns:
+            list: Installation directories. Directory is None if a package
+            could not be located.
+        """
+        return self._locate_specs(
+            [self._get_spec_string(package_config) for package_config in package_configs])
+
+    def _copy_license_files(self, spec_str, license_files):
+        for license_file in license_files:
+            if not os.path.islink(license_file):
                 continue
-            for license_file in license_files:
-                if not os.path.islink(license_file):
+            real_path = os.path.realpath(license_file)
+            self._logger.info(
+                "Copying license file for package '%s':",
+                spec_str)
+            self._logger.info(
+                "License source path: '%s':",
+                real_path)
+            self._logger.info(
+                "License target path: '%s':",
+                license_file)
+            os.remove(license_file)
+            copy_file(real_path, license_file)
+
+    def _copy_licenses(self, package_configs):
+        """Replaces symbolic links to license files with copies of the
+        license files. Installation directories are located with one query
+        and they are walked concurrently, each of them only once."""
+
+        install_dirs = self._get_install_dirs(package_configs)
+        missing = [
+            self._get_spec_string(package_config)
+            for package_config, install_dir in zip(package_configs, install_dirs)
+            if not install_dir
+        ]
+        if missing:
+            raise Exception(
+                'Could not find the installation directory for specs: {0}'.format(
+                    ', '.join(missing)))
+
+        with ThreadPoolExecutor(max_workers=min(8, len(package_configs))) as executor:
+            license_matches = list(executor.map(
+                find_files,
+                install_dirs,
+                [package_config['licenses'] for package_config in package_configs]))
+
+        for package_config, matches in zip(package_configs, license_matches):
+            spec_str = self._get_spec_string(package_config)
+            for license in package_config['licenses']:
+                if not matches[license]:
+                    self._logger.warning(
+                        ("No license files found in the installation directory "
+                         "of spec '%s' with license file name '%s'."),
+                        spec_str,
+                        license)
                     continue
-                real_path = os.path.realpath(license_file)
-                self._logger.info(
-                    "Copying license file for package '%s':",
-                    spec_str)
-                self._logger.info(
-                    "License source path: '%s':",
-                    real_path)
-                self._logger.info(
-                    "License target path: '%s':",
-                    license_file)
-                os.remove(license_file)
-                copy_file(real_path, license_file)
+                self._copy_license_files(spec_str, matches[license])
 
+    @rule_phase
     def _get_license_copy_rules(self):
 
-        rules = []
         self._logger.debug(msg='Copying license files:')
 
         packages = (
             self._confreader['build_config']['packages'] +
             self._confreader['build_config']['compilers']
         )
-        for package_config in packages:
-            if 'licenses' in package_config:
-                rules.append(PythonRule(self._copy_license_rule, [package_config]))
-
-        return rules
+        licensed_packages = [
+            package_config for package_config in packages
+            if 'licenses' in package_config
+        ]
+        if not licensed_packages:
+            return []
+        return [PythonRule(self._copy_licenses, [licensed_packages])]
 
+    @rule_phase
     def _get_recreate_modules_rules(self):
+        # Module tree is deleted before it is refreshed, so that modulefiles
+        # of uninstalled packages are removed. Flat module structures are
+        # moved out of the tree while it is refreshed, so that they can be
+        # updated incrementally afterwards.
+        lmod_root = self._confreader['config']['config']['module_roots']['lmod']
         logging_rule = LoggingRule('Recreating modules.')
+        stash_rule = PythonRule(self._stash_flat_modules, [lmod_root])
         recreate_rule = SubprocessRule(
             self._spack_cmd +
             ['module',
@@ -339,13 +850,17 @@ class SpackBuilder(Builder):
              '-y',
              '--delete-tree']
             )
-        return [logging_rule, recreate_rule]
+        return [logging_rule, stash_rule, recreate_rule]
 
-    def _get_module_arch_folders(self, lmod_root):
+    def _get_module_root(self, lmod_root):
         if '$spack' in lmod_root:
-            if sh.which('spack'):
-                spack_root = self._spack_sh('location', '-r').splitlines()[0]
+            if shutil.which('spack'):
+                spack_root = self._spack_query('location', '-r').strip().splitlines()[-1]
                 lmod_root = lmod_root.replace('$spack', spack_root)
+        return lmod_root
+
+    def _get_module_arch_folders(self, lmod_root):
+        lmod_root = self._get_module_root(lmod_root)
 
         def is_arch_folder(folder):
             return os.path.isdir(os.path.join(folder, 'Core'))
@@ -355,78 +870,173 @@ class SpackBuilder(Builder):
 
         return arch_folders
 
-    def _remove_all_modules_folders(self, module_root):
-        for arch_folder in self._get_module_arch_folders(module_root):
+    def _get_flat_stash_folder(self, lmod_root):
+        """Returns the folder next to the module root where flat module
+        structures are kept while the module tree is refreshed."""
+        lmod_root = os.path.normpath(self._get_module_root(lmod_root))
+        return os.path.join(
+            os.path.dirname(lmod_root),
+            '.{0}-flat'.format(os.path.basename(lmod_root)))
+
+    def _stash_flat_modules(self, lmod_root):
+        """Moves the flat module structures out of the module tree."""
+        lmod_root = self._get_module_root(lmod_root)
+        self._restore_flat_modules(lmod_root)
+        stash_folder = self._get_flat_stash_folder(lmod_root)
+        for arch_folder in self._get_module_arch_folders(lmod_root):
             all_folder = os.path.join(arch_folder, 'all')
             if os.path.isdir(all_folder):
-                shutil.rmtree(all_folder)
+                makedirs(stash_folder, 0o755)
+                os.rename(all_folder, os.path.join(stash_folder, os.path.basename(arch_folder)))
+
+    def _restore_flat_modules(self, lmod_root):
+        """Moves flat module structures that were moved out of the module
+        tree back into their architecture folders. Flat structures of
+        architecture folders that no longer exist are removed."""
+        stash_folder = self._get_flat_stash_folder(lmod_root)
+        if not os.path.isdir(stash_folder):
+            return
+        module_root = self._get_module_root(lmod_root)
+        for entry in list(os.scandir(stash_folder)):
+            arch_folder = os.path.join(module_root, entry.name)
+            all_folder = os.path.join(arch_folder, 'all')
+            if os.path.isdir(arch_folder) and not os.path.exists(all_folder):
+                os.rename(entry.path, all_folder)
+            else:
+                shutil.rmtree(entry.path)
+        os.rmdir(stash_folder)
+
+    @staticmethod
+    def _remove_stale_modules(all_folder, modulefiles):
+        """Removes files from a flat module folder that are not in
+        modulefiles and module folders that become empty. Returns the number
+        of removed files."""
+        removed = 0
+        for entry in list(os.scandir(all_folder)):
+            if not entry.is_dir(follow_symlinks=False):
+                if entry.path not in modulefiles:
+                    os.remove(entry.path)
+                    removed += 1
+                continue
+            for module_entry in list(os.scandir(entry.path)):
+                if module_entry.path not in modulefiles:
+                    if module_entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(module_entry.path)
+                    else:
+                        os.remove(module_entry.path)
+                    removed += 1
+            if not os.listdir(entry.path):
+                os.rmdir(entry.path)
+        return removed
+
+    @staticmethod
+    def _find_arch_modules(arch_folder):
+        """Returns a list of tuples of hierarchical modulefiles in an
+        architecture folder and their module information. Core modules are
+        listed before the modules of MPI libraries."""
+        modules = []
+        patterns = [
+            os.path.join(arch_folder, 'Core', '*', '*.lua'),
+            os.path.join(arch_folder, '*', '*', 'Core', '*', '*.lua'),
+        ]
+        for pattern in patterns:
+            for modulefile in sorted(glob(pattern)):
+                parts = os.path.relpath(modulefile, arch_folder).split(os.sep)
+                match = {'modulename': parts[-2], 'version': parts[-1][:-len('.lua')]}
+                if len(parts) == 5:
+                    match['mpi'] = parts[0]
+                    match['mpi_version'] = parts[1]
+                modules.append((modulefile, match))
+        return modules
 
     def _copy_all_modules(self, module_root):
+        """Updates the flat module structure of every architecture folder.
+        Flat structures that were moved out of the module tree while it was
+        refreshed are moved back first. Only new and changed modulefiles
+        are written and modulefiles whose source has been removed are
+        deleted, so the flat structure stays usable while it is updated.
 
-        def write_module_file_without_modulepath(src, dest):
-            with open(src, 'r') as modulefile:
-                modulefile_lines = modulefile.readlines()
-            with open(dest, 'w') as modulefile_new:
-                for line in modulefile_lines:
-                    if 'MODULEPATH' not in line:
-                        modulefile_new.write(line)
-            os.chmod(dest, 0o644)
+        Flat paths of all modulefiles are checked for overlaps before any
+        modulefile is written. Architecture folders are scanned on a thread
+        pool. Existing flat structures are also updated on the thread pool.
 
-        copied_modules = {}
-
-        for arch_folder in self._get_module_arch_folders(module_root):
-
-            core_regexp = re.compile(os.path.join(
-                arch_folder,
-                'Core',
-                '(?P<modulename>[^/]+)',
-                '(?P<version>[^/]+).lua'))
-            mpi_regexp = re.compile(os.path.join(
-                arch_folder,
-                '(?P<mpi>[^/]+)',
-                '(?P<mpi_version>[^/]+)',
-                'Core',
-                '(?P<modulename>[^/]+)',
-                '(?P<version>[^/]+).lua'))
+        Returns:
+            dict: Number of created, updated, removed and unchanged
+            modulefiles.
+        """
 
-            all_folder = os.path.join(arch_folder, 'all')
-            makedirs(all_folder, 0o755)
-
-            corefiles = glob(os.path.join(arch_folder, 'Core', '*', '*.lua'))
-            mpifiles = glob(os.path.join(arch_folder, '*', '*', 'Core', '*', '*.lua'))
-            moduledict = {x:core_regexp.match(x).groupdict() for x in corefiles}
-            moduledict.update({x:mpi_regexp.match(x).groupdict() for x in mpifiles})
-            for modulefile, match in moduledict.items():
-
-                modulefolder_new = os.path.join(all_folder, match['modulename'])
-                modulefile_new = os.path.join(
-                    modulefolder_new,
-                    '{}.lua'.format(match['version']))
-
-                if modulefile_new in copied_modules:
-                    raise FileExistsError(
-                        ('Modulefile overlap encountered. '
-                         'Tried to copy modulefile {0} to {1}, but it was also '
-                         'copied from modulefile {2}').format(
-                             modulefile, modulefile_new, copied_modules[modulefile_new]))
-
-                makedirs(modulefolder_new, 0o755)
-                write_module_file_without_modulepath(modulefile, modulefile_new)
-
-                copied_modules[modulefile_new] = match
+        module_root = self._get_module_root(module_root)
+        self._restore_flat_modules(module_root)
+        copied_modules = {}
+        sources = {}
+        counts = {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        arch_folders = self._get_module_arch_folders(module_root)
+
+        with ThreadPoolExecutor() as executor:
+            arch_modules = list(executor.map(self._find_arch_modules, arch_folders))
+
+            all_folders = {}
+            for arch_folder, modules in zip(arch_folders, arch_modules):
+                all_folder = os.path.join(arch_folder, 'all')
+                all_folders[all_folder] = set()
+                for modulefile, match in modules:
+                    modulefile_new = os.path.join(
+                        all_folder,
+                        match['modulename'],
+                        '{}.lua'.format(match['version']))
+
+                    if modulefile_new in copied_modules:
+                        raise FileExistsError(
+                            ('Modulefile overlap encountered. '
+                             'Tried to copy modulefile {0} to {1}, but it was also '
+                             'copied from modulefile {2}').format(
+                                 modulefile, modulefile_new, sources[modulefile_new]))
+
+                    copied_modules[modulefile_new] = match
+                    sources[modulefile_new] = modulefile
+                    all_folders[all_folder].add(modulefile_new)
+
+            # Flat structure is created from scratch without the thread
+            # pool, as creating files concurrently is slower than creating
+            # them serially.
+            incremental = any(os.path.isdir(all_folder) for all_folder in all_folders)
+            for all_folder, modulefiles in all_folders.items():
+                makedirs(all_folder, 0o755)
+                for modulefolder_new in set(map(os.path.dirname, modulefiles)):
+                    makedirs(modulefolder_new, 0o755)
+
+            # Modulefiles are synced in chunks to keep the overhead of the
+            # thread pool small compared to the file operations.
+            modulefiles = [(src, dest) for dest, src in sources.items()]
+            chunks = [modulefiles[index:index + self.MODULEFILE_CHUNK_SIZE]
+                      for index in range(0, len(modulefiles), self.MODULEFILE_CHUNK_SIZE)]
+            sync_map = executor.map if incremental else map
+            for chunk_counts in sync_map(sync_modulefiles, chunks):
+                for status, count in chunk_counts.items():
+                    counts[status] += count
+            counts['removed'] += sum(executor.map(
+                self._remove_stale_modules, list(all_folders), list(all_folders.values())))
+
+        for all_folder, modulefiles in all_folders.items():
+            self._logger.info('Copied following modules to %s:', all_folder)
+            for modulefile_new in sorted(modulefiles):
+                copied_module_info = copied_modules[modulefile_new]
+                if 'mpi' in copied_module_info:
+                    mpi = '%s/%s' % (copied_module_info['mpi'],
+                                     copied_module_info['mpi_version'])
+                else:
+                    mpi = 'None'
+                self._logger.info(
+                    'Module: %-30s Version: %-30s MPI: %-10s',
+                    copied_module_info['modulename'],
+                    copied_module_info['version'],
+                    mpi)
         self._logger.info(
-            'Copied following modules to %s:', all_folder)
-        for _, copied_module_info in sorted(copied_modules.items()):
-            if 'mpi' in copied_module_info:
-                mpi = '%s/%s' % (copied_module_info['mpi'], copied_module_info['mpi_version'])
-            else:
-                mpi = 'None'
-            self._logger.info(
-                'Module: %-30s Version: %-30s MPI: %-10s',
-                copied_module_info['modulename'],
-                copied_module_info['version'],
-                mpi)
+            'Flat modulefiles: %d created, %d updated, %d removed, %d unchanged.',
+            counts['created'], counts['updated'], counts['removed'], counts['unchanged'])
+        return counts
 
+    @rule_phase
     def _get_flatten_lmod_rules(self):
         """This function will create rules that generate a flat lmod
         structure from hierarchical modulefiles"""
@@ -435,14 +1045,7 @@ class SpackBuilder(Builder):
 
         rules = [
             LoggingRule(
-                'Removing folders that contain the non-hierarchal module structure.'
-            ),
-            PythonRule(
-                self._remove_all_modules_folders,
-                args=[lmod_root],
-            ),
-            LoggingRule(
-                'Copying modules to non-hierarchal module structure.'
+                'Updating non-hierarchal module structure.'
             ),
             PythonRule(
                 self._copy_all_modules,
@@ -458,25 +1061,45 @@ class SpackBuilder(Builder):
 
         1. Reindexing already installed software
         2. Installing compilers
-        3. Installing required packages
+        3. Installing required packages, either one by one or from a
+           generated Spack environment if 'install_mode' in build_config
+           is 'environment'
         4. Copying license files
         5. Re-creating lmod modules to check for name clashes
-        6. Creating flat lmod structure
+        6. Updating flat lmod structure
 
         Returns:
             list: List of build rules.
         """
 
+        self._install_counts = {'installed': 0, 'to_build': 0}
+        if self._confreader['build_config'].get('install_mode', 'packages') == 'environment':
+            package_install_rules = self._get_environment_install_rules()
+        else:
+            package_install_rules = self._get_package_install_rules()
+
         rules = (
             self._get_reindex_rules() +
             self._get_compiler_install_rules() +
-            self._get_package_install_rules() +
+            package_install_rules +
             self._get_license_copy_rules() +
             self._get_recreate_modules_rules() +
             self._get_flatten_lmod_rules()
             )
         return rules
 
+    def get_plan(self, deploy=True):
+        plan = super().get_plan(deploy=deploy)
+        plan['packages'] = dict(self._install_counts)
+        return plan
+
+    def describe(self, output_format='text'):
+        super().describe(output_format=output_format)
+        if output_format == 'text':
+            self._logger.info(
+                'Packages and compilers: %d already installed, %d to build.',
+                self._install_counts['installed'], self._install_counts['to_build'])
+
     def _symlink_lmod_modules(self):
         pass
 
@@ -0,0 +1,784 @@
+# -*- coding: utf-8 -*-
+"""Spackutils contains helpers that SpackBuilder uses to query and
+configure Spack.
+
+It contains in-memory models of Spack's compilers.yaml and installed specs,
+a long-lived process for Spack queries, scripts for 'spack python' and
+functions that flatten modulefiles and load Spack's schemas.
+"""
+import sys
+import re
+import os
+import logging
+import json
+import atexit
+import select
+import warnings
+import threading
+import subprocess
+from fnmatch import fnmatchcase
+
+from buildrules.common.utils import (get_cache_dir, load_yaml, dump_yaml,
+                                     calculate_dict_checksum, write_file_atomic)
+
+SPACK_ROOT=os.getenv('SPACK_ROOT', None)
+
+# Variants ('+mpi', '~shared', 'cuda_arch=70') and compilers ('%gcc@9.3.0')
+# that can be checked against installed specs
+SPEC_TOKEN_REGEX = re.compile(
+    r'(?P<enabled>[+~])(?P<flag>[\w.-]+)|'
+    r'(?P<name>[\w-]+)=(?P<value>[^\s+~%^]+)|'
+    r'%(?P<compiler>[\w-]+)(?:@(?P<compiler_version>[^\s+~%^]+))?')
+
+# Script for 'spack python' that finds the installation directories of
+# several specs like 'spack location -i' does for one spec. If several
+# installations match a spec, the last of them in sorted order is used like
+# 'spack find -p <spec> | tail -n 1' does. Specs that cannot be looked up
+# are reported as errors.
+LOCATION_SCRIPT = '''
+import json
+import spack.cmd
+import spack.store
+database = spack.store.STORE.db if hasattr(spack.store, 'STORE') else spack.store.db
+prefixes = []
+errors = {{}}
+for spec_str in {specs}:
+    try:
+        spec = spack.cmd.parse_specs(spec_str)[0]
+        matches = sorted(database.query(spec, installed=True))
+        prefixes.append(matches[-1].prefix if matches else None)
+    except (Exception, SystemExit) as error:
+        prefixes.append(None)
+        errors[spec_str] = str(error) or error.__class__.__name__
+print(json.dumps({{'prefixes': prefixes, 'errors': errors}}))
+'''
+
+# Script for 'spack python' that checks whether the root specs of an
+# environment are installed. Root specs are matched to the requested specs
+# by their normalized string representation.
+ENVIRONMENT_CHECK_SCRIPT = '''
+import json
+import spack.environment
+import spack.spec
+environment = spack.environment.Environment({folder})
+roots = {{}}
+for user_spec, concrete_spec in environment.concretized_specs():
+    roots[str(user_spec)] = concrete_spec
+installed = {{}}
+for spec_str in {specs}:
+    concrete_spec = roots.get(str(spack.spec.Spec(spec_str)), None)
+    installed[spec_str] = concrete_spec is not None and concrete_spec.installed
+print(json.dumps(installed))
+'''
+
+def parse_json_output(output):
+    """Returns the JSON document at the end of the output of a Spack
+    command. Messages that Spack prints before the document, e.g. warnings,
+    are skipped.
+
+    Args:
+        output (str): Output of a Spack command.
+
+    Returns:
+        object: Parsed JSON document.
+
+    Raises:
+        ValueError: If the output does not end with a JSON document.
+    """
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'^[\[{]', output, re.MULTILINE):
+        try:
+            document, end = decoder.raw_decode(output, match.start())
+        except ValueError:
+            continue
+        if not output[end:].strip():
+            return document
+    raise ValueError('Spack output does not end with a JSON document')
+
+def find_files(root, patterns):
+    """Finds files and folders whose names match any of the patterns with
+    a single walk over the folder tree. Symbolic links are not followed.
+
+    Args:
+        root (str): Folder to walk.
+        patterns (list): Shell-style name patterns like those of
+            'find -name'.
+
+    Returns:
+        dict: Lists of matching paths for each pattern.
+    """
+    matches = {pattern: [] for pattern in patterns}
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
+            for pattern in patterns:
+                if fnmatchcase(entry.name, pattern):
+                    matches[pattern].append(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path)
+    return matches
+
+def sync_modulefile(src, dest):
+    """Writes a flat copy of a hierarchical modulefile without MODULEPATH
+    lines. The copy gets the modification time of the source, so unchanged
+    sources are skipped without reading them. The copy is written only if
+    its contents change. Existing copies are replaced atomically.
+
+    Args:
+        src (str): Hierarchical modulefile.
+        dest (str): Flat modulefile.
+
+    Returns:
+        str: 'created', 'updated' or 'unchanged'.
+    """
+    src_stat = os.stat(src)
+    try:
+        dest_stat = os.stat(dest)
+    except FileNotFoundError:
+        dest_stat = None
+    if dest_stat is not None and dest_stat.st_mtime_ns == src_stat.st_mtime_ns:
+        return 'unchanged'
+
+    with open(src, 'r', encoding='utf-8') as modulefile:
+        contents = ''.join(line for line in modulefile if 'MODULEPATH' not in line)
+
+    status = 'created'
+    if dest_stat is not None:
+        status = 'updated'
+        with open(dest, 'r', encoding='utf-8') as modulefile:
+            if modulefile.read() == contents:
+                status = 'unchanged'
+    if status == 'created':
+        # New modulefiles are written in place, as creating a temporary file
+        # for each of them makes the first flatten several times slower. A
+        # modulefile left incomplete by an interrupted run does not have the
+        # modification time of its source, so it is checked on the next run.
+        try:
+            with open(os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644),
+                      'w', encoding='utf-8') as modulefile:
+                os.fchmod(modulefile.fileno(), 0o644)
+                modulefile.write(contents)
+        except FileExistsError:
+            status = 'updated'
+    if status == 'updated':
+        write_file_atomic(dest, contents, chmod=0o644)
+    os.utime(dest, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return status
+
+def sync_modulefiles(modulefiles):
+    """Runs sync_modulefile for a list of tuples of sources and
+    destinations and returns the number of modulefiles with each status."""
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    for src, dest in modulefiles:
+        counts[sync_modulefile(src, dest)] += 1
+    return counts
+
+class CompilersFile:
+    """CompilersFile is an in-memory model of Spack's compilers.yaml.
+
+    The file is parsed once and its compiler entries are indexed by their
+    spec. Changes are written back with one atomic write.
+
+    Args:
+        filename (str): Path to compilers.yaml. A missing file is treated
+            as a file without compilers.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._stat = None
+        self._contents = {'compilers': []}
+        try:
+            self._stat = os.stat(filename)
+            self._contents = load_yaml(filename) or self._contents
+        except FileNotFoundError:
+            pass
+        self._contents.setdefault('compilers', [])
+        self._index = {}
+        for entry in self._contents['compilers']:
+            compiler = entry['compiler']
+            self._index.setdefault(compiler['spec'], []).append(compiler)
+        self._changed = False
+
+    @property
+    def specs(self):
+        """list: Specs of the compilers in the order of the file."""
+        return [entry['compiler']['spec'] for entry in self._contents['compilers']]
+
+    def is_current(self):
+        """Returns True if the file has not changed since it was read or
+        written by this model."""
+        try:
+            stat = os.stat(self._filename)
+        except FileNotFoundError:
+            return self._stat is None
+        return (self._stat is not None and
+                (stat.st_mtime_ns, stat.st_size, stat.st_ino) ==
+                (self._stat.st_mtime_ns, self._stat.st_size, self._stat.st_ino))
+
+    def set_flags(self, spec, flags):
+        """Sets the flags of all compilers with the spec.
+
+        Args:
+            spec (str): Compiler spec, e.g. 'gcc@9.3.0'.
+            flags (dict): Compiler flags.
+
+        Returns:
+            bool: True if a compiler with the spec was found.
+        """
+        compilers = self._index.get(spec, [])
+        for compiler in compilers:
+            if compiler.get('flags', None) != flags:
+                compiler['flags'] = flags
+                self._changed = True
+        return bool(compilers)
+
+    def write(self):
+        """Writes the file atomically if it has been changed."""
+        if not self._changed:
+            return
+        write_file_atomic(self._filename, dump_yaml(self._contents, indent=False))
+        self._stat = os.stat(self._filename)
+        self._changed = False
+
+# Script for 'spack python' that runs Spack commands in one long-lived
+# process. Requests and responses are JSON lines. Responses are written to
+# the original standard output and everything Spack prints outside of the
+# commands goes to standard error. Like on the command line, output of a
+# command includes the warnings Spack prints while running it.
+QUERY_SERVER_SCRIPT = '''
+import os
+import sys
+import json
+from spack.main import SpackCommand
+responses = os.fdopen(os.dup(1), 'w')
+os.dup2(2, 1)
+commands = {}
+for line in sys.stdin:
+    request = json.loads(line)
+    try:
+        if request['command'] not in commands:
+            commands[request['command']] = SpackCommand(request['command'])
+        response = {'output': commands[request['command']](*request['args'])}
+    except (Exception, SystemExit) as error:
+        response = {'error': str(error) or error.__class__.__name__}
+    responses.write(json.dumps(response) + '\\n')
+    responses.flush()
+'''
+
+class SpackQueryError(Exception):
+    """SpackQueryError is raised when a query to SpackQueryServer fails."""
+
+class SpackQueryServer:
+    """SpackQueryServer runs Spack query commands in one long-lived
+    'spack python' process, so that Spack's startup, configuration and
+    database are loaded only once.
+
+    The process is started on the first query and it is stopped with
+    stop or when Python exits. Queries are run one at a time.
+
+    Spack configuration is read when the process starts, so the server
+    should be stopped after Spack's configuration has been changed.
+
+    Args:
+        spack_cmd (list): Spack command with its global options.
+        timeout (float, optional): Maximum time to wait for the response to
+            a query in seconds. Process is killed if it does not respond in
+            time. Default is TIMEOUT.
+    """
+
+    # Commands that only query Spack
+    COMMANDS = ('location', 'find', 'spec', 'python')
+    TIMEOUT = 900
+
+    def __init__(self, spack_cmd, timeout=TIMEOUT):
+        self._spack_cmd = list(spack_cmd)
+        self._timeout = timeout
+        self._process = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            self._spack_cmd + ['python', '-c', QUERY_SERVER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            bufsize=1)
+
+    def query(self, command, *args):
+        """Runs a Spack command in the server process.
+
+        Args:
+            command (str): Spack command, e.g. 'find'.
+            *args (str): Arguments of the command.
+
+        Returns:
+            str: Output of the command.
+
+        Raises:
+            SpackQueryError: If the command fails or the server process
+                has stopped.
+        """
+        request = json.dumps({'command': command, 'args': list(args)})
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            try:
+                self._process.stdin.write(request + '\n')
+                self._process.stdin.flush()
+                if not select.select([self._process.stdout], [], [], self._timeout)[0]:
+                    self._process.kill()
+                    self._process.wait()
+                    raise SpackQueryError(
+                        "Spack query server did not respond to '{0}' in {1} s".format(
+                            ' '.join([command] + list(args)), self._timeout))
+                response = self._process.stdout.readline()
+            except OSError as error:
+                raise SpackQueryError(
+                    'Spack query server failed: {0}'.format(error)) from error
+            if not response:
+                raise SpackQueryError(
+                    'Spack query server exited with code {0}'.format(self._process.wait()))
+        response = json.loads(response)
+        if 'error' in response:
+            raise SpackQueryError(
+                "Spack command '{0}' failed: {1}".format(
+                    ' '.join([command] + list(args)), response['error']))
+        return response['output']
+
+    def stop(self):
+        """Stops the server process."""
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                    self._process.wait()
+            self._process = None
+
+class InstalledSpecIndex:
+    """InstalledSpecIndex is an in-memory index of installed Spack specs.
+
+    It is created from the output of 'spack find --json' and it is used to
+    check whether a package configuration is satisfied by an installed spec.
+    The check is conservative: a package configuration is satisfied only if
+    it requests an exact version, a compiler with a version and a complete
+    target architecture that all match an installed spec. Package
+    configurations with dependencies or with spec syntax the index cannot
+    check are never satisfied.
+
+    Args:
+        specs (list): Installed specs from 'spack find --json'.
+    """
+
+    def __init__(self, specs):
+        self._specs = {}
+        for spec in specs:
+            # Older versions of Spack wrap each spec into {name: spec}
+            if 'name' not in spec and len(spec) == 1:
+                name, spec = next(iter(spec.items()))
+                spec = dict(spec, name=name)
+            self._specs.setdefault(spec['name'], []).append(spec)
+
+    def __len__(self):
+        return sum(len(specs) for specs in self._specs.values())
+
+    @staticmethod
+    def _parse_variants(variants):
+        """Returns a list of token match dicts or None if some part of the
+        variants cannot be parsed."""
+        tokens = []
+        for variant_str in variants:
+            for part in variant_str.split():
+                position = 0
+                for match in SPEC_TOKEN_REGEX.finditer(part):
+                    if match.start() != position:
+                        return None
+                    tokens.append(match.groupdict())
+                    position = match.end()
+                if position != len(part):
+                    return None
+        return tokens
+
+    @staticmethod
+    def _token_satisfied(spec, token):
+        parameters = spec.get('parameters', {}) or {}
+        if token['flag'] is not None:
+            return parameters.get(token['flag'], None) is (token['enabled'] == '+')
+        if token['name'] is not None:
+            value = parameters.get(token['name'], None)
+            if isinstance(value, list):
+                return set(token['value'].split(',')) == set(map(str, value))
+            return str(value) == token['value']
+        compiler = spec.get('compiler', {}) or {}
+        return (compiler.get('name', None) == token['compiler'] and
+                str(compiler.get('version', '')) == token['compiler_version'])
+
+    @staticmethod
+    def _arch_satisfied(spec, target_architecture):
+        arch = spec.get('arch', {}) or {}
+        target = arch.get('target', None)
+        if isinstance(target, dict):
+            target = target.get('name', None)
+        installed = {
+            'platform': arch.get('platform', None),
+            'os': arch.get('platform_os', None),
+            'target': target,
+        }
+        return all(installed[key] == target_architecture[key] for key in installed)
+
+    def satisfies(self, package_config, target_architecture=None):
+        """Returns True if an installed spec satisfies the package
+        configuration.
+
+        Args:
+            package_config (dict): Package configuration from build_config.
+            target_architecture (dict, optional): Requested 'platform', 'os'
+                and 'target' (or 'arch') of the installation.
+
+        Returns:
+            bool: True if the package is already installed.
+        """
+        if package_config.get('dependencies', []):
+            return False
+        tokens = self._parse_variants(package_config.get('variants', []))
+        if tokens is None:
+            return False
+        # Compiler and target architecture that Spack would choose are not
+        # known, so they must be requested explicitly.
+        compilers = [token for token in tokens if token['compiler'] is not None]
+        if len(compilers) != 1 or compilers[0]['compiler_version'] is None:
+            return False
+        target_architecture = dict(target_architecture or {})
+        target_architecture.setdefault('target', target_architecture.get('arch', None))
+        target_architecture = {
+            key: target_architecture.get(key, None) for key in ('platform', 'os', 'target')}
+        if any(value in (None, 'None') for value in target_architecture.values()):
+            return False
+        for spec in self._specs.get(package_config['name'], []):
+            if str(spec.get('version', '')) != str(package_config['version']):
+                continue
+            if not self._arch_satisfied(spec, target_architecture):
+                continue
+            if all(self._token_satisfied(spec, token) for token in tokens):
+                return True
+        return False
+
+def get_spack_revision(spack_root):
+    """Returns the version and the git commit of a Spack installation.
+
+    Args:
+        spack_root (str): Root folder of Spack.
+
+    Returns:
+        dict: Dictionary with the root, the version and the commit of Spack.
+            Version and commit are None if they cannot be determined.
+    """
+    version = None
+    try:
+        with open(os.path.join(spack_root, 'lib', 'spack', 'spack', '__init__.py'),
+                  encoding='utf-8') as init_file:
+            init_source = init_file.read()
+        version_match = (
+            re.search(r'spack_version_info\s*=\s*\(([^)]*)\)', init_source) or
+            re.search(r'__version__\s*=\s*[\'"]([^\'"]+)[\'"]', init_source))
+        if version_match:
+            version = re.sub(r'[\s\'"]', '', version_match.group(1)).replace(',', '.')
+    except OSError:
+        pass
+
+    return {
+        'root': os.path.realpath(spack_root),
+        'version': version,
+        'commit': get_git_commit(spack_root),
+    }
+
+def get_git_commit(folder):
+    """Returns the git commit that is checked out in a folder without
+    running git.
+
+    Args:
+        folder (str): Root folder of a git repository.
+
+    Returns:
+        str: Commit or None if it cannot be determined.
+    """
+    commit = None
+    git_dir = os.path.join(folder, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), encoding='utf-8') as head_file:
+            head = head_file.read().strip()
+        if head.startswith('ref: '):
+            ref = head[5:]
+            ref_path = os.path.join(git_dir, ref)
+            if os.path.isfile(ref_path):
+                with open(ref_path, encoding='utf-8') as ref_file:
+                    commit = ref_file.read().strip()
+            else:
+                with open(os.path.join(git_dir, 'packed-refs'), encoding='utf-8') as packed_refs:
+                    for line in packed_refs:
+                        if line.strip().endswith(' ' + ref):
+                            commit = line.split()[0]
+                            break
+        else:
+            commit = head
+    except OSError:
+        pass
+    return commit
+
+def get_package_repos(conf_folders, spack_root=None):
+    """Returns the custom package repositories that are listed in
+    repos.yaml of Spack configuration folders.
+
+    Args:
+        conf_folders (list): Configuration folders.
+        spack_root (str): Root folder of Spack that replaces '$spack' in
+            repository paths. Default is None.
+
+    Returns:
+        list: Absolute paths of the repositories.
+    """
+    repo_paths = []
+    for conf_folder in conf_folders:
+        repos_file = os.path.join(conf_folder, 'repos.yaml')
+        if not os.path.isfile(repos_file):
+            continue
+        repos = (load_yaml(repos_file) or {}).get('repos', None) or []
+        # Newer versions of Spack map repository names to paths
+        if isinstance(repos, dict):
+            repos = list(repos.values())
+        for repo_path in repos:
+            if not isinstance(repo_path, str):
+                continue
+            if spack_root:
+                repo_path = re.sub(r'\$(spack\b|\{spack\})', spack_root, repo_path)
+            repo_path = os.path.expanduser(os.path.expandvars(repo_path))
+            repo_path = os.path.abspath(os.path.join(conf_folder, repo_path))
+            if repo_path not in repo_paths:
+                repo_paths.append(repo_path)
+    return repo_paths
+
+def get_repo_revision(repo_path):
+    """Returns the revision of a Spack package repository. Revision
+    contains the git commit of the repository, if it is in a git
+    repository, and a checksum of the modification times and the sizes of
+    its package files, so that uncommitted changes change it too.
+
+    Args:
+        repo_path (str): Root folder of the repository.
+
+    Returns:
+        dict: Dictionary with the commit and the package checksum.
+    """
+    commit = None
+    folder = repo_path
+    while True:
+        if os.path.exists(os.path.join(folder, '.git')):
+            commit = get_git_commit(folder)
+            break
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            break
+        folder = parent
+
+    package_files = {}
+    for root, _, files in os.walk(repo_path):
+        for filename in files:
+            if not filename.endswith('.py') and filename != 'repo.yaml':
+                continue
+            path = os.path.join(root, filename)
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            package_files[os.path.relpath(path, repo_path)] = [
+                file_stat.st_mtime_ns, file_stat.st_size]
+    return {
+        'commit': commit,
+        'packages': calculate_dict_checksum(package_files),
+    }
+
+def _import_spack_schemas(spack_root):
+    spack_lib_path = os.path.join(spack_root, 'lib/spack')
+    spack_external_lib_path = os.path.join(spack_root, 'lib/spack/external')
+    for lib_path in (spack_lib_path, spack_external_lib_path):
+        if lib_path not in sys.path:
+            sys.path.append(lib_path)
+    import spack.config
+    return [
+        spack.schema.config.schema,
+        spack.schema.modules.schema,
+        spack.schema.packages.schema,
+    ]
+
+def get_spack_schemas(spack_root=None):
+    """Returns Spack's schemas for config.yaml, modules.yaml and
+    packages.yaml.
+
+    Importing Spack's library is slow, so the schemas are cached as JSON in
+    buildrules' cache folder. The cache is keyed by the version and the git
+    commit of Spack and Spack is imported only when no cache exists for the
+    current revision.
+
+    Args:
+        spack_root (str, optional): Root folder of Spack. Default is None,
+            which uses SPACK_ROOT.
+
+    Returns:
+        list: List of schemas. Schemas are empty if Spack environment is not
+            activated.
+    """
+    if spack_root is None:
+        spack_root = SPACK_ROOT
+    if not spack_root:
+        warnings.warn('Spack environment is not activated. Spack configuration schemas are not verified correctly!')
+        return [{}, {}, {}]
+
+    revision = get_spack_revision(spack_root)
+    if revision['version'] is None and revision['commit'] is None:
+        return _import_spack_schemas(spack_root)
+
+    cache_file = get_cache_dir(
+        'spack', 'schemas', '{0}.json'.format(calculate_dict_checksum(revision)))
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as schema_cache:
+            return json.load(schema_cache)['schemas']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    schemas = _import_spack_schemas(spack_root)
+    try:
+        write_file_atomic(
+            cache_file,
+            json.dumps({'revision': revision, 'schemas': schemas}))
+    except (OSError, TypeError, ValueError) as error:
+        logging.getLogger('SpackBuilder').debug(
+            'Could not cache Spack schemas into %s: %s', cache_file, error)
+    return schemas
+
+# Schema of build_config.yaml
+BUILDCONFIG_SCHEMA = {
+    '$schema': 'http://json-schema.org/schema#',
+    'title': 'Package configuration file schema',
+    'type': 'object',
+    'additionalProperties': False,
+    'patternProperties': {
+        'target_architecture': {
+            'type': 'object',
+            'properties': {
+                'platform': {'type': 'string'},
+                'os': {'type': 'string'},
+                'target': {'type': 'string'},
+            },
+        },
+        'compilers': {
+            'type': 'array',
+            'default': [],
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'version': {'type': 'string'},
+                    'system_compiler': {'type': 'boolean'},
+                    'licenses': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'variants': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'dependencies': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'extra_flags': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'cpus': {
+                        'type': 'integer',
+                        'minimum': 1,
+                    },
+                    'flags': {
+                        'type': 'object',
+                        'properties': {
+                            'cflags': {'type': 'string'},
+                            'cxxflags': {'type': 'string'},
+                            'fflags': {'type': 'string'},
+                            'cppflags': {'type': 'string'},
+                            'ldflags': {'type': 'string'},
+                            'ldlibs': {'type': 'string'},
+                        },
+                    },
+                },
+                'required': ['name', 'version'],
+            },
+        },
+        'engine': {
+            'type': 'string',
+            'enum': ['sync', 'asyncio'],
+        },
+        'install_cpus': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'parallel_installs': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'install_mode': {
+            'type': 'string',
+            'enum': ['packages', 'environment'],
+        },
+        'concretization_cache': {
+            'type': 'boolean',
+        },
+        'skip_installed': {
+            'type': 'boolean',
+        },
+        'query_server': {
+            'type': 'boolean',
+        },
+        'packages': {
+            'type': 'array',
+            'default': [],
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'version': {'type': 'string'},
+                    'licenses': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'variants': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'dependencies': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'extra_flags': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                    },
+                    'cpus': {
+                        'type': 'integer',
+                        'minimum': 1,
+                    },
+                },
+                'required': ['name', 'version'],
+            },
+        },
+    },
+}
@@ -0,0 +1,98 @@
+# -*- coding=utf-8 -*-
+"""Benchmark for loading a large build_config.yaml.
+
+A Spack build_config.yaml with a large number of packages is loaded
+repeatedly:
+
+- by parsing it and validating it with jsonschema.validate, like ConfReader
+  did previously,
+- with ConfReader without the configuration cache, which reuses compiled
+  validators, and
+- with ConfReader using the configuration cache.
+
+Validation alone is also timed with jsonschema.validate and with the
+compiled validator registry.
+
+Run with:
+
+    python -m tests.benchmarks.bench_config_load [number of packages] [repeats]
+"""
+import os
+import sys
+import time
+import tempfile
+from unittest import mock
+
+import yaml
+import jsonschema
+
+from buildrules.spack import SpackBuilder
+from buildrules.common.confreader import ConfReader
+from buildrules.common.utils import write_yaml
+from buildrules.common.validators import validate
+
+def get_build_config(n_packages):
+    """Returns a build_config with n_packages packages."""
+    return {
+        'target_architecture': {'platform': 'linux', 'os': 'centos7', 'target': 'x86_64'},
+        'compilers': [
+            {'name': 'gcc', 'version': '9.3.0', 'system_compiler': False,
+             'flags': {'cflags': '-O2', 'cxxflags': '-O2'}},
+        ],
+        'packages': [
+            {'name': 'package{0}'.format(index),
+             'version': '1.{0}.0'.format(index),
+             'variants': ['+mpi', '~debug', 'build_type=Release'],
+             'dependencies': ['^openmpi@4.0.5', '^hdf5@1.10.7+mpi'],
+             'extra_flags': ['--keep-stage'],
+             'licenses': ['license{0}.dat'.format(index)] if index % 10 == 0 else []}
+            for index in range(n_packages)
+        ],
+    }
+
+def previous_load(config_file, schema):
+    """Previous implementation of ConfReader."""
+    with open(config_file, 'r') as yaml_f:
+        data = yaml.load(yaml_f.read(), Loader=yaml.Loader)
+    jsonschema.validate(instance=data, schema=schema)
+    return data
+
+def timeit(function, repeats):
+    """Returns the best time of repeated calls of function."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    n_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    schema = SpackBuilder.SCHEMAS[-1]
+
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            mock.patch.dict(os.environ, {'BUILDRULES_CACHE_DIR': tmpdir}):
+        config_file = os.path.join(tmpdir, 'build_config.yaml')
+        write_yaml(config_file, get_build_config(n_packages))
+
+        data = previous_load(config_file, schema)
+        results = [
+            ('jsonschema.validate only',
+             timeit(lambda: jsonschema.validate(instance=data, schema=schema), repeats)),
+            ('compiled validator only',
+             timeit(lambda: validate(data, schema), repeats)),
+            ('yaml.Loader + jsonschema.validate',
+             timeit(lambda: previous_load(config_file, schema), repeats)),
+            ('ConfReader, no cache',
+             timeit(lambda: ConfReader([config_file], [schema], use_cache=False), repeats)),
+            ('ConfReader, cached',
+             timeit(lambda: ConfReader([config_file], [schema]), repeats)),
+        ]
+
+    print('Loading build_config.yaml with {0} packages:'.format(n_packages))
+    for name, elapsed in results:
+        print('  {0:<36} {1:8.1f} ms'.format(name, elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# -*- coding=utf-8 -*-
+"""Benchmark for flattening Lmod module hierarchies.
+
+Creates a synthetic module hierarchy and compares a serial rewrite of the
+whole flat structure, like the one SpackBuilder used to do, against
+SpackBuilder._copy_all_modules on the first run, on an unchanged
+hierarchy and on a hierarchy that was regenerated with new timestamps.
+The serial rewrite and the first run are alternated and the best of the
+repeats is reported, as the cost of creating files varies a lot between
+runs.
+
+Run with:
+
+    python -m tests.benchmarks.bench_flatten_modules [number of modulefiles] [folder] [repeats]
+
+The folder defaults to a temporary folder. Give a folder on a network
+file system to measure the effect of concurrent file operations.
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import warnings
+from glob import glob
+from unittest import mock
+
+from buildrules.spack import SpackBuilder
+from buildrules.common.utils import write_yaml
+
+ARCH_FOLDERS = ['linux-centos7-haswell', 'linux-centos7-skylake']
+MPI_LIBRARIES = ['openmpi/4.0.5', 'mpich/3.3.2', 'intel-mpi/2019.7']
+
+MODULEFILE = """-- -*- lua -*-
+whatis([[Name : {name}]])
+whatis([[Version : {version}]])
+prepend_path("PATH", "/appl/{name}/{version}/bin", ":")
+prepend_path("MANPATH", "/appl/{name}/{version}/share/man", ":")
+prepend_path("MODULEPATH", "/appl/modules/{name}/{version}")
+setenv("{upper}_ROOT", "/appl/{name}/{version}")
+"""
+
+def create_hierarchy(lmod_root, n_modulefiles):
+    """Creates n_modulefiles hierarchical modulefiles with unique flat
+    paths."""
+    hierarchies = ['Core'] + [os.path.join(mpi, 'Core') for mpi in MPI_LIBRARIES]
+    for index in range(n_modulefiles):
+        arch_folder = ARCH_FOLDERS[index % len(ARCH_FOLDERS)]
+        hierarchy = hierarchies[(index // len(ARCH_FOLDERS)) % len(hierarchies)]
+        name = 'package{0}'.format(index // 10)
+        version = '1.{0}.{1}'.format(index % 10, hierarchies.index(hierarchy))
+        module_folder = os.path.join(lmod_root, arch_folder, hierarchy, name)
+        os.makedirs(module_folder, exist_ok=True)
+        with open(os.path.join(module_folder, version + '.lua'), 'w') as modulefile:
+            modulefile.write(MODULEFILE.format(name=name, version=version, upper=name.upper()))
+
+def touch_hierarchy(lmod_root):
+    """Gives every hierarchical modulefile a new modification time like
+    'spack module lmod refresh' does."""
+    timestamp = time.time_ns() + 10**9
+    for modulefile in glob(os.path.join(lmod_root, '*', '**', '*.lua'), recursive=True):
+        if os.sep + 'all' + os.sep not in modulefile:
+            os.utime(modulefile, ns=(timestamp, timestamp))
+
+def copy_serially(lmod_root):
+    """Rewrites the whole flat structure serially."""
+    remove_flat_modules(lmod_root)
+    for arch_folder in ARCH_FOLDERS:
+        arch_root = os.path.join(lmod_root, arch_folder)
+        modulefiles = (glob(os.path.join(arch_root, 'Core', '*', '*.lua')) +
+                       glob(os.path.join(arch_root, '*', '*', 'Core', '*', '*.lua')))
+        for modulefile in modulefiles:
+            parts = modulefile.split(os.sep)
+            module_folder = os.path.join(arch_root, 'all', parts[-2])
+            os.makedirs(module_folder, exist_ok=True)
+            with open(modulefile, 'r') as source:
+                lines = source.readlines()
+            target_file = os.path.join(module_folder, parts[-1])
+            with open(target_file, 'w') as target:
+                for line in lines:
+                    if 'MODULEPATH' not in line:
+                        target.write(line)
+            os.chmod(target_file, 0o644)
+
+def get_builder(conf_folder):
+    """Returns a SpackBuilder with minimal configuration."""
+    os.makedirs(conf_folder)
+    for conf_file, contents in [('config.yaml', {'config': {}}),
+                                ('modules.yaml', {'modules': {}}),
+                                ('packages.yaml', {'packages': {}}),
+                                ('build_config.yaml', {'compilers': [], 'packages': []})]:
+        write_yaml(os.path.join(conf_folder, conf_file), contents)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return SpackBuilder(conf_folder, deployers=[])
+
+def remove_flat_modules(lmod_root):
+    for arch_folder in ARCH_FOLDERS:
+        all_folder = os.path.join(lmod_root, arch_folder, 'all')
+        if os.path.isdir(all_folder):
+            shutil.rmtree(all_folder)
+
+def timeit(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def main():
+    n_modulefiles = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    root = sys.argv[2] if len(sys.argv) > 2 else None
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    logging.getLogger('SpackBuilder').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(dir=root) as tmpdir, \
+            mock.patch.dict(os.environ, {'BUILDRULES_CACHE_DIR': tmpdir}):
+        lmod_root = os.path.join(tmpdir, 'lmod')
+        builder = get_builder(os.path.join(tmpdir, 'spack'))
+        create_hierarchy(lmod_root, n_modulefiles)
+
+        print('Hierarchy with {0} modulefiles (best of {1}):'.format(n_modulefiles, repeats))
+        serial_runs = []
+        first_runs = []
+        for _ in range(repeats):
+            serial_runs.append(timeit(lambda: copy_serially(lmod_root)))
+            remove_flat_modules(lmod_root)
+            first_runs.append(timeit(lambda: builder._copy_all_modules(lmod_root)))
+        results = [
+            ('serial rewrite', min(serial_runs, key=lambda run: run[0])),
+            ('first run', min(first_runs, key=lambda run: run[0])),
+        ]
+        results.append(
+            ('unchanged', timeit(lambda: builder._copy_all_modules(lmod_root))))
+        touch_hierarchy(lmod_root)
+        results.append(
+            ('regenerated', timeit(lambda: builder._copy_all_modules(lmod_root))))
+        for name, (elapsed, counts) in results:
+            print('  {0:<16} {1:8.2f} s  {2}'.format(name, elapsed, counts or ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding=utf-8 -*-
+"""Benchmark for the output handling of SubprocessRule.
+
+Compares the chunked OutputPump against the previous implementation that
+read one line per ready stream with readline(). A synthetic child process
+writes a large number of lines into both stdout and stderr.
+
+Run with:
+
+    python -m tests.benchmarks.bench_output_pump [number of lines]
+"""
+import sys
+import time
+import select
+import subprocess
+
+from buildrules.common.rule import OutputPump
+
+NOISY_CHILD = """
+import sys
+lines = int(sys.argv[1])
+line = 'x' * 80
+for i in range(lines):
+    sys.stdout.write('stdout %d %s\\n' % (i, line))
+    if i % 4 == 0:
+        sys.stderr.write('stderr %d %s\\n' % (i, line))
+"""
+
+def readline_capture(cmd, writer):
+    """Previous implementation of SubprocessRule output handling."""
+    sp_call = subprocess.Popen(cmd, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    loggers = {sp_call.stdout: writer, sp_call.stderr: writer}
+
+    def capture_io():
+        output = select.select([sp_call.stdout, sp_call.stderr], [], [], 1000)[0]
+        for io_stream in output:
+            line = io_stream.readline()[:-1].decode('utf-8')
+            if line:
+                loggers[io_stream](line)
+
+    while sp_call.poll() is None:
+        capture_io()
+    # Previous implementation could leave buffered lines unread, drain them
+    # so that both implementations do the same amount of work
+    for io_stream in (sp_call.stdout, sp_call.stderr):
+        for line in io_stream:
+            if line[:-1]:
+                loggers[io_stream](line[:-1].decode('utf-8'))
+    return sp_call.wait()
+
+def pump_capture(cmd, writer):
+    """Current implementation of SubprocessRule output handling."""
+    sp_call = subprocess.Popen(cmd, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with sp_call:
+        OutputPump({sp_call.stdout: writer, sp_call.stderr: writer}).run()
+        return sp_call.wait()
+
+def benchmark(capture, lines):
+    """Runs a capture function against the noisy child.
+
+    Returns:
+        tuple: Lines per second and the number of writer calls.
+    """
+    counts = {'lines': 0, 'calls': 0}
+
+    def writer(message):
+        counts['calls'] += 1
+        counts['lines'] += message.count('\n') + 1
+
+    cmd = [sys.executable, '-c', NOISY_CHILD, str(lines)]
+    start = time.perf_counter()
+    capture(cmd, writer)
+    elapsed = time.perf_counter() - start
+    return counts['lines'] / elapsed, counts['lines'], counts['calls']
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for name, capture in (('readline', readline_capture), ('OutputPump', pump_capture)):
+        lines_per_second, total_lines, calls = benchmark(capture, lines)
+        print('{0:<12} {1:>12.0f} lines/s {2:>10} lines {3:>10} writer calls'.format(
+            name, lines_per_second, total_lines, calls))
+
+if __name__ == '__main__':
+    main()
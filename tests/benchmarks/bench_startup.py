@@ -0,0 +1,38 @@
+# -*- coding=utf-8 -*-
+"""Benchmark for the startup of the buildrules command line interface.
+
+Reports the import time of buildrules and of each builder measured with
+-X importtime. Interpreter startup (site etc.) is not included.
+
+Run with:
+
+    python -m tests.benchmarks.bench_startup [repeats]
+"""
+import sys
+
+from buildrules import BUILDERS
+from tests.test_startup import get_import_times
+
+STARTUP_MODULES = ['site', 'encodings', 'encodings.utf_8', 'io', 'zipimport',
+                   '_frozen_importlib_external', '_signal', '_io', 'marshal',
+                   'posix', 'time', '_codecs', 'codecs', 'encodings.aliases',
+                   'abc', '_abc', '_stat', 'stat', '_collections_abc',
+                   'genericpath', 'posixpath', 'os', '_sitebuiltins']
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    benchmarks = [('import buildrules', 'import buildrules')]
+    benchmarks.extend([
+        (builder, 'import buildrules; buildrules.BUILDERS[{0!r}]'.format(builder))
+        for builder in BUILDERS])
+    for name, code in benchmarks:
+        times = []
+        for _ in range(repeats):
+            import_times = get_import_times(code, top_level=True)
+            times.append(sum(
+                cumulative for module, cumulative in import_times.items()
+                if module not in STARTUP_MODULES))
+        print('{0:<20} {1:8.1f} ms'.format(name, min(times) / 1000.))
+
+if __name__ == '__main__':
+    main()
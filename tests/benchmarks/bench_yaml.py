@@ -0,0 +1,70 @@
+# -*- coding=utf-8 -*-
+"""Benchmark for YAML loading and dumping.
+
+Compares the pure-Python PyYAML loader and YAMLDumper against the helpers
+in buildrules.common.utils that use libyaml when it is available. The
+document resembles a large installed_environments.yml.
+
+Run with:
+
+    python -m tests.benchmarks.bench_yaml [number of environments] [repeats]
+"""
+import sys
+import time
+
+import yaml
+
+from buildrules.common.utils import YAMLDumper, CYAMLDumper, dump_yaml, parse_yaml
+
+def get_document(n_environments):
+    """Returns a document with n_environments environments."""
+    return {
+        'environments': {
+            'env{0}'.format(index): {
+                'name': 'env{0}'.format(index),
+                'version': '2020.{0}'.format(index),
+                'path': '/share/apps/anaconda/env{0}'.format(index),
+                'channels': ['conda-forge', 'defaults'],
+                'dependencies': (
+                    ['package{0}=1.{1}'.format(package, index) for package in range(40)] +
+                    [{'pip': ['pip-package{0}==1.0'.format(package) for package in range(10)]}]),
+            }
+            for index in range(n_environments)
+        }
+    }
+
+def timeit(function, repeats):
+    """Returns the best time of repeated calls of function."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    n_environments = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    document = get_document(n_environments)
+    yaml_str = yaml.dump(document, default_flow_style=False, Dumper=YAMLDumper)
+    assert dump_yaml(document) == yaml_str
+
+    print('libyaml available: {0}'.format(CYAMLDumper is not None))
+    print('Document with {0} environments ({1} kB):'.format(
+        n_environments, len(yaml_str) // 1024))
+    results = [
+        ('load, yaml.SafeLoader',
+         timeit(lambda: yaml.load(yaml_str, Loader=yaml.SafeLoader), repeats)),
+        ('load, parse_yaml',
+         timeit(lambda: parse_yaml(yaml_str), repeats)),
+        ('dump, YAMLDumper',
+         timeit(lambda: yaml.dump(document, default_flow_style=False, Dumper=YAMLDumper),
+                repeats)),
+        ('dump, dump_yaml',
+         timeit(lambda: dump_yaml(document), repeats)),
+    ]
+    for name, elapsed in results:
+        print('  {0:<24} {1:8.1f} ms'.format(name, elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
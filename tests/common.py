@@ -4,6 +4,9 @@
 import os
 import warnings
 import logging
+import tempfile
+import unittest
+from unittest import mock
 from collections import defaultdict
 from functools import wraps
 from io import StringIO
@@ -46,6 +49,20 @@ def ignore_deprecationwarning(func):
         return response
     return inner
 
+class CacheDirTestCase(unittest.TestCase):
+    """TestCase that creates a temporary folder for each test and uses it
+    as the cache folder of buildrules, so that stamps, configuration caches,
+    journals and traces are not written into the user's cache folder.
+    The folder is removed after the test."""
+
+    def setUp(self):
+        super().setUp()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        patcher = mock.patch.dict(os.environ, {'BUILDRULES_CACHE_DIR': self._tmpdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
 def example_function(val1=1, val2=2):
     """Example Python function that can be used for various calls."""
     return val1 + val2
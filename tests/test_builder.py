@@ -1,12 +1,15 @@
 # -*- coding=utf-8 -*-
 """These tests test various features of the buildrules.common.builder-module."""
 import os
+import io
+import json
 import unittest
 import copy
 import logging
+from contextlib import redirect_stdout
 from testfixtures import log_capture
 
-from .common import (ignore_deprecationwarning, example_function,
+from .common import (CacheDirTestCase, ignore_deprecationwarning, example_function,
                     count_log_events, EXAMPLE_CONFIGS, EXAMPLE_SCHEMAS)
 from buildrules.common.builder import Builder
 from buildrules.common.rule import PythonRule, SubprocessRule, RuleError
@@ -18,7 +21,7 @@ def print_keys(conf_dict):
     for key in conf_dict:
         print(key)
 
-class TestBuilder(unittest.TestCase):
+class TestBuilder(CacheDirTestCase):
 
     @ignore_deprecationwarning
     @log_capture(level=logging.INFO)
@@ -167,6 +170,49 @@ class TestBuilder(unittest.TestCase):
             ),
         )
 
+    @ignore_deprecationwarning
+    @log_capture(level=logging.INFO)
+    def test_builder_describe_json(self, capture):
+        """This function creates a simple builder, then checks the plan written
+        by the Builder's 'describe()' method in JSON format."""
+
+        class TestBuilderDescribeJSON(Builder):
+
+            def __init__(self, conf_folder):
+                self.get_rules_calls = 0
+                super().__init__(conf_folder)
+
+            def _get_rules(self):
+                self.get_rules_calls += 1
+                python_rule = PythonRule(example_function, [0, 0], {})
+                subprocess_rule = SubprocessRule(
+                    ['echo', 'test'], env={'SECRET': 'value'}).depends_on(python_rule)
+                return [python_rule, subprocess_rule]
+
+        builder_instance = TestBuilderDescribeJSON(os.path.join('tests', 'builder_test'))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            builder_instance.describe(output_format='json')
+        builder_instance.describe(output_format='json')
+        self.assertEqual(builder_instance.get_rules_calls, 1)
+
+        plan = json.loads(output.getvalue())
+        self.assertEqual(plan['builder'], 'None')
+        self.assertEqual(len(plan['build_id']), 64)
+        python_plan, subprocess_plan = plan['rules']
+        self.assertEqual(python_plan['type'], 'PythonRule')
+        self.assertEqual(python_plan['function'], 'example_function')
+        self.assertEqual(python_plan['index'], 0)
+        self.assertEqual(python_plan['dependencies'], [])
+        self.assertEqual(subprocess_plan['type'], 'SubprocessRule')
+        self.assertEqual(subprocess_plan['command'], ['echo', 'test'])
+        self.assertEqual(subprocess_plan['env_keys'], ['SECRET'])
+        self.assertNotIn('value', output.getvalue())
+        self.assertEqual(subprocess_plan['dependencies'], [0])
+        self.assertEqual(
+            subprocess_plan['fingerprint'],
+            builder_instance._get_rules()[1].fingerprint(include_files=False))
+
     @ignore_deprecationwarning
     @log_capture(level=logging.INFO)
     def test_builder_additional_conf_file_empty_schema(self, capture):
@@ -3,13 +3,17 @@
 
 import os
 import copy
+import json
+import stat
+import shutil
 import unittest
+from unittest import mock
 from jsonschema.exceptions import ValidationError
 
 from buildrules.common.confreader import ConfReader
-from .common import EXAMPLE_CONFIGS, EXAMPLE_SCHEMAS
+from .common import CacheDirTestCase, EXAMPLE_CONFIGS, EXAMPLE_SCHEMAS
 
-class TestConfReader(unittest.TestCase):
+class TestConfReader(CacheDirTestCase):
     """This class tests various features of the buildrules.common.confreader-module."""
 
     def test_conf_reader_valid_default(self):
@@ -219,6 +223,61 @@ class TestConfReader(unittest.TestCase):
             )
             print(cr_invalid)
 
+    def test_conf_reader_cache(self):
+        """Cached configurations are neither parsed nor validated again
+        unless the configuration file or the schema has changed."""
+        deployment_config_schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+
+        deployment_config = os.path.join(self._tmpdir.name, 'deployment_config.yaml')
+        shutil.copy(EXAMPLE_CONFIGS['deployment_config'], deployment_config)
+
+        cr_first = ConfReader([deployment_config], [deployment_config_schema])
+
+        with mock.patch.object(ConfReader, '_parse_yaml') as parse_yaml, \
+                mock.patch.object(ConfReader, 'validate') as validate:
+            cr_cached = ConfReader([deployment_config], [deployment_config_schema])
+        parse_yaml.assert_not_called()
+        validate.assert_not_called()
+        self.assertEqual(dict(cr_cached), dict(cr_first))
+
+        # Changed schema is validated again
+        deployment_config_schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+        deployment_config_schema['required'].append('missing_field')
+        with self.assertRaises(ValidationError):
+            ConfReader([deployment_config], [deployment_config_schema])
+
+        # Changed configuration is parsed again
+        deployment_config_schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+        with open(deployment_config, 'r') as config_file:
+            contents = config_file.read()
+        with open(deployment_config, 'w') as config_file:
+            config_file.write(contents.replace('host.example.com', 'other.example.com'))
+        cr_changed = ConfReader([deployment_config], [deployment_config_schema])
+        self.assertEqual(
+            cr_changed['deployment_config']['target_host'], 'other.example.com')
+
+    def test_conf_reader_untrusted_cache(self):
+        """Cache entries that other users can write to are not used."""
+        deployment_config = EXAMPLE_CONFIGS['deployment_config']
+        deployment_config_schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+
+        cr_first = ConfReader([deployment_config], [deployment_config_schema])
+        with open(deployment_config, 'rb') as config_file:
+            cache_file = ConfReader._get_cache_file(
+                config_file.read(), deployment_config_schema)
+        with open(cache_file, 'r') as cache_f:
+            self.assertEqual(json.load(cache_f), dict(cr_first)['deployment_config'])
+
+        for path in (cache_file, os.path.dirname(cache_file)):
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode | stat.S_IWOTH)
+            with mock.patch.object(
+                    ConfReader, '_parse_yaml', wraps=ConfReader._parse_yaml) as parse_yaml:
+                cr_untrusted = ConfReader([deployment_config], [deployment_config_schema])
+            parse_yaml.assert_called_once()
+            self.assertEqual(dict(cr_untrusted), dict(cr_first))
+            os.chmod(path, mode)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.journal-module."""
+
+import os
+import shutil
+import unittest
+
+from buildrules.common.builder import Builder
+from buildrules.common.rule import PythonRule
+from buildrules.common.journal import RuleJournal
+
+from .common import CacheDirTestCase, ignore_deprecationwarning
+
+def failing_function():
+    """Example Python function that raises an error."""
+    raise Exception('Failing function')
+
+class TestJournal(CacheDirTestCase):
+    """This class tests various features of the buildrules.common.journal-module."""
+
+    def test_journal(self):
+        """Completed rules are read back from the journal."""
+        journal_file = os.path.join(self._tmpdir.name, 'journals', 'test.journal')
+        journal = RuleJournal(journal_file)
+        self.assertEqual(journal.completed(), set())
+        journal.record(0, 'abc')
+        journal.record(2, 'def')
+        # Incomplete line from a killed build is ignored
+        with open(journal_file, 'a') as journal_f:
+            journal_f.write('3 gh')
+        journal = RuleJournal(journal_file)
+        journal.record(4, 'ijk')
+        self.assertEqual(journal.completed(), {(0, 'abc'), (2, 'def'), (4, 'ijk')})
+        journal.clear()
+        self.assertFalse(os.path.exists(journal_file))
+
+    @ignore_deprecationwarning
+    def test_builder_resume(self):
+        """Resumed build skips rules completed by a failed build."""
+
+        class TestBuilderResume(Builder):
+
+            def __init__(self, conf_folder):
+                self.runs = []
+                self.fail = True
+                super().__init__(conf_folder)
+
+            def fail_once(self):
+                if self.fail:
+                    self.fail = False
+                    raise Exception('Failing once')
+                self.runs.append('b')
+
+            def _get_rules(self):
+                return [
+                    PythonRule(self.runs.append, ['a']),
+                    PythonRule(self.fail_once),
+                    PythonRule(self.runs.append, ['c']),
+                ]
+
+        builder_instance = TestBuilderResume(os.path.join('tests', 'builder_test'))
+        with self.assertRaises(SystemExit):
+            builder_instance()
+        self.assertEqual(builder_instance.runs, ['a'])
+        builder_instance(resume=True)
+        self.assertEqual(builder_instance.runs, ['a', 'b', 'c'])
+
+        # Journal is removed after a successful build
+        builder_instance(resume=True)
+        self.assertEqual(builder_instance.runs, ['a', 'b', 'c', 'a', 'b', 'c'])
+
+    @ignore_deprecationwarning
+    def test_builder_remove_journals(self):
+        """Successful build removes the journals of superseded builds."""
+
+        class TestBuilderJournals(Builder):
+
+            def __init__(self, conf_folder):
+                self.rules = [PythonRule(print), PythonRule(failing_function)]
+                super().__init__(conf_folder)
+
+            def _get_rules(self):
+                return self.rules
+
+        other_conf_folder = os.path.join(self._tmpdir.name, 'other_builder_test')
+        shutil.copytree(os.path.join('tests', 'builder_test'), other_conf_folder)
+        builder_instance = TestBuilderJournals(os.path.join('tests', 'builder_test'))
+        other_instance = TestBuilderJournals(other_conf_folder)
+        journal_dir = builder_instance._get_journal_dir()
+        other_journal_dir = other_instance._get_journal_dir()
+        self.assertNotEqual(journal_dir, other_journal_dir)
+        with self.assertRaises(SystemExit):
+            builder_instance()
+        builder_instance.rules = [PythonRule(print), PythonRule(print),
+                                  PythonRule(failing_function)]
+        with self.assertRaises(SystemExit):
+            builder_instance()
+        with self.assertRaises(SystemExit):
+            other_instance()
+        self.assertEqual(len(os.listdir(journal_dir)), 2)
+
+        # Journals of builds from other configuration folders are kept
+        builder_instance.rules = [PythonRule(print)]
+        builder_instance()
+        self.assertEqual(os.listdir(journal_dir), [])
+        self.assertEqual(len(os.listdir(other_journal_dir)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
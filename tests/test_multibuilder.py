@@ -0,0 +1,108 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.multibuilder-module."""
+
+import os
+import unittest
+import threading
+from unittest import mock
+
+from buildrules.common.builder import Builder
+from buildrules.common.rule import PythonRule, SubprocessRule
+from buildrules.common.multibuilder import MultiBuilder
+from buildrules.common.deployer import RsyncDeployer
+from buildrules.common.utils import write_yaml
+
+from .common import CacheDirTestCase, ignore_deprecationwarning
+
+BARRIER = threading.Barrier(2, timeout=10)
+
+class BuilderA(Builder):
+
+    BUILDER_NAME = 'A'
+
+    def _get_rules(self):
+        return [PythonRule(BARRIER.wait)]
+
+class BuilderB(BuilderA):
+
+    BUILDER_NAME = 'B'
+
+class FailingBuilder(Builder):
+
+    BUILDER_NAME = 'Failing'
+
+    def _get_rules(self):
+        return [SubprocessRule(['false'])]
+
+def create_target(deployer):
+    """Replacement for RsyncDeployer.get_rules that creates the target."""
+    return [PythonRule(os.makedirs, [deployer.config['dest']])]
+
+REGISTRY = {'a': BuilderA, 'b': BuilderB, 'failing': FailingBuilder}
+
+class TestMultiBuilder(CacheDirTestCase):
+    """This class tests various features of the buildrules.common.multibuilder-module."""
+
+    def setUp(self):
+        super().setUp()
+        self._conf_root = os.path.join(self._tmpdir.name, 'configs')
+        self._target = os.path.join(self._tmpdir.name, 'target')
+        for name in REGISTRY:
+            os.makedirs(os.path.join(self._conf_root, name))
+            write_yaml(
+                os.path.join(self._conf_root, name, 'deployment_config.yaml'),
+                [{'method': 'rsync', 'target_host': 'localhost',
+                  'source': os.path.join(self._tmpdir.name, 'source', ''),
+                  'dest': self._target}])
+        os.makedirs(os.path.join(self._tmpdir.name, 'source'))
+        BARRIER.reset()
+
+    def test_merge_deployers(self):
+        """Identical deployments of builders are merged."""
+        multibuilder = MultiBuilder(self._conf_root, ['a', 'b'], registry=REGISTRY)
+        self.assertEqual(len(multibuilder.deployers), 1)
+        self.assertEqual(sorted(multibuilder.builders), ['a', 'b'])
+
+    def test_shared_deployment_config(self):
+        """deployment_config in the configuration root is shared by all builders."""
+        write_yaml(os.path.join(self._conf_root, 'deployment_config.yaml'), [])
+        os.remove(os.path.join(self._conf_root, 'a', 'deployment_config.yaml'))
+        multibuilder = MultiBuilder(self._conf_root, ['a', 'b'], registry=REGISTRY)
+        self.assertEqual(multibuilder.deployers, [])
+        self.assertIs(multibuilder.builders['a'].deployers,
+                      multibuilder.builders['b'].deployers)
+
+    @ignore_deprecationwarning
+    def test_concurrent_builders(self):
+        """Builders are run concurrently and deployed once at the end."""
+        multibuilder = MultiBuilder(self._conf_root, ['a', 'b'], registry=REGISTRY)
+        with mock.patch.object(Builder, 'get_deployer_rules',
+                               wraps=Builder.get_deployer_rules) as get_deployer_rules, \
+                mock.patch.object(RsyncDeployer, 'get_rules', create_target):
+            multibuilder()
+        get_deployer_rules.assert_called_once_with(multibuilder.deployers)
+        self.assertTrue(os.path.isdir(self._target))
+
+    @ignore_deprecationwarning
+    def test_failing_builder(self):
+        """Deployments are skipped if a builder fails."""
+        multibuilder = MultiBuilder(self._conf_root, ['failing'], registry=REGISTRY)
+        with self.assertRaises(SystemExit), \
+                mock.patch.object(RsyncDeployer, 'get_rules', create_target):
+            multibuilder()
+        self.assertFalse(os.path.isdir(self._target))
+
+    def test_plan(self):
+        """Plan contains builders without deployments and merged deployments."""
+        multibuilder = MultiBuilder(self._conf_root, ['a', 'b'], registry=REGISTRY)
+        with mock.patch.object(RsyncDeployer, 'get_rules', create_target):
+            plan = multibuilder.get_plan()
+        self.assertEqual(sorted(plan['builders']), ['a', 'b'])
+        self.assertEqual(
+            [rule['function'] for rule in plan['builders']['a']['rules']],
+            ['Barrier.wait'])
+        self.assertEqual(len(plan['deployments']), 1)
+        self.assertEqual(plan['deployments'][0]['phase'], 'RsyncDeployer.get_rules')
+
+if __name__ == '__main__':
+    unittest.main()
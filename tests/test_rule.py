@@ -1,12 +1,16 @@
 # -*- coding=utf-8 -*-
 """These tests test various features of the buildrules.common.rule-module."""
 
+import os
+import gzip
 import unittest
 import logging
+import tempfile
 from testfixtures import log_capture
 from subprocess import CalledProcessError
 
-from buildrules.common.rule import PythonRule, SubprocessRule, RuleError, LoggingRule
+from buildrules.common.rule import (PythonRule, SubprocessRule, RuleError,
+                                    LoggingRule, OutputPump)
 
 from .common import ignore_deprecationwarning, example_function
 
@@ -207,5 +211,44 @@ class TestRule(unittest.TestCase):
             )
         )
 
+    def test_output_pump(self):
+        """OutputPump passes complete lines in batches and keeps partial
+        lines until they are completed."""
+        read_fd, write_fd = os.pipe()
+        output = []
+        with os.fdopen(read_fd, 'rb', buffering=0) as read_stream:
+            pump = OutputPump({read_stream: output.append})
+            os.write(write_fd, b'a\nb\n\nc')
+            self.assertTrue(pump.pump(timeout=5))
+            self.assertEqual(output, ['a\nb'])
+            os.write(write_fd, b'd\ne')
+            self.assertTrue(pump.pump(timeout=5))
+            self.assertEqual(output, ['a\nb', 'cd'])
+            os.close(write_fd)
+            pump.run()
+            self.assertEqual(output, ['a\nb', 'cd', 'e'])
+            self.assertFalse(pump.pump())
+
+    @ignore_deprecationwarning
+    @log_capture()
+    def test_subprocess_spool_output(self, capture):
+        """Spooled output is written into a compressed log file and its tail
+        is logged on failure."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log_file = os.path.join(tmpdir, 'logs', 'seq.log.gz')
+            SubprocessRule(['seq', '1', '5']).spool_output(log_file)()
+            with gzip.open(log_file, 'rt') as log_f:
+                self.assertEqual(log_f.read().splitlines()[1:], ['1', '2', '3', '4', '5'])
+
+            with self.assertRaises(RuleError):
+                SubprocessRule(
+                    ['seq 1 5; false'],
+                    shell=True).spool_output(log_file, tail_lines=2)()
+
+        messages = [record[2] for record in capture.actual() if record[0] == 'SubprocessRule']
+        self.assertTrue(messages[0].startswith('SubprocessRule: seq 1 5 finished in'))
+        self.assertTrue(messages[1].startswith('SubprocessRule: seq 1 5; false failed after'))
+        self.assertTrue(messages[1].endswith('\n4\n5'))
+
 if __name__ == '__main__':
     unittest.main()
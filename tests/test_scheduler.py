@@ -0,0 +1,215 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.scheduler-module."""
+
+import os
+import unittest
+import time
+import threading
+
+from buildrules.common.builder import Builder
+from buildrules.common.rule import (PythonRule, SubprocessRule, LoggingRule,
+                                    RuleError, chain_rules)
+from buildrules.common.scheduler import RuleScheduler, AsyncRuleScheduler
+from buildrules.common.resources import ResourcePool
+
+from .common import CacheDirTestCase, ignore_deprecationwarning, example_function
+
+def failing_function():
+    """Example Python function that raises an error."""
+    raise Exception('Failing function')
+
+class TestScheduler(CacheDirTestCase):
+    """This class tests various features of the buildrules.common.scheduler-module."""
+
+    def test_resolve_dependencies_sequential(self):
+        """Rules without dependencies depend on all preceding rules."""
+        rules = [LoggingRule('a'), LoggingRule('b'), LoggingRule('c')]
+        self.assertEqual(
+            RuleScheduler.resolve_dependencies(rules),
+            [set(), {0}, {1}])
+
+    def test_resolve_dependencies_chains(self):
+        """Chained rules only depend on their chain and barrier rules wait
+        for every chain."""
+        start_rule = LoggingRule('start')
+        chain1 = chain_rules([LoggingRule('a1'), LoggingRule('a2')], [start_rule])
+        chain2 = chain_rules([LoggingRule('b1')], [start_rule])
+        rules = [start_rule] + chain1 + chain2 + [LoggingRule('end')]
+        self.assertEqual(
+            RuleScheduler.resolve_dependencies(rules),
+            [set(), {0}, {1}, {0}, {2, 3}])
+
+    def test_resolve_dependencies_invalid(self):
+        """Dependencies must precede the rule."""
+        rule1 = LoggingRule('a')
+        rule2 = LoggingRule('b').depends_on(rule1)
+        with self.assertRaises(ValueError):
+            RuleScheduler([rule2, rule1])
+        with self.assertRaises(ValueError):
+            RuleScheduler([rule2])
+
+    @ignore_deprecationwarning
+    def test_parallel_execution(self):
+        """Independent rules are run concurrently."""
+        barrier = threading.Barrier(2, timeout=10)
+        finished = []
+
+        def wait_for_other():
+            barrier.wait()
+
+        start_rule = LoggingRule('start')
+        rules = [start_rule]
+        for _ in range(2):
+            rules.extend(chain_rules([PythonRule(wait_for_other)], [start_rule]))
+        rules.append(PythonRule(finished.append, [True]))
+
+        RuleScheduler(rules, jobs=2)(lambda index, rule: rule())
+
+        self.assertEqual(finished, [True])
+
+    @ignore_deprecationwarning
+    def test_parallel_execution_error(self):
+        """Rules that depend on a failed rule are not run."""
+        results = []
+        start_rule = LoggingRule('start')
+        rules = [start_rule]
+        rules.extend(chain_rules([
+            PythonRule(failing_function),
+            PythonRule(results.append, ['a'])], [start_rule]))
+        rules.extend(chain_rules([
+            PythonRule(results.append, [example_function()])], [start_rule]))
+        rules.append(PythonRule(results.append, ['end']))
+
+        with self.assertRaises(RuleError):
+            RuleScheduler(rules, jobs=4)(lambda index, rule: rule())
+
+        self.assertNotIn('a', results)
+        self.assertNotIn('end', results)
+
+    def test_resource_pool(self):
+        """Resources are reserved until they are released and requests
+        larger than the pool are limited to the pool size."""
+        pool = ResourcePool(cpus=4, memory=1000)
+        self.assertTrue(pool.acquire({'cpus': 3, 'memory': 500}))
+        self.assertFalse(pool.acquire({'cpus': 2, 'memory': 0}))
+        self.assertFalse(pool.acquire({'cpus': 1, 'memory': 600}))
+        self.assertTrue(pool.acquire({'cpus': 1, 'memory': 500}))
+        pool.release({'cpus': 3, 'memory': 500})
+        pool.release({'cpus': 1, 'memory': 500})
+        self.assertTrue(pool.acquire({'cpus': 64, 'memory': 10000}))
+        self.assertTrue(pool.acquire({'cpus': 0, 'memory': 0, 'scratch': 'large'}))
+        self.assertFalse(pool.acquire({'cpus': 0, 'memory': 0, 'scratch': 'large'}))
+        pool.set_scratch_limit('install', 1)
+        self.assertTrue(pool.acquire({'cpus': 0, 'memory': 0, 'scratch': 'install'}))
+        self.assertFalse(pool.acquire({'cpus': 0, 'memory': 0, 'scratch': 'install'}))
+
+    @ignore_deprecationwarning
+    def test_resource_packing(self):
+        """Concurrent rules never use more CPU slots than are available."""
+        lock = threading.Lock()
+        usage = {'current': 0, 'max': 0}
+
+        def use_cpus(cpus):
+            with lock:
+                usage['current'] += cpus
+                usage['max'] = max(usage['max'], usage['current'])
+            time.sleep(0.05)
+            with lock:
+                usage['current'] -= cpus
+
+        start_rule = LoggingRule('start')
+        rules = [start_rule]
+        for cpus in [3, 2, 1, 3, 1, 2]:
+            rules.extend(chain_rules([
+                PythonRule(use_cpus, [cpus]).set_resources(cpus=cpus)], [start_rule]))
+
+        RuleScheduler(rules, jobs=6, capacity=ResourcePool(cpus=4, memory=0))(
+            lambda index, rule: rule())
+
+        self.assertLessEqual(usage['max'], 4)
+        self.assertGreater(usage['max'], 3)
+
+    @ignore_deprecationwarning
+    def test_shared_resource_pool(self):
+        """Schedulers wait for capacity that other users of a shared pool
+        hold instead of skipping their rules."""
+        results = []
+        start_rule = LoggingRule('start').set_resources(cpus=2)
+        rules = [start_rule]
+        rules.extend(chain_rules([PythonRule(results.append, ['a'])], [start_rule]))
+        rules.extend(chain_rules([PythonRule(results.append, ['b'])], [start_rule]))
+
+        for scheduler_class, jobs in [(RuleScheduler, 1), (RuleScheduler, 2),
+                                      (AsyncRuleScheduler, 2)]:
+            results.clear()
+            pool = ResourcePool(cpus=2, memory=0)
+            self.assertTrue(pool.acquire({'cpus': 2}))
+            timer = threading.Timer(0.2, pool.release, [{'cpus': 2}])
+            timer.start()
+            if scheduler_class is AsyncRuleScheduler:
+                async def run_rule(index, rule):
+                    rule()
+                scheduler_class(rules, jobs=jobs, capacity=pool)(run_rule)
+            else:
+                scheduler_class(rules, jobs=jobs, capacity=pool)(
+                    lambda index, rule: rule())
+            timer.join()
+            self.assertEqual(sorted(results), ['a', 'b'])
+            self.assertTrue(pool.acquire({'cpus': 2}))
+
+    @ignore_deprecationwarning
+    def test_async_execution(self):
+        """Subprocesses are run concurrently in an event loop."""
+        output = []
+        start_rule = LoggingRule('start')
+        rules = [start_rule]
+        for index in range(3):
+            rules.extend(chain_rules([
+                SubprocessRule(
+                    ['sleep 0.2; echo {0}'.format(index)],
+                    shell=True,
+                    stdout_writer=output.append)], [start_rule]))
+        rules.append(PythonRule(output.append, ['end']))
+
+        async def run_rule(index, rule):
+            await rule.run_async()
+
+        AsyncRuleScheduler(rules, jobs=3)(run_rule)
+
+        self.assertEqual(sorted(output[:3]), ['0', '1', '2'])
+        self.assertEqual(output[3], 'end')
+
+    @ignore_deprecationwarning
+    def test_async_execution_error(self):
+        """Errors in asyncio subprocesses are raised as RuleErrors."""
+
+        async def run_rule(index, rule):
+            await rule.run_async()
+
+        with self.assertRaises(RuleError):
+            AsyncRuleScheduler([SubprocessRule(['false'])])(run_rule)
+
+    @ignore_deprecationwarning
+    def test_builder_asyncio_engine(self):
+        """Builder can use the asyncio engine."""
+
+        class TestBuilderEngine(Builder):
+
+            def __init__(self, conf_folder):
+                self.output = []
+                super().__init__(conf_folder)
+
+            def _get_rules(self):
+                return [
+                    SubprocessRule(['echo', 'a'], stdout_writer=self.output.append),
+                    PythonRule(self.output.append, ['b']),
+                ]
+
+        builder_instance = TestBuilderEngine(os.path.join('tests', 'builder_test'))
+        builder_instance(engine='asyncio')
+        self.assertEqual(builder_instance.output, ['a', 'b'])
+        with self.assertRaises(ValueError):
+            builder_instance(engine='invalid')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,870 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.spack- and
+buildrules.spackutils-modules."""
+
+import os
+import sys
+import json
+import shutil
+import unittest
+import tempfile
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import sh
+
+from buildrules.spack import SpackBuilder, SpackInstallError
+from buildrules.spackutils import (get_spack_revision, get_spack_schemas, InstalledSpecIndex,
+                                   SpackQueryServer, SpackQueryError, find_files,
+                                   get_package_repos, get_repo_revision)
+from buildrules.common.scheduler import RuleScheduler
+from buildrules.common.resources import ResourcePool
+from buildrules.common.utils import write_yaml, load_yaml, write_file_atomic
+
+from .common import CacheDirTestCase, ignore_deprecationwarning
+
+FAKE_SCHEMA = """
+schema = {{'title': '{0} schema {1}'}}
+"""
+
+class TestSpack(CacheDirTestCase):
+    """This class tests various features of the buildrules.spack-module."""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self._unload_spack)
+        self._spack_root = os.path.join(self._tmpdir.name, 'spack_root')
+        os.makedirs(os.path.join(self._spack_root, 'lib', 'spack', 'external'))
+        os.makedirs(os.path.join(self._spack_root, 'lib', 'spack', 'spack', 'schema'))
+        os.makedirs(os.path.join(self._spack_root, '.git', 'refs', 'heads'))
+        self._write('lib/spack/spack/__init__.py', 'spack_version_info = (0, 16, 1)\n')
+        self._write('lib/spack/spack/config.py', 'import spack.schema\n')
+        self._write(
+            'lib/spack/spack/schema/__init__.py',
+            'from spack.schema import config, modules, packages\n')
+        self._write_schemas('v1')
+        self._write('.git/HEAD', 'ref: refs/heads/develop\n')
+        self._write('.git/refs/heads/develop', 'a' * 40 + '\n')
+
+    @staticmethod
+    def _unload_spack():
+        for module in list(sys.modules):
+            if module == 'spack' or module.startswith('spack.'):
+                del sys.modules[module]
+
+    def _write(self, path, contents):
+        with open(os.path.join(self._spack_root, path), 'w') as output_file:
+            output_file.write(contents)
+
+    def _write_schemas(self, version):
+        for schema in ['config', 'modules', 'packages']:
+            self._write(
+                'lib/spack/spack/schema/{0}.py'.format(schema),
+                FAKE_SCHEMA.format(schema, version))
+
+    def _get_schemas(self):
+        schemas = get_spack_schemas(self._spack_root)
+        self._unload_spack()
+        return schemas
+
+    def test_spack_revision(self):
+        """Version and commit are read without importing Spack."""
+        revision = get_spack_revision(self._spack_root)
+        self.assertEqual(revision['version'], '0.16.1')
+        self.assertEqual(revision['commit'], 'a' * 40)
+        self._write('.git/HEAD', 'b' * 40 + '\n')
+        self.assertEqual(get_spack_revision(self._spack_root)['commit'], 'b' * 40)
+
+    def test_repo_revision(self):
+        """Revision of a package repository contains the commit of the git
+        repository that contains it."""
+        repo_path = os.path.join(self._spack_root, 'var', 'repo')
+        os.makedirs(os.path.join(repo_path, 'packages'))
+        revision = get_repo_revision(repo_path)
+        self.assertEqual(revision['commit'], 'a' * 40)
+        self._write('var/repo/packages/package.py', 'pass\n')
+        self.assertNotEqual(get_repo_revision(repo_path)['packages'], revision['packages'])
+        os.makedirs(os.path.join(self._spack_root, 'etc', 'spack'))
+        self._write('etc/spack/repos.yaml', 'repos:\n- $spack/var/repo\n')
+        self.assertEqual(
+            get_package_repos([os.path.join(self._spack_root, 'etc', 'spack')],
+                              self._spack_root),
+            [repo_path])
+
+    def test_spack_schema_cache(self):
+        """Schemas are loaded from the cache until Spack's revision changes."""
+        schemas = self._get_schemas()
+        self.assertEqual(schemas[0], {'title': 'config schema v1'})
+        self.assertEqual(schemas[2], {'title': 'packages schema v1'})
+
+        self._write_schemas('v2')
+        with mock.patch('buildrules.spackutils._import_spack_schemas') as import_schemas:
+            self.assertEqual(self._get_schemas(), schemas)
+        import_schemas.assert_not_called()
+
+        self._write('.git/refs/heads/develop', 'c' * 40 + '\n')
+        self.assertEqual(self._get_schemas()[1], {'title': 'modules schema v2'})
+
+# Stands in for 'spack module lmod refresh'. It regenerates the
+# hierarchical modulefiles of the installed packages with new modification
+# times and deletes the whole module tree first if it is given
+# '--delete-tree'.
+FAKE_REFRESH = """
+import os
+import sys
+import shutil
+import time
+lmod_root = {lmod_root!r}
+if '--delete-tree' in sys.argv:
+    shutil.rmtree(lmod_root)
+for package in {packages!r}:
+    modulefile = os.path.join(lmod_root, 'linux-centos7-x86_64', 'Core', package)
+    os.makedirs(os.path.dirname(modulefile), exist_ok=True)
+    with open(modulefile, 'w') as output_file:
+        output_file.write('load("{{0}}")\\n'.format(package))
+    mtime = time.time_ns() + 10**9
+    os.utime(modulefile, ns=(mtime, mtime))
+"""
+
+class TestSpackBuilder(CacheDirTestCase):
+    """This class tests the build rules created by SpackBuilder."""
+
+    def setUp(self):
+        super().setUp()
+        self._conf_folder = os.path.join(self._tmpdir.name, 'configs', 'spack')
+        os.makedirs(self._conf_folder)
+        self._write_config('config.yaml', {'config': {}})
+        self._write_config('modules.yaml', {'modules': {}})
+        self._write_config('packages.yaml', {'packages': {}})
+        self._build_config = {
+            'compilers': [],
+            'packages': [
+                {'name': 'package{0}'.format(index), 'version': '1.0'}
+                for index in range(5)
+            ],
+        }
+
+    def _write_config(self, filename, contents):
+        write_yaml(os.path.join(self._conf_folder, filename), contents)
+
+    @ignore_deprecationwarning
+    def _get_builder(self, **build_config):
+        self._build_config.update(build_config)
+        self._write_config('build_config.yaml', self._build_config)
+        return SpackBuilder(self._conf_folder, deployers=[])
+
+    def _get_install_rules(self, **build_config):
+        with mock.patch('buildrules.spack.get_host_cpus', return_value=32):
+            builder = self._get_builder(**build_config)
+            rules = builder._get_package_install_rules()
+        return rules, RuleScheduler.resolve_dependencies(rules)
+
+    def test_unlimited_installs(self):
+        """Packages are installed independently of each other by default."""
+        rules, dependencies = self._get_install_rules()
+        self.assertEqual(dependencies[1:], [{0}] * 5)
+        self.assertEqual(rules[1].resources['cpus'], 16)
+
+    def test_parallel_installs(self):
+        """Parallel installations are limited and share the CPUs of the host."""
+        rules, dependencies = self._get_install_rules(parallel_installs=2)
+        self.assertEqual(dependencies[1:], [{0}] * 5)
+        self.assertEqual(rules[1].resources['cpus'], 16)
+        self.assertEqual(rules[1].resources['scratch'], 'spack-install')
+        self.assertIn('16', rules[1].get_plan()['command'])
+
+        rules, dependencies = self._get_install_rules(parallel_installs=4)
+        self.assertEqual(dependencies[5], {0})
+        self.assertEqual(rules[5].resources['cpus'], 8)
+        builder = self._get_builder()
+        self.assertEqual(builder._get_scratch_limits(), {'spack-install': 4})
+
+        # Installations that finish early do not hold back the others
+        capacity = ResourcePool(cpus=32, memory=0)
+        for scratch, limit in builder._get_scratch_limits().items():
+            capacity.set_scratch_limit(scratch, limit)
+        for rule in rules[1:5]:
+            self.assertTrue(capacity.acquire(rule.resources))
+        self.assertFalse(capacity.acquire(rules[5].resources))
+        capacity.release(rules[3].resources)
+        self.assertTrue(capacity.acquire(rules[5].resources))
+
+    def test_parallel_installs_without_locks(self):
+        """Packages are installed one at a time if Spack locks are disabled."""
+        self._write_config('config.yaml', {'config': {'locks': False}})
+        rules, dependencies = self._get_install_rules(parallel_installs=4)
+        self.assertEqual(dependencies[1:], [{0}] * 5)
+        self.assertEqual(rules[1].resources['cpus'], 16)
+        self.assertEqual(self._get_builder()._get_scratch_limits(), {'spack-install': 1})
+
+    def test_install_stamp(self):
+        """Install stamps do not depend on the number of build jobs and
+        they are used only if the package is still installed."""
+        rules, _ = self._get_install_rules()
+        with mock.patch('buildrules.spack.get_host_cpus', return_value=4):
+            builder = self._get_builder()
+            other_rules = builder._get_package_install_rules()
+        self.assertNotEqual(rules[1].get_plan()['command'], other_rules[1].get_plan()['command'])
+        self.assertEqual(rules[1].fingerprint(), other_rules[1].fingerprint())
+        self.assertNotEqual(rules[1].fingerprint(), other_rules[2].fingerprint())
+
+        spack_sh = mock.Mock(return_value=json.dumps(
+            {'prefixes': ['/opt/package0', None, None, None, None], 'errors': {}}))
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh):
+            self.assertTrue(other_rules[1].stamp_is_valid())
+            self.assertFalse(other_rules[2].stamp_is_valid())
+        spack_sh.assert_called_once()
+        self.assertIn('package4@1.0 arch=linux-None-None', spack_sh.call_args[0][2])
+
+    def test_install_stamp_repos(self):
+        """Install stamps change with custom package repositories and the
+        configuration of Spack's user scope."""
+        repo_path = os.path.join(self._conf_folder, 'repo')
+        package_file = os.path.join(repo_path, 'packages', 'package0', 'package.py')
+        os.makedirs(os.path.dirname(package_file))
+        write_file_atomic(package_file, 'class Package0:\n    pass\n')
+        self._write_config('repos.yaml', {'repos': ['repo']})
+        home = os.path.join(self._conf_folder, 'home')
+        with mock.patch.dict(os.environ, {'HOME': home}):
+            rules, _ = self._get_install_rules()
+            write_file_atomic(package_file, 'class Package0:\n    version = 2\n')
+            repo_rules, _ = self._get_install_rules()
+            self.assertNotEqual(rules[1].fingerprint(), repo_rules[1].fingerprint())
+
+            fingerprint = repo_rules[1].fingerprint()
+            os.makedirs(os.path.join(home, '.spack'))
+            write_yaml(os.path.join(home, '.spack', 'packages.yaml'), {'packages': {}})
+            self.assertNotEqual(repo_rules[1].fingerprint(), fingerprint)
+
+    def test_environment_install(self):
+        """Packages are concretized once and installed from an environment."""
+        with mock.patch('buildrules.spack.get_host_cpus', return_value=32):
+            builder = self._get_builder(install_mode='environment', parallel_installs=2)
+            rules = builder._get_environment_install_rules()
+        commands = [rule.get_plan().get('command', []) for rule in rules]
+        self.assertEqual(
+            [command.index('-e') for command in commands if 'spack' in command],
+            [3, 3])
+        self.assertEqual(
+            [command[5] for command in commands if 'spack' in command],
+            ['concretize', 'install'])
+        self.assertEqual(rules[4].resources['cpus'], 16)
+        self.assertEqual(RuleScheduler.resolve_dependencies(rules)[4], {3})
+        self.assertEqual(RuleScheduler.resolve_dependencies(rules)[5], {4})
+
+        environment_folder = builder._get_environment_folder()
+        rules[1]()
+        environment = load_yaml(os.path.join(environment_folder, 'spack.yaml'))
+        self.assertEqual(
+            environment['spack']['specs'][0],
+            'package0@1.0 arch=linux-None-None')
+        self.assertEqual(len(environment['spack']['specs']), 5)
+
+        # Environment is concretized again if spack.lock has been removed
+        # or if it was not written by a completed concretization
+        self.assertFalse(rules[2].stamp_is_valid())
+        with open(os.path.join(environment_folder, 'spack.lock'), 'w') as lock_file:
+            lock_file.write('{}')
+        self.assertFalse(rules[2].stamp_is_valid())
+        rules[3]()
+        self.assertTrue(rules[2].stamp_is_valid())
+        os.remove(os.path.join(environment_folder, 'spack.lock'))
+        self.assertFalse(rules[2].stamp_is_valid())
+
+        # Recorded key is removed when the inputs of concretization change
+        with open(os.path.join(environment_folder, 'spack.lock'), 'w') as lock_file:
+            lock_file.write('{}')
+        self._write_config('packages.yaml', {'packages': {'all': {}}})
+        self.assertFalse(rules[2].stamp_is_valid())
+        rules[1]()
+        self.assertFalse(os.path.exists(builder._get_environment_key_file(environment_folder)))
+        self._write_config('packages.yaml', {'packages': {}})
+        self.assertFalse(rules[2].stamp_is_valid())
+
+    @ignore_deprecationwarning
+    def test_environment_per_conf_folder(self):
+        """Configuration folders do not share environments or spec files."""
+        builder = self._get_builder(install_mode='environment')
+        other_conf_folder = self._conf_folder + '_other'
+        shutil.copytree(self._conf_folder, other_conf_folder)
+        other_builder = SpackBuilder(other_conf_folder, deployers=[])
+        self.assertNotEqual(
+            builder._get_environment_folder(), other_builder._get_environment_folder())
+        package_config = self._build_config['packages'][0]
+        self.assertNotEqual(
+            builder._get_spec_file(package_config), other_builder._get_spec_file(package_config))
+
+    def test_environment_install_extra_flags(self):
+        """Extra flags are only given to the installation of their packages."""
+        self._build_config['packages'][1]['extra_flags'] = ['--keep-stage']
+        self._build_config['packages'][3]['extra_flags'] = ['--keep-stage']
+        builder = self._get_builder(install_mode='environment')
+        rules = builder._get_environment_install_rules()
+        install_commands = [rule.get_plan()['command'] for rule in rules[4:-1]]
+        self.assertEqual(len(install_commands), 2)
+        self.assertNotIn('--keep-stage', install_commands[0])
+        self.assertEqual(
+            install_commands[0][-3:],
+            ['package{0}@1.0 arch=linux-None-None'.format(index) for index in [0, 2, 4]])
+        self.assertEqual(
+            install_commands[1][-3:],
+            ['--keep-stage'] + [
+                'package{0}@1.0 arch=linux-None-None'.format(index) for index in [1, 3]])
+        self.assertEqual(RuleScheduler.resolve_dependencies(rules)[6], {5})
+
+    def test_environment_install_failures(self):
+        """Failed installations are mapped back to the packages."""
+        builder = self._get_builder(install_mode='environment')
+        environment_folder = builder._get_environment_folder()
+        packages = self._build_config['packages']
+
+        def check_install(installed_indices):
+            installed = json.dumps({
+                'package{0}@1.0 arch=linux-None-None'.format(index): index in installed_indices
+                for index in range(5)})
+            spack_sh = mock.Mock(return_value='==> Warning\n' + installed)
+            with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh):
+                builder._check_environment_install(environment_folder, packages)
+            script = spack_sh.call_args[0][2]
+            self.assertIn(json.dumps(environment_folder), script)
+            self.assertIn('"package4@1.0 arch=linux-None-None"', script)
+
+        with self.assertRaisesRegex(
+                SpackInstallError, 'not installed: package1@1.0, package3@1.0, package4@1.0'):
+            check_install([0, 2])
+        check_install(range(5))
+
+    def test_concretization_cache(self):
+        """Packages are installed from cached concrete specs."""
+        builder = self._get_builder(concretization_cache=True)
+        rules = builder._get_package_install_rules()
+        dependencies = RuleScheduler.resolve_dependencies(rules)
+        self.assertEqual(len(rules), 11)
+        self.assertEqual(dependencies[1:3], [{0}, {1}])
+        package_config = self._build_config['packages'][0]
+        spec_file = builder._get_spec_file(package_config)
+        self.assertEqual(rules[2].get_plan()['command'][-2:], ['-f', spec_file])
+
+        spack_sh = mock.Mock(return_value='==> Warning: deprecated\n{"spec": "concrete"}\n')
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh):
+            builder._concretize_spec(package_config, spec_file)
+            builder._concretize_spec(package_config, spec_file)
+            self.assertEqual(spack_sh.call_count, 1)
+            spack_sh.assert_called_with(
+                'spec', '--json', 'package0@1.0', 'arch=linux-None-None')
+            with open(spec_file, 'r') as concrete_spec:
+                self.assertEqual(concrete_spec.read(), '{"spec": "concrete"}')
+
+            self._write_config('packages.yaml', {'packages': {'all': {}}})
+            builder._concretize_spec(package_config, spec_file)
+            self.assertEqual(spack_sh.call_count, 2)
+
+            # Output without a concrete spec is not cached
+            self._write_config('packages.yaml', {'packages': {}, 'other': {}})
+            spack_sh.return_value = '==> Error: concretization failed\n'
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    builder._concretize_spec(package_config, spec_file)
+            self.assertEqual(spack_sh.call_count, 4)
+
+    def test_concretization_key_repos(self):
+        """Concretization key changes with custom package repositories."""
+        builder = self._get_builder(concretization_cache=True)
+        package_config = self._build_config['packages'][0]
+        key = builder._get_concretization_key(package_config)
+
+        repo_path = os.path.join(self._conf_folder, 'repo')
+        package_file = os.path.join(repo_path, 'packages', 'package0', 'package.py')
+        os.makedirs(os.path.dirname(package_file))
+        write_file_atomic(package_file, 'class Package0:\n    pass\n')
+        self._write_config('repos.yaml', {'repos': ['repo']})
+        builder = self._get_builder(concretization_cache=True)
+        repo_key = builder._get_concretization_key(package_config)
+        self.assertNotEqual(repo_key, key)
+        self.assertEqual(list(builder._get_repo_revisions()), [repo_path])
+        self.assertEqual(builder._get_concretization_key(package_config), repo_key)
+
+        write_file_atomic(package_file, 'class Package0:\n    version = 2\n')
+        builder = self._get_builder(concretization_cache=True)
+        self.assertNotEqual(builder._get_concretization_key(package_config), repo_key)
+
+    def test_skip_installed(self):
+        """Install rules are not created for installed packages."""
+        def installed_spec(index, target='haswell', compiler_version='9.3.0'):
+            return {
+                'name': 'package{0}'.format(index),
+                'version': '1.0',
+                'arch': {'platform': 'linux', 'platform_os': 'centos7',
+                         'target': {'name': target}},
+                'compiler': {'name': 'gcc', 'version': compiler_version},
+            }
+        installed = json.dumps([
+            installed_spec(1),
+            installed_spec(2, target='skylake'),
+            installed_spec(3),
+            installed_spec(4, compiler_version='10.2.0'),
+        ])
+        for package_config in self._build_config['packages']:
+            package_config['variants'] = ['%gcc@9.3.0']
+        builder = self._get_builder(
+            skip_installed=True,
+            target_architecture={'platform': 'linux', 'os': 'centos7', 'target': 'haswell'})
+        spack_sh = mock.Mock(return_value=installed)
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                mock.patch('buildrules.spack.shutil.which', return_value='/bin/spack'):
+            builder._install_counts = {'installed': 0, 'to_build': 0}
+            rules = builder._get_package_install_rules()
+            builder._get_package_install_rules()
+        spack_sh.assert_called_once_with('find', '--json')
+        self.assertEqual(
+            [rule.get_plan()['command'][-3] for rule in rules[1:]],
+            ['package0@1.0', 'package2@1.0', 'package4@1.0'])
+        self.assertEqual(builder._install_counts, {'installed': 4, 'to_build': 6})
+
+    def test_copy_licenses(self):
+        """License links of all packages are replaced by copies."""
+        licensed = [
+            {'name': 'package0', 'version': '1.0', 'licenses': ['license.dat', '*.lic']},
+            {'name': 'package1', 'version': '1.0', 'licenses': ['missing.dat']},
+        ]
+        builder = self._get_builder()
+        prefixes = [os.path.join(self._conf_folder, 'prefix{0}'.format(index))
+                    for index in range(2)]
+        source = os.path.join(self._conf_folder, 'license_source')
+        with open(source, 'w') as license_file:
+            license_file.write('license')
+        os.makedirs(os.path.join(prefixes[0], 'etc', 'licenses'))
+        os.makedirs(prefixes[1])
+        links = [os.path.join(prefixes[0], 'license.dat'),
+                 os.path.join(prefixes[0], 'etc', 'licenses', 'other.lic')]
+        for link in links:
+            os.symlink(source, link)
+
+        spack_sh = mock.Mock(return_value='==> Warning\n' + json.dumps(
+            {'prefixes': prefixes, 'errors': {}}))
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh):
+            builder._copy_licenses(licensed)
+        self.assertEqual(spack_sh.call_count, 1)
+        self.assertIn('["package0@1.0", "package1@1.0"]', spack_sh.call_args[0][2])
+        for link in links:
+            self.assertFalse(os.path.islink(link))
+            with open(link, 'r') as license_file:
+                self.assertEqual(license_file.read(), 'license')
+
+        spack_sh.return_value = json.dumps(
+            {'prefixes': [prefixes[0], None], 'errors': {'package1@1.0': 'lookup failed'}})
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                self.assertLogs('SpackBuilder', 'WARNING') as logs:
+            with self.assertRaisesRegex(Exception, 'specs: package1@1.0'):
+                builder._copy_licenses(licensed)
+        self.assertIn("Could not look up spec 'package1@1.0': lookup failed", logs.output[0])
+
+    def _write_modulefile(self, lmod_root, path, contents):
+        modulefile = os.path.join(lmod_root, 'linux-centos7-x86_64', path)
+        os.makedirs(os.path.dirname(modulefile), exist_ok=True)
+        with open(modulefile, 'w') as output_file:
+            output_file.write(contents)
+        return modulefile
+
+    def test_flatten_modules(self):
+        """Flat modulefiles are updated incrementally."""
+        builder = self._get_builder()
+        lmod_root = os.path.join(self._conf_folder, 'lmod')
+        self._write_modulefile(
+            lmod_root, 'Core/gcc/9.3.0.lua', 'load("gcc")\nprepend_path("MODULEPATH", "x")\n')
+        hdf5 = self._write_modulefile(
+            lmod_root, 'openmpi/4.0.5/Core/hdf5/1.10.7.lua', 'load("hdf5")\n')
+        stale = self._write_modulefile(lmod_root, 'all/old/1.0.lua', 'load("old")\n')
+        flat_gcc = os.path.join(lmod_root, 'linux-centos7-x86_64', 'all', 'gcc', '9.3.0.lua')
+        flat_hdf5 = os.path.join(lmod_root, 'linux-centos7-x86_64', 'all', 'hdf5', '1.10.7.lua')
+
+        with self.assertLogs('SpackBuilder', 'INFO') as logs:
+            self.assertEqual(
+                builder._copy_all_modules(lmod_root),
+                {'created': 2, 'updated': 0, 'removed': 1, 'unchanged': 0})
+        self.assertIn(
+            'Copied following modules to {0}:'.format(os.path.dirname(os.path.dirname(flat_gcc))),
+            logs.output[0])
+        self.assertFalse(os.path.exists(os.path.dirname(stale)))
+        with open(flat_gcc, 'r') as modulefile:
+            self.assertEqual(modulefile.read(), 'load("gcc")\n')
+        self.assertEqual(os.stat(flat_gcc).st_mode & 0o777, 0o644)
+
+        self.assertEqual(
+            builder._copy_all_modules(lmod_root),
+            {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 2})
+
+        # Sources regenerated with new modification times
+        self._write_modulefile(
+            lmod_root, 'Core/gcc/9.3.0.lua', 'load("gcc")\nprepend_path("MODULEPATH", "y")\n')
+        self._write_modulefile(
+            lmod_root, 'openmpi/4.0.5/Core/hdf5/1.10.7.lua', 'load("hdf5", "mpi")\n')
+        os.utime(hdf5, ns=(0, 10**18))
+        self.assertEqual(
+            builder._copy_all_modules(lmod_root),
+            {'created': 0, 'updated': 1, 'removed': 0, 'unchanged': 1})
+        with open(flat_hdf5, 'r') as modulefile:
+            self.assertEqual(modulefile.read(), 'load("hdf5", "mpi")\n')
+
+        os.remove(hdf5)
+        self.assertEqual(
+            builder._copy_all_modules(lmod_root),
+            {'created': 0, 'updated': 0, 'removed': 1, 'unchanged': 1})
+        self.assertFalse(os.path.exists(os.path.dirname(flat_hdf5)))
+
+    def _refresh_modules(self, builder, lmod_root, packages):
+        fake_refresh = os.path.join(self._conf_folder, 'fake_refresh.py')
+        with open(fake_refresh, 'w') as script:
+            script.write(FAKE_REFRESH.format(lmod_root=lmod_root, packages=packages))
+        builder._spack_cmd = [sys.executable, fake_refresh]
+        builder._confreader['config']['config']['module_roots'] = {'lmod': lmod_root}
+        for rule in builder._get_recreate_modules_rules():
+            rule()
+
+    def test_refresh_and_flatten_modules(self):
+        """Refreshing the hierarchical modules keeps the flat modulefiles,
+        so unchanged modulefiles are not rewritten, and flat modulefiles of
+        uninstalled packages are removed."""
+        builder = self._get_builder()
+        lmod_root = os.path.join(self._conf_folder, 'lmod')
+        self._write_modulefile(lmod_root, 'Core/gcc/9.3.0.lua', 'load("gcc/9.3.0.lua")\n')
+        self._write_modulefile(lmod_root, 'Core/hdf5/1.10.7.lua', 'load("hdf5/1.10.7.lua")\n')
+        flat_gcc = os.path.join(lmod_root, 'linux-centos7-x86_64', 'all', 'gcc', '9.3.0.lua')
+        flat_hdf5 = os.path.join(lmod_root, 'linux-centos7-x86_64', 'all', 'hdf5', '1.10.7.lua')
+        builder._copy_all_modules(lmod_root)
+        flat_inode = os.stat(flat_gcc).st_ino
+
+        self._refresh_modules(builder, lmod_root, ['gcc/9.3.0.lua'])
+        self.assertFalse(os.path.exists(os.path.join(lmod_root, 'linux-centos7-x86_64', 'all')))
+        self.assertEqual(
+            builder._copy_all_modules(lmod_root),
+            {'created': 0, 'updated': 0, 'removed': 1, 'unchanged': 1})
+        self.assertEqual(os.stat(flat_gcc).st_ino, flat_inode)
+        self.assertFalse(os.path.exists(flat_hdf5))
+        self.assertFalse(os.path.exists(os.path.join(self._conf_folder, '.lmod-flat')))
+
+    def test_flatten_modules_overlap(self):
+        """Modulefiles that would be flattened into the same file raise an error."""
+        builder = self._get_builder()
+        lmod_root = os.path.join(self._conf_folder, 'lmod')
+        self._write_modulefile(lmod_root, 'Core/hdf5/1.10.7.lua', '')
+        self._write_modulefile(lmod_root, 'openmpi/4.0.5/Core/hdf5/1.10.7.lua', '')
+        with self.assertRaises(FileExistsError):
+            builder._copy_all_modules(lmod_root)
+
+    def test_compiler_rules(self):
+        """Compilers are added in batches. Compilers that are built with
+        Spack's default compiler are installed after the earlier compilers
+        have been added."""
+        builder = self._get_builder(compilers=[
+            {'name': 'gcc', 'version': '4.8.5', 'system_compiler': True},
+            {'name': 'gcc', 'version': '9.3.0', 'flags': {'cflags': '-O2'}},
+            {'name': 'intel', 'version': '19.1.1'},
+            {'name': 'llvm', 'version': '11.0.0', 'variants': ['%gcc@9.3.0']},
+        ])
+        rules = builder._get_compiler_install_rules()
+        descriptions = [
+            rule.get_plan().get('function', rule.get_plan().get('command', [None])[3:4])
+            for rule in rules if rule.get_plan()['type'] != 'LoggingRule'
+        ]
+        self.assertEqual(descriptions, [
+            'SpackBuilder._remove_compilers_file',
+            'SpackBuilder._add_compilers',
+            'SpackBuilder._set_compiler_flags',
+            ['install'],
+            'SpackBuilder._add_compilers',
+            'SpackBuilder._set_compiler_flags',
+            ['install'], ['install'],
+            'SpackBuilder._add_compilers',
+            'SpackBuilder._set_compiler_flags',
+            'SpackBuilder._show_compilers',
+        ])
+
+        compilers = self._build_config['compilers']
+        spack_sh = mock.Mock(return_value=json.dumps(
+            {'prefixes': ['/opt/gcc', None, '/opt/llvm', None], 'errors': {}}))
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                mock.patch.dict(os.environ, {'PATH': os.pathsep.join(['/usr/bin', '/missing'])}):
+            builder._add_compilers(compilers, add_default=True)
+        self.assertEqual(spack_sh.call_count, 2)
+        self.assertEqual(spack_sh.call_args[0],
+                         ('compiler', 'add', '/usr/bin', '/opt/gcc', '/opt/llvm'))
+
+        # Output of 'spack compiler add' is logged and failures do not stop
+        # the build
+        def compiler_add(*args, **kwargs):
+            if args[0] == 'python':
+                return json.dumps({'prefixes': ['/opt/gcc'], 'errors': {}})
+            kwargs['_out']('==> Added 1 new compiler\n')
+            raise sh.ErrorReturnCode_1('spack compiler add', b'', b'')
+        spack_sh = mock.Mock(side_effect=compiler_add)
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                self.assertLogs('SpackBuilder', 'INFO') as logs:
+            builder._add_compilers(compilers[1:2])
+        self.assertEqual(logs.output, [
+            'INFO:SpackBuilder:==> Added 1 new compiler',
+            "WARNING:SpackBuilder:'spack compiler add' failed with exit code 1.",
+        ])
+
+        # Failures to add the default compilers stop the build
+        spack_sh.reset_mock()
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                self.assertLogs('SpackBuilder', 'INFO'):
+            with self.assertRaises(sh.ErrorReturnCode):
+                builder._add_compilers(compilers[1:2], add_default=True)
+        self.assertEqual(spack_sh.call_args[0], ('compiler', 'add'))
+
+        # Failures caused by the installed compilers are only logged
+        def installed_compiler_add(*args, **kwargs):
+            if args[0] == 'python':
+                return json.dumps({'prefixes': ['/opt/gcc'], 'errors': {}})
+            if '/opt/gcc' in args:
+                raise sh.ErrorReturnCode_1('spack compiler add', b'', b'')
+            return ''
+        spack_sh = mock.Mock(side_effect=installed_compiler_add)
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                self.assertLogs('SpackBuilder', 'WARNING'):
+            builder._add_compilers(compilers[1:2], add_default=True)
+        self.assertEqual(spack_sh.call_count, 3)
+
+        # Compiler names that differ from package names
+        builder = self._get_builder(compilers=[
+            {'name': 'gcc', 'version': '4.8.5', 'system_compiler': True},
+            {'name': 'intel-parallel-studio', 'version': 'cluster.2019.3',
+             'dependencies': ['%gcc@4.8.5']},
+            {'name': 'llvm', 'version': '11.0.0', 'dependencies': ['%intel']},
+            {'name': 'gcc', 'version': '10.2.0', 'dependencies': ['%clang@11.0.0']},
+            {'name': 'nvhpc', 'version': '21.2', 'dependencies': ['%unknown']},
+        ])
+        functions = [
+            rule.get_plan().get('function', 'install')
+            for rule in builder._get_compiler_install_rules()
+            if rule.get_plan()['type'] != 'LoggingRule'
+        ]
+        self.assertEqual(functions[3:], [
+            'install',
+            'SpackBuilder._add_compilers', 'SpackBuilder._set_compiler_flags',
+            'install',
+            'SpackBuilder._add_compilers', 'SpackBuilder._set_compiler_flags',
+            'install',
+            'SpackBuilder._add_compilers', 'SpackBuilder._set_compiler_flags',
+            'install',
+            'SpackBuilder._add_compilers', 'SpackBuilder._set_compiler_flags',
+            'SpackBuilder._show_compilers',
+        ])
+
+    def test_compiler_flags(self):
+        """Flags of all compilers are set with one read and one write."""
+        builder = self._get_builder()
+        builder._compilers_file = os.path.join(self._conf_folder, 'compilers.yaml')
+        write_yaml(builder._compilers_file, {'compilers': [
+            {'compiler': {'spec': 'gcc@4.8.5', 'flags': {}, 'paths': {'cc': '/usr/bin/gcc'}}},
+            {'compiler': {'spec': 'gcc@9.3.0', 'flags': {}, 'paths': {'cc': '/opt/gcc'}}},
+        ]})
+        compilers = [
+            {'name': 'gcc', 'version': '9.3.0', 'flags': {'cflags': '-O2'}},
+            {'name': 'intel', 'version': '19.1.1', 'flags': {'cflags': '-O3'}},
+        ]
+        with mock.patch('buildrules.spackutils.load_yaml', wraps=load_yaml) as load, \
+                mock.patch('buildrules.spackutils.write_file_atomic',
+                           wraps=write_file_atomic) as write:
+            builder._set_compiler_flags(compilers)
+            builder._set_compiler_flags(compilers)
+            builder._show_compilers()
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(
+            load_yaml(builder._compilers_file)['compilers'][1]['compiler']['flags'],
+            {'cflags': '-O2'})
+
+        # Spack changes the file
+        write_yaml(builder._compilers_file, {'compilers': []})
+        self.assertEqual(builder._get_compilers().specs, [])
+
+    def test_query_server_routing(self):
+        """Only query commands are sent to the query server."""
+        builder = self._get_builder(query_server=True)
+        spack_sh = mock.Mock(return_value='added')
+        with mock.patch.object(SpackBuilder, '_get_spack_sh', return_value=spack_sh), \
+                mock.patch.object(SpackQueryServer, 'query', return_value='found') as query:
+            self.assertEqual(builder._spack_query('find', '--json'), 'found')
+            self.assertEqual(builder._spack_query('compiler', 'add'), 'added')
+        query.assert_called_once_with('find', '--json')
+        spack_sh.assert_called_once_with('compiler', 'add')
+
+        # Concurrent rules share one server
+        with mock.patch.object(SpackQueryServer, 'query', autospec=True,
+                               return_value='found') as query:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda _: builder._spack_query('find'), range(8)))
+        self.assertEqual({id(call[0][0]) for call in query.call_args_list},
+                         {id(builder._query_server)})
+
+        # Server is restarted after compilers change
+        builder._compilers_file = os.path.join(self._conf_folder, 'compilers.yaml')
+        with mock.patch.object(SpackQueryServer, 'stop') as stop:
+            builder._remove_compilers_file()
+            builder._set_compiler_flags([])
+        self.assertEqual(stop.call_count, 2)
+
+FAKE_SPACK = """
+import os
+import sys
+args = sys.argv[1:]
+os.execv(sys.executable, [sys.executable] + args[args.index('python') + 1:])
+"""
+
+FAKE_SPACK_MAIN = """
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout, redirect_stderr
+
+class SpackCommand:
+
+    def __init__(self, command):
+        self._command = command
+
+    def __call__(self, *args):
+        # Like Spack's SpackCommand, output and errors are captured
+        output = io.StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            print('==> Warning: Spack output that is not a response', file=sys.stderr)
+            if self._command == 'fail':
+                raise Exception('failed')
+            if self._command == 'hang':
+                time.sleep(60)
+            print('{0} {1} {2}'.format(self._command, ' '.join(args), os.getpid()))
+        return output.getvalue()
+"""
+
+class TestSpackQueryServer(unittest.TestCase):
+    """This class tests SpackQueryServer with a fake Spack."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        os.makedirs(os.path.join(tmpdir.name, 'spack'))
+        for path, contents in [('fake_spack.py', FAKE_SPACK),
+                               ('spack/__init__.py', ''),
+                               ('spack/main.py', FAKE_SPACK_MAIN)]:
+            with open(os.path.join(tmpdir.name, path), 'w') as output_file:
+                output_file.write(contents)
+        patcher = mock.patch.dict(os.environ, {'PYTHONPATH': tmpdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._server = SpackQueryServer(
+            [sys.executable, os.path.join(tmpdir.name, 'fake_spack.py'), '--config-scope', 'x'])
+        self.addCleanup(self._server.stop)
+
+    def test_queries(self):
+        """Queries are run in one process until the server is stopped."""
+        output = self._server.query('find', '--json').splitlines()
+        self.assertEqual(output[0], '==> Warning: Spack output that is not a response')
+        command, args, pid = output[1].split(' ')
+        self.assertEqual((command, args), ('find', '--json'))
+        with self.assertRaisesRegex(SpackQueryError, "'fail now' failed: failed"):
+            self._server.query('fail', 'now')
+        self.assertEqual(self._server.query('location', '-r').split(' ')[-1].strip(), pid)
+
+        self._server.stop()
+        self.assertNotEqual(self._server.query('location', '-r').split(' ')[-1].strip(), pid)
+
+    def test_query_timeout(self):
+        """Server that does not respond in time is killed."""
+        self._server._timeout = 1
+        pid = self._server.query('location', '-r').split(' ')[-1].strip()
+        with self.assertRaisesRegex(SpackQueryError, 'did not respond'):
+            self._server.query('hang')
+        self.assertNotEqual(self._server.query('location', '-r').split(' ')[-1].strip(), pid)
+
+class TestFindFiles(unittest.TestCase):
+    """This class tests the single-pass search of files."""
+
+    def test_find_files(self):
+        """All patterns are matched with one walk and links are not followed."""
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'a', 'b'))
+            for path in ['LICENSE', 'a/LICENSE', 'a/b/key.lic', 'a/b/other']:
+                open(os.path.join(root, path), 'w').close()
+            os.symlink(os.path.join(root, 'a'), os.path.join(root, 'link'))
+            matches = find_files(root, ['LICENSE', '*.lic', 'missing'])
+        self.assertEqual(
+            sorted(os.path.relpath(path, root) for path in matches['LICENSE']),
+            ['LICENSE', os.path.join('a', 'LICENSE')])
+        self.assertEqual(
+            [os.path.relpath(path, root) for path in matches['*.lic']],
+            [os.path.join('a', 'b', 'key.lic')])
+        self.assertEqual(matches['missing'], [])
+
+class TestInstalledSpecIndex(unittest.TestCase):
+    """This class tests the index of installed Spack specs."""
+
+    def setUp(self):
+        self._index = InstalledSpecIndex([
+            {
+                'name': 'openmpi',
+                'version': '4.0.5',
+                'arch': {'platform': 'linux', 'platform_os': 'centos7',
+                         'target': {'name': 'haswell'}},
+                'compiler': {'name': 'gcc', 'version': '9.3.0'},
+                'parameters': {'cuda': False, 'fabrics': ['ucx', 'psm2'],
+                               'schedulers': 'slurm'},
+            },
+            {'zlib': {'version': '1.2.11', 'parameters': {'shared': True}}},
+        ])
+
+    def test_satisfies(self):
+        """Installed specs satisfy exact versions, variants, compilers and
+        architectures."""
+        self.assertEqual(len(self._index), 2)
+        satisfies = self._index.satisfies
+        haswell = {'platform': 'linux', 'os': 'centos7', 'arch': 'haswell'}
+        self.assertTrue(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5',
+             'variants': ['~cuda fabrics=ucx,psm2 schedulers=slurm', '%gcc@9.3.0']},
+            haswell))
+        self.assertTrue(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3.0']},
+            {'platform': 'linux', 'os': 'centos7', 'target': 'haswell'}))
+        # Compiler and target architecture must be requested and match
+        self.assertFalse(satisfies({'name': 'openmpi', 'version': '4.0.5'}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc']}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3']}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%intel@19.1.1']}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3.0']}))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3.0']},
+            {'platform': 'linux', 'os': 'None', 'arch': 'haswell'}))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3.0']},
+            dict(haswell, arch='skylake')))
+        # Versions and variants must match exactly
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0', 'variants': ['%gcc@9.3.0']}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['+cuda %gcc@9.3.0']},
+            haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['fabrics=ucx %gcc@9.3.0']},
+            haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['%gcc@9.3.0'],
+             'dependencies': ['^ucx@1.9']},
+            haswell))
+        self.assertFalse(satisfies(
+            {'name': 'openmpi', 'version': '4.0.5', 'variants': ['cflags="-O3" %gcc@9.3.0']},
+            haswell))
+        # Old format of 'spack find --json' without architecture
+        self.assertFalse(satisfies(
+            {'name': 'zlib', 'version': '1.2.11', 'variants': ['+shared %gcc@9.3.0']}, haswell))
+        self.assertFalse(satisfies(
+            {'name': 'hdf5', 'version': '1.10.7', 'variants': ['%gcc@9.3.0']}, haswell))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.stamps-module."""
+
+import os
+import unittest
+
+from buildrules.common.builder import Builder
+from buildrules.common.rule import PythonRule, SubprocessRule
+from buildrules.common.stamps import StampStore
+
+from .common import CacheDirTestCase, ignore_deprecationwarning, example_function
+
+class TestStamps(CacheDirTestCase):
+    """This class tests various features of the buildrules.common.stamps-module."""
+
+    def test_stamp_store(self):
+        """Stamps can be added and removed."""
+        stamps = StampStore(os.path.join(self._tmpdir.name, 'stamps'))
+        self.assertNotIn('abcdef', stamps)
+        stamps.add('abcdef', 'test')
+        self.assertIn('abcdef', stamps)
+        stamps.remove('abcdef')
+        self.assertNotIn('abcdef', stamps)
+
+    def test_fingerprint(self):
+        """Fingerprints depend on the command and the inputs of a rule."""
+        input_file = os.path.join(self._tmpdir.name, 'input.txt')
+        with open(input_file, 'w') as input_f:
+            input_f.write('a')
+
+        def get_rule(command, config):
+            return SubprocessRule(command).use_stamp(files=[input_file], config=config)
+
+        fingerprint = get_rule(['echo', 'a'], {'a': 1}).fingerprint()
+        self.assertEqual(fingerprint, get_rule(['echo', 'a'], {'a': 1}).fingerprint())
+        self.assertNotEqual(fingerprint, get_rule(['echo', 'b'], {'a': 1}).fingerprint())
+        self.assertNotEqual(fingerprint, get_rule(['echo', 'a'], {'a': 2}).fingerprint())
+
+        with open(input_file, 'w') as input_f:
+            input_f.write('b')
+        self.assertNotEqual(fingerprint, get_rule(['echo', 'a'], {'a': 1}).fingerprint())
+
+        # Actions replace the command in the fingerprint
+        self.assertEqual(
+            SubprocessRule(['echo', '-n', 'a']).use_stamp(actions=['echo', 'a']).fingerprint(),
+            SubprocessRule(['echo', '-e', 'a']).use_stamp(actions=['echo', 'a']).fingerprint())
+
+        self.assertEqual(
+            PythonRule(example_function, [1]).fingerprint(),
+            PythonRule(example_function, [1]).fingerprint())
+        self.assertNotEqual(
+            PythonRule(example_function, [1]).fingerprint(),
+            PythonRule(example_function, [2]).fingerprint())
+
+    @ignore_deprecationwarning
+    def test_builder_skips_stamped_rules(self):
+        """Stamped rules are only run once."""
+
+        class TestBuilderStamps(Builder):
+
+            def __init__(self, conf_folder):
+                self.runs = []
+                super().__init__(conf_folder)
+
+            def _get_rules(self):
+                return [
+                    PythonRule(self.runs.append, ['stamped']).use_stamp(),
+                    PythonRule(self.runs.append, ['not stamped']),
+                    PythonRule(self.runs.append, ['checked']).use_stamp(
+                        check=lambda: 'removed' not in self.runs),
+                ]
+
+        builder_instance = TestBuilderStamps(os.path.join('tests', 'builder_test'))
+        builder_instance()
+        builder_instance()
+        self.assertEqual(
+            builder_instance.runs, ['stamped', 'not stamped', 'checked', 'not stamped'])
+        builder_instance(use_stamps=False)
+        self.assertEqual(builder_instance.runs.count('stamped'), 2)
+
+        # Stamped rule is run again if its result no longer exists
+        builder_instance.runs.append('removed')
+        builder_instance()
+        self.assertEqual(builder_instance.runs.count('stamped'), 2)
+        self.assertEqual(builder_instance.runs.count('checked'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
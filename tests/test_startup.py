@@ -0,0 +1,62 @@
+# -*- coding=utf-8 -*-
+"""These tests measure the startup of the buildrules-module with -X importtime."""
+
+import sys
+import unittest
+import subprocess
+
+HEAVY_MODULES = ['requests', 'sh', 'swiftclient', 'spack', 'jinja2']
+
+def get_import_times(code, top_level=False):
+    """Runs code in a new interpreter with -X importtime.
+
+    Args:
+        code (str): Python code to run.
+        top_level (bool): Only return modules that were not imported by
+            other modules. Default is False.
+
+    Returns:
+        dict: Cumulative import times of imported modules in microseconds.
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE, check=True).stderr.decode('utf-8')
+    import_times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, module = line.split('|')
+        if top_level and module.startswith('  '):
+            continue
+        try:
+            import_times[module.strip()] = int(cumulative)
+        except ValueError:
+            pass
+    return import_times
+
+class TestStartup(unittest.TestCase):
+    """This class tests the startup of the buildrules-module."""
+
+    def assertNoHeavyImports(self, import_times):
+        imported = {module.split('.')[0] for module in import_times}
+        self.assertEqual(imported.intersection(HEAVY_MODULES), set())
+
+    def test_import_buildrules(self):
+        """Importing buildrules does not import any builders."""
+        import_times = get_import_times('import buildrules; list(buildrules.BUILDERS)')
+        self.assertNotIn('buildrules.anaconda', import_times)
+        self.assertNotIn('buildrules.spack', import_times)
+        self.assertNoHeavyImports(import_times)
+
+    def test_import_builder(self):
+        """Selecting a builder does not import Spack or the heavy optional
+        dependencies."""
+        for builder in ['anaconda', 'ci', 'singularity']:
+            import_times = get_import_times(
+                'import buildrules; buildrules.BUILDERS[{0!r}]'.format(builder))
+            self.assertIn('buildrules.common.builder', import_times)
+            self.assertNotIn('buildrules.spack', import_times)
+            self.assertNoHeavyImports(import_times)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.timeline-module."""
+
+import os
+import json
+import unittest
+
+from buildrules.common.builder import Builder, rule_phase
+from buildrules.common.rule import PythonRule, LoggingRule
+from buildrules.common.timeline import RuleTimeline
+
+from .common import CacheDirTestCase, ignore_deprecationwarning, example_function
+
+class TestTimeline(CacheDirTestCase):
+    """This class tests various features of the buildrules.common.timeline-module."""
+
+    def test_chrome_trace(self):
+        """Recorded rules are exported as complete events."""
+        rule = PythonRule(example_function)
+        rule.phase = 'test_phase'
+        timeline = RuleTimeline('build')
+        timeline.record(0, rule, 10.0, 12.5, 'completed')
+        timeline.record(1, LoggingRule('test'), 12.5, 12.5, 'completed')
+
+        trace = timeline.get_chrome_trace()
+        self.assertEqual(len(trace['traceEvents']), 2)
+        event = trace['traceEvents'][0]
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['cat'], 'test_phase')
+        self.assertEqual(event['dur'], 2500000)
+        self.assertEqual(event['name'], 'PythonRule: example_function')
+        self.assertEqual(event['args']['status'], 'completed')
+
+        summary = timeline.get_summary()
+        self.assertIn('test_phase', summary[2])
+
+    @ignore_deprecationwarning
+    def test_builder_trace(self):
+        """Builder writes a trace with the phases of the rules."""
+
+        class TestBuilderTrace(Builder):
+
+            @rule_phase
+            def _get_first_rules(self):
+                return [PythonRule(example_function), LoggingRule('first')]
+
+            def _get_rules(self):
+                return self._get_first_rules() + [LoggingRule('second')]
+
+        trace_file = os.path.join(self._tmpdir.name, 'trace.json')
+        builder_instance = TestBuilderTrace(os.path.join('tests', 'builder_test'))
+        builder_instance(trace_file=trace_file)
+
+        with open(trace_file, 'r') as trace_f:
+            trace = json.load(trace_f)
+        self.assertEqual(
+            [event['cat'] for event in trace['traceEvents']],
+            ['_get_first_rules', '_get_first_rules', 'None'])
+
+    @ignore_deprecationwarning
+    def test_builder_trace_rotation(self):
+        """Builds write traces with unique names into the cache folder and
+        only the newest traces are kept."""
+
+        class TestBuilderTraceRotation(Builder):
+
+            MAX_TRACES = 2
+
+            def _get_rules(self):
+                return [LoggingRule('rule')]
+
+        builder_instance = TestBuilderTraceRotation(os.path.join('tests', 'builder_test'))
+        trace_dir = os.path.join(self._tmpdir.name, 'none', 'traces')
+        traces = []
+        for _ in range(3):
+            builder_instance()
+            traces.append(sorted(set(os.listdir(trace_dir)) - set(traces))[0])
+        self.assertEqual(sorted(os.listdir(trace_dir)), sorted(traces[1:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding=utf-8 -*-
+"""These tests test various features of the buildrules.common.validators-module."""
+
+import copy
+import unittest
+from unittest import mock
+from jsonschema.exceptions import ValidationError, SchemaError
+
+from buildrules.common import validators
+from buildrules.common.validators import get_validator, validate, clear_validators
+
+from .common import EXAMPLE_SCHEMAS
+
+class TestValidators(unittest.TestCase):
+    """This class tests various features of the buildrules.common.validators-module."""
+
+    def setUp(self):
+        clear_validators()
+        self.addCleanup(clear_validators)
+
+    def test_validator_reuse(self):
+        """Validator is created only once for equal schemas."""
+        schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+        with mock.patch.object(
+                validators, 'validator_for', wraps=validators.validator_for) as validator_for:
+            validator = get_validator(schema)
+            self.assertIs(get_validator(schema), validator)
+            self.assertEqual(validator_for.call_count, 1)
+            self.assertIs(get_validator(copy.deepcopy(schema)), validator)
+            self.assertEqual(validator_for.call_count, 1)
+            schema['required'].append('missing_field')
+            self.assertIsNot(get_validator(schema), validator)
+            self.assertEqual(validator_for.call_count, 2)
+            with self.assertRaises(ValidationError):
+                validate({'method': 'rsync', 'delete': False,
+                          'set_sbit': True, 'target_host': 'host'}, schema)
+
+    def test_validate(self):
+        """Invalid instances and schemas raise errors like jsonschema.validate."""
+        schema = copy.deepcopy(EXAMPLE_SCHEMAS['deployment_config'])
+        validate({'method': 'rsync', 'delete': False,
+                  'set_sbit': True, 'target_host': 'host'}, schema)
+        with self.assertRaises(ValidationError):
+            validate({'method': 'rsync'}, schema)
+        with self.assertRaises(SchemaError):
+            validate({}, {'type': 'invalid_type'})
+
+if __name__ == '__main__':
+    unittest.main()
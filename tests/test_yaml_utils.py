@@ -0,0 +1,58 @@
+# -*- coding=utf-8 -*-
+"""These tests test the YAML helpers of the buildrules.common.utils-module."""
+
+import unittest
+import yaml
+
+from buildrules.common.utils import (YAMLDumper, dump_yaml, parse_yaml,
+                                     get_formatted_yaml, indent_sequences)
+
+EXAMPLE_DOCUMENTS = [
+    {
+        'environments': {
+            'anaconda3': {
+                'name': 'anaconda3',
+                'version': '2020.07',
+                'channels': ['conda-forge', 'defaults'],
+                'dependencies': [
+                    'numpy=1.19', 'scipy',
+                    {'pip': ['tensorflow==2.3.0', '- not an item']},
+                ],
+                'extra': [[1, 2], [], {}, None, True, 'yes', '1.0'],
+            },
+        },
+    },
+    [{'a': ['b', {'c': ['d']}]}, ['e', ['f']]],
+    {'multiline': 'first line\nsecond line:\n- third', 'empty': [], 'key:': ['value:']},
+]
+
+class TestYAMLUtils(unittest.TestCase):
+    """This class tests the YAML helpers of the buildrules.common.utils-module."""
+
+    def test_dump_yaml_indentation(self):
+        """dump_yaml produces the same output as YAMLDumper."""
+        for document in EXAMPLE_DOCUMENTS:
+            expected = yaml.dump(document, default_flow_style=False, Dumper=YAMLDumper)
+            self.assertEqual(dump_yaml(document), expected)
+            self.assertEqual(parse_yaml(get_formatted_yaml(document)), document)
+
+    def test_dump_yaml_without_indentation(self):
+        """dump_yaml without indentation matches yaml.SafeDumper."""
+        for document in EXAMPLE_DOCUMENTS:
+            expected = yaml.dump(document, default_flow_style=False, Dumper=yaml.SafeDumper)
+            self.assertEqual(dump_yaml(document, indent=False), expected)
+
+    def test_dump_yaml_complex_keys(self):
+        """Documents with complex keys are dumped correctly."""
+        document = {'x' * 200: ['a', 'b'], 'multi\nline': {'c': ['d']}}
+        self.assertEqual(parse_yaml(dump_yaml(document)), document)
+
+    def test_indent_sequences(self):
+        """Only sequences that are values of mappings are indented."""
+        self.assertEqual(
+            indent_sequences('a:\n- 1\n- b:\n  - 2\n  c: 3\nd: 4\n'),
+            'a:\n  - 1\n  - b:\n      - 2\n    c: 3\nd: 4\n')
+        self.assertEqual(indent_sequences('- - 1\n  - 2\n- 3\n'), '- - 1\n  - 2\n- 3\n')
+
+if __name__ == '__main__':
+    unittest.main()